@@ -51,6 +51,10 @@ def is_heavy_analysis_ready() -> bool:
     """
     Kontrollerar om heavy_analysis.db är redo att användas
     
+    Dashboard-tabellerna byts in atomiskt av 8_materialise_dashboard.py,
+    så när en generation är publicerad saknas de aldrig. Kontrollen är
+    konstant i tid (ingen COUNT(*) över actions).
+    
     Returns:
         bool: True om databasen finns och har nödvändiga tabeller
     """
@@ -63,15 +67,14 @@ def is_heavy_analysis_ready() -> bool:
         cursor = conn.cursor()
         
         # Kontrollera att actions-tabellen finns och har data
-        cursor.execute("SELECT COUNT(*) FROM actions LIMIT 1")
-        row_tmp = cursor.fetchone()
-        count_row = cast(tuple[int], row_tmp) if row_tmp else None
+        cursor.execute("SELECT 1 FROM actions LIMIT 1")
+        has_actions = cursor.fetchone() is not None
 
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='dashboard_summary'")
         dash_exists = cursor.fetchone() is not None
         
         conn.close()
-        return dash_exists and bool(count_row and count_row[0])
+        return dash_exists and has_actions
         
     except Exception as e:
         log.debug(f"Heavy analysis DB not ready: {e}")
@@ -2,19 +2,24 @@
 # scrape.py – hämtar HH för STARTING_DATE och segmenterar direkt + kör processing-scripts
 
 from __future__ import annotations
-import os, re, json, sqlite3, sys, subprocess, argparse
+import os, re, json, sqlite3, sys, subprocess, argparse, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
+from itertools import islice
 from pathlib import Path
 from typing import Iterable, Generator, List, Any, Tuple
 import logging
 from datetime import datetime
 
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
 # Import centraliserad path-hantering
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 from utils.paths import PROJECT_ROOT, POKER_DB, LOG_DIR, IS_RENDER
+from utils.hand_ids import canonical_hand_id
 
 # ────────────────────────────────────────────────────────────────
 # 0. projektrot + konstanter
@@ -166,11 +171,21 @@ def validate_hand(hand: dict[str, Any]) -> tuple[bool, str | None]:
     except Exception as e:
         return False, f"Valideringsfel: {str(e)}"
 
-def check_duplicate(con: sqlite3.Connection, hand_id: str) -> bool:
-    """Kontrollerar om en hand redan finns i databasen."""
-    cur = con.cursor()
-    cur.execute("SELECT 1 FROM hands WHERE id = ?", (hand_id,))
-    return cur.fetchone() is not None
+def existing_ids(con: sqlite3.Connection, hand_ids: List[str]) -> set[str]:
+    """Returnerar de hand-ID:n som redan finns i databasen (en query per 999 ID:n)."""
+    found: set[str] = set()
+    for off in range(0, len(hand_ids), 999):           # SQLite max antal bindningar
+        chunk = hand_ids[off:off + 999]
+        ph = ",".join("?" * len(chunk))
+        found.update(r[0] for r in con.execute(
+            f"SELECT id FROM hands WHERE id IN ({ph})", chunk))
+    return found
+
+def chunked(it: Iterable[Any], n: int) -> Generator[List[Any], None, None]:
+    """Grupperar en ström i listor om n element (sista kan vara kortare)."""
+    it = iter(it)
+    while chunk := list(islice(it, n)):
+        yield chunk
 
 # ────────────────────────────────────────────────────────────────
 # 3. script-runner
@@ -190,7 +205,20 @@ def find_processing_scripts() -> List[Path]:
     return sorted(scripts)
 
 def run_processing_scripts(skip_scripts: List[str] | None = None) -> bool:
-    """Kör alla processing-scripts i ordning. Returnerar True om alla lyckades."""
+    """Kör alla processing-scripts i ordning. Returnerar True om alla lyckades.
+
+    Default körs stegen in-process via scripts/etl_pipeline.py (delade
+    kopplingar, inga nya tolkar per batch). ETL_MODE=subprocess i config.txt
+    ger det gamla beteendet med en `python <script>` per steg. ETL_FUSED=Y
+    kör steg 3–6 som ett pass (enrich_actions.py, bara in-process).
+    """
+    if CFG.get("ETL_MODE", "inprocess").lower() != "subprocess":
+        scripts_dir = str(ROOT / "scrape_hh" / "scripts")
+        if scripts_dir not in sys.path:           # anropas en gång per batch
+            sys.path.append(scripts_dir)
+        import etl_pipeline  # noqa: E402
+        return etl_pipeline.run_all(skip_scripts, CFG.get("ETL_FUSED", "N").upper() == "Y")
+
     skip_scripts = skip_scripts or []
     scripts = find_processing_scripts()
     
@@ -253,11 +281,18 @@ class Api:
     organizer: str
     event: str
     limit: int = 50
+    workers: int = 1          # >1 = sidor hämtas parallellt (prefetch)
+    retries: int = 3          # omförsök per sida vid timeout/5xx
+    backoff: float = 1.0      # sekunder, dubblas per omförsök
 
     s: requests.Session = field(init=False, repr=False)
 
     def __post_init__(self):
         self.s = requests.Session()
+        # Delad session mellan fetch-trådarna → poolen måste rymma alla
+        adapter = HTTPAdapter(pool_maxsize=max(10, self.workers))
+        self.s.mount("https://", adapter)
+        self.s.mount("http://", adapter)
         self._login(
             os.getenv("BATTLE_API_USERNAME"),
             os.getenv("BATTLE_API_PASSWORD")
@@ -277,86 +312,168 @@ class Api:
                           "csrfmiddlewaretoken": token, "next": "/admin/"},
                     headers={"Referer": url}).raise_for_status()
 
-    def iter_hands(self, date: str) -> Generator[tuple[int, dict[str, Any]], None, None]:
+    def _page_url(self, epi: str, offset: int) -> str:
+        return (f"{self.base}/v1/solver/power_ranking/organizers/{self.organizer}"
+                f"/events/{self.event}/episodes/{epi}/hands"
+                f"?limit={self.limit}&offset={offset}")
+
+    def _get_page(self, url: str) -> requests.Response:
+        """GET med omförsök + exponentiell backoff vid timeout, anslutningsfel och 5xx."""
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.s.get(url, timeout=60)
+                if response.status_code < 500 or attempt == self.retries:
+                    return response
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                if attempt == self.retries:
+                    raise
+            time.sleep(self.backoff * 2 ** attempt)
+        raise RuntimeError("unreachable")
+
+    def _page_json(self, response: requests.Response, date: str, epi: str) -> dict[str, Any] | None:
+        """Kontrollerar HTTP-status och returnerar JSON, eller None om hämtningen ska avbrytas."""
+        if response.status_code == 404:
+            print(f"❌ Datum {date} hittades inte i API:et")
+            print(f"   Episod '{epi}' existerar inte")
+            print(f"   Prova ett tidigare datum som 2025-01-10")
+            return None
+        elif response.status_code != 200:
+            print(f"❌ HTTP {response.status_code}")
+            print(f"   Response: {response.text[:200]}...")
+            return None
+        return response.json()
+
+    @staticmethod
+    def _report_error(e: Exception, offset: int) -> None:
+        if isinstance(e, requests.exceptions.Timeout):
+            print(f"⏰ Timeout efter 60s på offset {offset}")
+            print(f"   API svarar för långsamt")
+        elif isinstance(e, requests.exceptions.ConnectionError):
+            print(f"❌ Anslutningsfel till API")
+            print(f"   Kontrollera internetanslutning")
+        elif isinstance(e, requests.exceptions.RequestException):
+            print(f"❌ Nätverksfel: {e}")
+        elif isinstance(e, ValueError):
+            print(f"❌ JSON-parsing fel: {e}")
+            print(f"   API returnerade ogiltig data")
+        else:
+            print(f"❌ Oväntat fel: {e}")
+
+    def _prefetch_pages(self, date: str, epi: str, start: int, count: int,
+                        next_url: str | None
+                        ) -> Generator[tuple[int, dict[str, Any]], None, str | None]:
+        """
+        Hämtar sidorna start..count med upp till `workers` anrop i luften och
+        levererar händerna i offset-ordning. Returnerar `next` från sista sidan
+        (episoden kan ha vuxit under tiden), oförändrat `next_url` om inga
+        sidor återstod (count har inte hunnit ikapp `next`) eller None vid fel/slut.
+        """
+        offsets = iter(range(start, count, self.limit))
+        with ThreadPoolExecutor(max_workers=self.workers,
+                                thread_name_prefix="hh-fetch") as pool:
+            pending = deque(
+                (off, pool.submit(self._get_page, self._page_url(epi, off)))
+                for off in islice(offsets, self.workers)
+            )
+            while pending:
+                offset, fut = pending.popleft()
+                print(f"   📡 API-anrop (offset {offset})...", end=" ", flush=True)
+                try:
+                    js = self._page_json(fut.result(), date, epi)
+                except Exception as e:
+                    js = None
+                    self._report_error(e, offset)
+                if js is None:
+                    for _, f in pending:
+                        f.cancel()
+                    return None
+
+                # Fyll på så att `workers` sidor alltid är i luften
+                nxt = next(offsets, None)
+                if nxt is not None:
+                    pending.append((nxt, pool.submit(self._get_page, self._page_url(epi, nxt))))
+
+                results = js.get("results", [])
+                print(f"✅ {len(results)} händer")
+                for i, h in enumerate(results):
+                    yield offset + i, h
+                next_url = js.get("next")
+        return next_url
+
+    def iter_hands(self, date: str, start_offset: int = 0
+                   ) -> Generator[tuple[int, dict[str, Any]], None, None]:
         epi = f"Ep{date}"
-        url = (f"{self.base}/v1/solver/power_ranking/organizers/{self.organizer}"
-               f"/events/{self.event}/episodes/{epi}/hands"
-               f"?limit={self.limit}&offset=0")
+        url = self._page_url(epi, start_offset)
         
         # Skriv ut första URL för transparens  
         print(f"🔗 Hämtar från: {url}")
+        if start_offset:
+            print(f"   Återupptar från offset {start_offset}")
+        if self.workers > 1:
+            print(f"   Prefetch: {self.workers} sidor parallellt")
         print()
         
         total_hands = 0
         first_page = True
         
         while url:
+            offset_match = re.search(r"offset=(\d+)", url)
+            if not offset_match:
+                break
+            offset = int(offset_match.group(1))
+            
+            if first_page:
+                print(f"   📡 API-anrop (första sidan)...", end=" ", flush=True)
+            else:
+                print(f"   📡 API-anrop (offset {offset})...", end=" ", flush=True)
+            
             try:
-                offset_match = re.search(r"offset=(\d+)", url)
-                if not offset_match:
-                    break
-                offset = int(offset_match.group(1))
-                
-                if first_page:
-                    print(f"   📡 API-anrop (första sidan)...", end=" ", flush=True)
-                else:
-                    print(f"   📡 API-anrop (offset {offset})...", end=" ", flush=True)
-                
-                response = self.s.get(url, timeout=60)
-                
-                # Kontrollera HTTP status
-                if response.status_code == 404:
-                    print(f"❌ Datum {date} hittades inte i API:et")
-                    print(f"   Episod '{epi}' existerar inte")
-                    print(f"   Prova ett tidigare datum som 2025-01-10")
+                js = self._page_json(self._get_page(url), date, epi)
+            except Exception as e:
+                self._report_error(e, offset)
+                break
+            if js is None:
+                break
+            
+            results = js.get("results", [])
+            
+            if first_page:
+                if not results and start_offset:
+                    print(f"✅ Inga nya händer efter offset {start_offset}")
                     break
-                elif response.status_code != 200:
-                    print(f"❌ HTTP {response.status_code}")
-                    print(f"   Response: {response.text[:200]}...")
+                elif not results:
+                    print(f"❌ Inga händer för {date}")
+                    print(f"   API svarade OK men episod '{epi}' är tom")
+                    print(f"   Datum kanske inte existerar än i systemet")
                     break
-                
-                js = response.json()
-                results = js.get("results", [])
-                
-                if first_page:
-                    if not results:
-                        print(f"❌ Inga händer för {date}")
-                        print(f"   API svarade OK men episod '{epi}' är tom")
-                        print(f"   Datum kanske inte existerar än i systemet")
-                        break
-                    else:
-                        print(f"✅ {len(results)} händer hittade")
-                        first_page = False
                 else:
-                    print(f"✅ {len(results)} händer")
-                
-                for i, h in enumerate(results):
-                    yield offset + i, h
-                    total_hands += 1
-                    
-                url = js.get("next")
+                    print(f"✅ {len(results)} händer hittade")
+                    first_page = False
+            else:
+                print(f"✅ {len(results)} händer")
+            
+            for i, h in enumerate(results):
+                yield offset + i, h
+                total_hands += 1
                 
-            except requests.exceptions.Timeout:
-                print(f"⏰ Timeout efter 60s på offset {offset}")
-                print(f"   API svarar för långsamt")
-                break
-            except requests.exceptions.ConnectionError:
-                print(f"❌ Anslutningsfel till API")
-                print(f"   Kontrollera internetanslutning")
-                break
-            except requests.exceptions.RequestException as e:
-                print(f"❌ Nätverksfel: {e}")
-                break
-            except ValueError as e:
-                print(f"❌ JSON-parsing fel: {e}")
-                print(f"   API returnerade ogiltig data")
-                break
-            except Exception as e:
-                print(f"❌ Oväntat fel: {e}")
-                break
+            url = js.get("next")
+
+            # Känt totalantal → beräkna resterande offsets och hämta dem parallellt
+            count = js.get("count")
+            if url and self.workers > 1 and isinstance(count, int):
+                prefetch = self._prefetch_pages(date, epi, offset + len(results), count, url)
+                while True:
+                    try:
+                        yield next(prefetch)
+                        total_hands += 1
+                    except StopIteration as stop:
+                        url = stop.value
+                        break
         
         if total_hands > 0:
             print(f"🎉 Totalt hämtade {total_hands:,} händer för {date}")
+        elif start_offset:
+            print(f"ℹ️  Inga nya händer för {date} sedan förra körningen")
         else:
             print(f"⚠️  Inga händer hämtades för {date}")
             print(f"   Möjliga orsaker:")
@@ -382,8 +499,41 @@ class Store:
             );
             CREATE INDEX IF NOT EXISTS idx_date ON hands(hand_date);
             CREATE INDEX IF NOT EXISTS idx_seq  ON hands(hand_date, seq);
+            CREATE TABLE IF NOT EXISTS ingest_state(
+                hand_date   TEXT PRIMARY KEY,
+                last_offset INTEGER,
+                last_stub   TEXT,
+                total_seen  INTEGER,   -- händer för datumet i hands
+                updated_at  TEXT
+            );
         """)
 
+    def load_cursor(self, date: str) -> tuple[int, str | None] | None:
+        """Returnerar (last_offset, last_stub) för datumet, eller None om det aldrig skrapats."""
+        row = self.con.execute(
+            "SELECT last_offset, last_stub FROM ingest_state WHERE hand_date=?",
+            (date,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def save_cursor(self, date: str, last_offset: int, last_stub: str | None):
+        """Flyttar fram high-water mark (aldrig bakåt) för datumet; total_seen räknas i hands."""
+        self.con.execute("""
+            INSERT INTO ingest_state(hand_date, last_offset, last_stub, total_seen, updated_at)
+            VALUES (?,?,?,(SELECT COUNT(*) FROM hands WHERE hand_date=?),?)
+            ON CONFLICT(hand_date) DO UPDATE SET
+                last_offset = excluded.last_offset,
+                last_stub   = excluded.last_stub,
+                total_seen  = excluded.total_seen,
+                updated_at  = excluded.updated_at
+            WHERE excluded.last_offset >= ingest_state.last_offset
+        """, (date, last_offset, last_stub, date,
+              datetime.now().isoformat(timespec="seconds")))
+        self.con.commit()
+
+    def reset_cursor(self, date: str):
+        self.con.execute("DELETE FROM ingest_state WHERE hand_date=?", (date,))
+        self.con.commit()
+
     def insert_batch(self, rows: Iterable[Tuple[str, str, int, str]]):
         self.con.executemany(
             "INSERT OR IGNORE INTO hands(id, hand_date, seq, raw_json)"
@@ -404,6 +554,10 @@ def main() -> None:
                        help="Script att hoppa över (t.ex. --skip-scripts 1_build_heavy_analysis.py 2_preflop_scores.py)")
     parser.add_argument("--no-scripts", action="store_true",
                        help="Hoppa över alla processing-scripts")
+    parser.add_argument("--fetch-workers", type=int,
+                       help="Antal API-sidor att hämta parallellt (default: FETCH_WORKERS i config)")
+    parser.add_argument("--full", action="store_true",
+                       help="Ignorera sparad ingest-cursor och skanna hela episoden från offset 0")
     args = parser.parse_args()
     
     # Setup från config
@@ -413,10 +567,17 @@ def main() -> None:
         args.url or CFG["BASE_URL"], 
         CFG["ORGANIZER"], 
         CFG["EVENT"],
-        limit=int(CFG.get("BATCH_LIMIT", 50))
+        limit=int(CFG.get("BATCH_LIMIT", 50)),
+        workers=args.fetch_workers or int(CFG.get("FETCH_WORKERS", 1)),
+        retries=int(CFG.get("FETCH_RETRIES", 3)),
     )
     store = Store(ROOT / (args.db or DB_PATH))
 
+    # Återuppta från high-water mark minus ett tail-fönster (fångar sena/omsorterade händer)
+    tail = int(CFG.get("RESCAN_TAIL", 100))
+    cursor = None if args.full else store.load_cursor(date)
+    start_offset = max(0, cursor[0] + 1 - tail) if cursor else 0
+
     print(f"📥 Startar hämtning för {date}")
     print(f"   Batch-storlek: {batch_size} händer ({batch_size//50} sidor)")
     print(f"   Database: {DB_PATH}")
@@ -424,6 +585,8 @@ def main() -> None:
         print(f"   Hoppar över scripts: {', '.join(args.skip_scripts)}")
     if args.no_scripts:
         print(f"   Scripts: INAKTIVERADE")
+    if cursor:
+        print(f"   Ingest-cursor: offset {cursor[0]:,} (tail {tail} → start {start_offset:,})")
     print()
     
     rows: List[Tuple[str, str, int, str]] = []
@@ -432,45 +595,65 @@ def main() -> None:
     batch_count = 0
     duplicates = 0
     invalid_hands = 0
-
-    for seq, hand in api.iter_hands(date):
-        hand_id = hand.get("stub", "")
+    hwm_seq, hwm_stub = -1, None     # högsta offset som setts i denna körning
+    cursor_ok = True
+
+    for page in chunked(api.iter_hands(date, start_offset), api.limit):
+        # Kanoniskt hand-ID ("Hand<nummer>") redan vid ingest
+        for _, h in page:
+            if h.get("stub"):
+                h["stub"] = canonical_hand_id(h["stub"])
+        # Varje hand valideras en gång per sida; resultatet återanvänds nedan
+        checked = [(seq, h, validate_hand(h)) for seq, h in page]
+        # En set-baserad dublettkontroll per API-sida i stället för en SELECT per hand
+        known = existing_ids(store.con, [h.get("stub", "") for _, h, (ok, _) in checked
+                                         if ok])
+
+        for seq, hand, (is_valid, error_msg) in checked:
+            hand_id = hand.get("stub", "")
+            if seq > hwm_seq:
+                hwm_seq, hwm_stub = seq, hand_id
+            if cursor and seq == cursor[0] and hand_id != cursor[1]:
+                # Episoden har förskjutits sedan förra körningen → nästa körning gör full skanning
+                cursor_ok = False
+                logger.warning(f"Ingest-cursor ur synk för {date}: offset {seq} är {hand_id}, väntade {cursor[1]}")
         
-        # Validera hand
-        is_valid, error_msg = validate_hand(hand)
-        if not is_valid:
-            invalid_hands += 1
-            logger.warning(f"Ogiltig hand {hand_id}: {error_msg}")
-            continue
+            # Ogiltig hand
+            if not is_valid:
+                invalid_hands += 1
+                logger.warning(f"Ogiltig hand {hand_id}: {error_msg}")
+                continue
         
-        # Kontrollera dublett
-        if check_duplicate(store.con, hand_id):
-            duplicates += 1
-            logger.info(f"Dublett hittad: {hand_id}")
-            continue
+            # Kontrollera dublett
+            if hand_id in known:
+                duplicates += 1
+                logger.info(f"Dublett hittad: {hand_id}")
+                continue
         
-        rows.append((hand["stub"], date, seq, json.dumps(hand)))
-        objs.append(hand)
+            rows.append((hand["stub"], date, seq, json.dumps(hand)))
+            objs.append(hand)
 
-        if len(rows) >= batch_size:
-            batch_count += 1
+            if len(rows) >= batch_size:
+                batch_count += 1
             
-            # Spara rådata + segmentera
-            store.insert_batch(rows)
-            bulk_from_objects(store.con, objs)
-            total_seen += len(rows)
+                # Spara rådata + segmentera
+                store.insert_batch(rows)
+                bulk_from_objects(store.con, objs)
+                total_seen += len(rows)
+                if cursor_ok:
+                    store.save_cursor(date, hwm_seq, hwm_stub)
             
-            print(f"📦 Batch {batch_count}: {len(rows)} händer → Totalt: {total_seen:,}")
+                print(f"📦 Batch {batch_count}: {len(rows)} händer → Totalt: {total_seen:,}")
             
-            # Kör processing-scripts
-            if not args.no_scripts:
-                scripts_ok = run_processing_scripts(args.skip_scripts)
-                if not scripts_ok:
-                    print(f"❌ Scripts misslyckades i batch {batch_count} - avbryter")
-                    return
+                # Kör processing-scripts
+                if not args.no_scripts:
+                    scripts_ok = run_processing_scripts(args.skip_scripts)
+                    if not scripts_ok:
+                        print(f"❌ Scripts misslyckades i batch {batch_count} - avbryter")
+                        return
             
-            rows.clear(); objs.clear()
-            print()  # Tom rad mellan batches
+                rows.clear(); objs.clear()
+                print()  # Tom rad mellan batches
 
     # Hantera sista batch
     if rows:
@@ -479,6 +662,8 @@ def main() -> None:
         store.insert_batch(rows)
         bulk_from_objects(store.con, objs)
         total_seen += len(rows)
+        if cursor_ok:
+            store.save_cursor(date, hwm_seq, hwm_stub)
         
         print(f"📦 Sista batch {batch_count}: {len(rows)} händer → Totalt: {total_seen:,}")
         
@@ -488,6 +673,12 @@ def main() -> None:
                 print(f"❌ Scripts misslyckades i sista batch")
                 return
 
+    # Dubbletter/ogiltiga i slutet av episoden flyttar också fram cursorn
+    if not cursor_ok:
+        store.reset_cursor(date)
+    elif hwm_seq >= 0:
+        store.save_cursor(date, hwm_seq, hwm_stub)
+
     print(f"\n🎉 KLART! {total_seen:,} händer hämtade i {batch_count} batches")
     print(f"   Sparade i: {DB_PATH}")
     
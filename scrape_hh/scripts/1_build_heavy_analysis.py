@@ -6,6 +6,9 @@ build_heavy_analysis.py – v14 (board_cards + holecards)
   med:
       hand_info · streets · players · actions · postflop_scores
 • BB-normalisering: Om NORMALIZE_CUR=Y i config, delas alla belopp med chip_value
+• Inkrementellt: rowid-watermark per källdatabas (etl_watermark) – bara nya
+  händer läses; --full skannar om hela poker.db
+• hand_id skrivs i kanonisk form ("Hand<nummer>", utils.hand_ids)
 
 Nytt i v14
 ──────────
@@ -17,13 +20,17 @@ Nytt i v14
 """
 
 from __future__ import annotations
-import json, re, sqlite3, time, argparse
+import json, re, sqlite3, time, argparse, queue, threading
+from bisect import bisect_left
 from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Dict, Any, List, Tuple
 
 # ── 1. Import centraliserad path-hantering ──────────────────────────
-from script_paths import ROOT, SRC_DB, DST_DB, CFG
+from script_paths import ROOT, SRC_DB, DST_DB, CFG, connect, check_deadline
+from etl_state import checked_watermark, set_watermark, enqueue_hands, prune_queue
+from utils.hand_ids import canonical_hand_id, migrate_hand_ids
 
 # Kolla om vi ska normalisera valutor
 NORMALIZE_CUR = CFG.get("NORMALIZE_CUR", "N").upper() == "Y"
@@ -42,14 +49,6 @@ def safe_parse_int(value, default=0):
         print(f"⚠️  Kunde inte parsa värde '{value}'")
         return default
 
-# Hantera kommandoradsargument
-ap = argparse.ArgumentParser()
-ap.add_argument("--src"); ap.add_argument("--dst")
-cli = ap.parse_args()
-if cli.src: SRC_DB = Path(cli.src).expanduser().resolve()
-if cli.dst: DST_DB = Path(cli.dst).expanduser().resolve()
-DST_DB.parent.mkdir(parents=True, exist_ok=True)
-
 # ── 2. JSON-kolumnen i hands ─────────────────────────────────────────
 HANDS_TBL = "hands"
 def detect_json_col(con: sqlite3.Connection) -> str:
@@ -98,6 +97,26 @@ def rotate_postflop(active: List[str]) -> deque:
             dq = deque(active); dq.rotate(-active.index(first)); return dq
     return deque(active)
 
+# ── score-uppslag via sorterade prefix ───────────────────────────────
+def build_score_index(score_rows) -> Tuple[List[str], List[Tuple[float, float]]]:
+    """score_rows → (sorterade node_strings, [(score, difficulty)] i samma ordning)."""
+    idx = sorted((node, sc, dd) for _, node, sc, dd in score_rows)
+    return [n for n, _, _ in idx], [(sc, dd) for _, sc, dd in idx]
+
+def match_score(nodes: List[str], vals: List[Tuple[float, float]], wanted: str):
+    """
+    Kortaste node_string som börjar med `wanted` (lika långa → lexikografiskt
+    minsta). Alla noder med prefixet ligger i ett sammanhängande intervall
+    från bisect_left i den sorterade listan.
+    """
+    i = bisect_left(nodes, wanted)
+    best = None
+    while i < len(nodes) and nodes[i].startswith(wanted):
+        if best is None or len(nodes[i]) < len(nodes[best]):
+            best = i
+        i += 1
+    return vals[best] if best is not None else (None, None)
+
 # ── Normaliseringsfunktion ───────────────────────────────────────────
 def normalize_amount(amount: float, chip_value: float) -> float:
     """Normaliserar belopp baserat på chip_value om NORMALIZE_CUR=Y."""
@@ -124,6 +143,7 @@ def parse_hand(h: Dict[str, Any],
         chip_value = 1.0
     
     # ── 5.1 grund-setup ──────────────────────────────────────────────
+    hand_id = canonical_hand_id(h["stub"])
     pos2info = h["positions"]
     seats = [p for p in SEAT_ORDER if p in pos2info]
     active = seats[:]
@@ -159,11 +179,12 @@ def parse_hand(h: Dict[str, Any],
     partial = h.get("partial_scores") or extra_scores or {}
     rows_s, rows_a, rows_p = [], [], []
     score_rows = [
-        (h["stub"], k,
+        (hand_id, k,
          v if isinstance(v, float) else v.get("action_score"),
          None if isinstance(v, float) else v.get("decision_difficulty"))
         for k, v in partial.items()
     ]
+    score_nodes, score_vals = build_score_index(score_rows)
 
     # ── 5.3 loopa genom situation_string ────────────────────────────
     order = deque(active)
@@ -174,7 +195,7 @@ def parse_hand(h: Dict[str, Any],
     for st_idx, (street, toks, board) in enumerate(split_streets(h["situation_string"])):
         if board:
             board_seen += board     # 🆕
-            rows_s.append((h["stub"], street, board))
+            rows_s.append((hand_id, street, board))
         if street != "preflop":
             order = rotate_postflop(active)
 
@@ -195,7 +216,7 @@ def parse_hand(h: Dict[str, Any],
                     raw_amt = safe_parse_int(tk[1:], cur_max)
                     amt_to = int(normalize_amount(raw_amt, chip_value))
                 except (ValueError, TypeError):
-                    print(f"⚠️  Kunde inte parsa raise amount '{tk[1:]}' i hand {h['stub']}")
+                    print(f"⚠️  Kunde inte parsa raise amount '{tk[1:]}' i hand {hand_id}")
                     amt_to = cur_max  # Använd current max som fallback
 
             stack_b, pot_b = stack0[pos] - invested[pos], pot
@@ -206,6 +227,7 @@ def parse_hand(h: Dict[str, Any],
                 put = cur_max - invested[pos]
             invested[pos] += put; pot += put
             stack_a = stack_b - put
+            score, difficulty = match_score(score_nodes, score_vals, state_next)
 
             if act == "f":
                 active.remove(pos); order.popleft()
@@ -214,14 +236,14 @@ def parse_hand(h: Dict[str, Any],
             players_left = len(active)
 
             rows_a.append((
-                h["stub"], idx, street, st_idx,
+                hand_id, idx, street, st_idx,
                 pos,
                 pos2info[pos]["stub"],                 # player_id
                 pos2name[pos],                         # nickname
                 act, amt_to,
                 stack_b, stack_a, put, pot_b, pot,
                 players_left, int(stack_a == 0),
-                None, None,                            # score & difficulty
+                score, difficulty,                     # score & difficulty
                 state,                                 # state_prefix
                 board_seen,                            # 🆕 board_cards
                 ",".join(pos2info[pos]["hole_cards"])  # 🆕 holecards
@@ -234,7 +256,7 @@ def parse_hand(h: Dict[str, Any],
     # ── 5.4 players- & hand_info-rader ──────────────────────────────
     # Normalisera money_won
     rows_p = [
-        (h["stub"], p, pos2name[p], stack0[p],
+        (hand_id, p, pos2name[p], stack0[p],
          ",".join(pos2info[p]["hole_cards"]),
          normalize_amount(pos2info[p].get("money_won") or 0, chip_value))
         for p in pos2info
@@ -252,7 +274,7 @@ def parse_hand(h: Dict[str, Any],
             return 0
     
     hand_info = (
-        h["stub"], hand_date, seq,
+        hand_id, hand_date, seq,
         safe_parse_bool(h.get("is_mtt")), safe_parse_bool(h.get("is_cash")),
         bb, sb, ante, len(seats), h.get("pot_type")
     )
@@ -330,55 +352,160 @@ def ensure(con: sqlite3.Connection) -> None:
     if "holecards" not in acols:
         con.execute("ALTER TABLE actions ADD COLUMN holecards TEXT")
 
+    # hand_id-migration: äldre rader utan "Hand"-prefix
+    migrate_hand_ids(con, ("hand_info", "streets", "players", "actions", "postflop_scores"))
+
+    # Senare steg hämtar sina köade händer via hand_id (samma index som steg 7)
+    con.execute("""
+        CREATE INDEX IF NOT EXISTS idx_actions_hand_position
+        ON actions(hand_id, position)
+    """)
+
     con.commit()
 
+WM_STAGE = "1_build_heavy_analysis"
+
 def done_ids(c) -> set[str]:
     return {r[0] for r in c.execute("SELECT hand_id FROM hand_info")}
 
-# ── 7. fyll saknade score-fält ───────────────────────────────────────
-def fill_missing_scores(con: sqlite3.Connection, hand_id: str):
-    cur = con.cursor()
-    nodes = cur.execute(
-        "SELECT node_string, action_score, decision_difficulty "
-        "FROM postflop_scores WHERE hand_id=? ORDER BY LENGTH(node_string)",
-        (hand_id,)
-    ).fetchall()
-    if not nodes:
-        return
-    upd = []
-    for rowid, prefix, act in cur.execute(
-        "SELECT rowid, state_prefix, action "
-        "FROM actions WHERE hand_id=? AND action_score IS NULL",
-        (hand_id,)
-    ):
-        wanted = prefix + act
-        for ns, sc, dd in nodes:
-            if ns.startswith(wanted):
-                upd.append((sc, dd, rowid)); break
-    if upd:
-        cur.executemany(
-            "UPDATE actions SET action_score=?, decision_difficulty=? WHERE rowid=?",
-            upd
-        ); con.commit()
+# ── 7. skrivning + parallell parsning ───────────────────────────────
+INSERT_ACTIONS = """INSERT OR IGNORE INTO actions 
+            (hand_id, action_order, street, street_index, position, player_id, nickname,
+             action, amount_to, stack_before, stack_after, invested_this_action,
+             pot_before, pot_after, players_left, is_allin, action_score, decision_difficulty,
+             state_prefix, board_cards, holecards)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)"""  # 21 kolumner med explicit kolumnnamn
+
+PARSE_CHUNK = 200          # händer per worker-uppgift (= commit-intervall)
+
+def write_parsed(con: sqlite3.Connection, parsed: List[Tuple[str, tuple]]) -> None:
+    """Skriver (hand_id, parse_hand-resultat) med en executemany per tabell.
+    Tabellordningen per hand bevaras, så rowids blir desamma som vid seriell import.
+    Händerna läggs i etl_queue i samma transaktion, så senare steg ser dem."""
+    cd = con.cursor()
+    cd.executemany("INSERT OR IGNORE INTO hand_info VALUES (?,?,?,?,?,?,?,?,?,?)",
+                   [p[3] for _, p in parsed])
+    cd.executemany("INSERT OR IGNORE INTO streets VALUES (?,?,?)",
+                   [r for _, p in parsed for r in p[0]])
+    cd.executemany("INSERT OR IGNORE INTO players VALUES (?,?,?,?,?,?)",
+                   [r for _, p in parsed for r in p[2]])
+    cd.executemany(INSERT_ACTIONS, [r for _, p in parsed for r in p[1]])
+    cd.executemany("INSERT OR IGNORE INTO postflop_scores VALUES (?,?,?,?)",
+                   [r for _, p in parsed for r in p[4]])
+    enqueue_hands(con, (p[3][0] for _, p in parsed))
+
+def _parse_chunk(items: List[tuple]) -> List[Tuple[str, tuple]]:
+    """Worker-process: JSON-dekodning + parse_hand för en bit av händer."""
+    out = []
+    for hid, hdat, seq, raw_json, ps_json, chip_value in items:
+        extra_scores = json.loads(ps_json) if ps_json else None
+        out.append((hid, parse_hand(json.loads(raw_json), extra_scores, hdat, seq, chip_value)))
+    return out
+
+def import_parallel(dst: sqlite3.Connection, rows, done: set[str], source: str,
+                    workers: int, last_rid: int) -> Tuple[int, int, str | None]:
+    """
+    Fläktar ut parsningen till en ProcessPoolExecutor; en enda writer-tråd
+    skriver resultaten i källordning med en transaktion per bit.
+    Returnerar (antal nya händer, sista rowid, id vid sista rowid).
+    """
+    q: queue.Queue = queue.Queue(maxsize=workers * 2)
+    last_key = None
+    state = {"new": 0, "error": None}
+
+    def writer():
+        try:
+            while (item := q.get()) is not None:
+                parsed, (rid, key) = item
+                write_parsed(dst, parsed)
+                set_watermark(dst, WM_STAGE, source, rid, key)
+                dst.commit()
+                state["new"] += len(parsed)
+                if parsed:
+                    print(f"• {state['new']:,} HH importerade …")
+        except BaseException as e:          # rapporteras i huvudtråden
+            state["error"] = e
+            while q.get() is not None:      # töm kön så att producenten inte blockerar
+                pass
+
+    def chunks():
+        nonlocal last_rid, last_key
+        items, keys = [], None
+        for row in rows:
+            last_rid, last_key = row["rid"], row["id"]
+            if canonical_hand_id(row["id"]) in done:
+                continue
+            keys = keys or set(row.keys())
+            items.append((row["id"], row["hand_date"], row["seq"], row["hand_json"],
+                          row["ps_json"] if "ps_json" in keys else None,
+                          row["chip_value_in_displayed_currency"]
+                          if "chip_value_in_displayed_currency" in keys else None))
+            if len(items) >= PARSE_CHUNK:
+                yield items, (last_rid, last_key)
+                items = []
+        yield items, (last_rid, last_key)    # sista (ev. tomma) biten flyttar watermark
+
+    # Writer-tråden startas först efter första submit: med fork skapas alla
+    # workers då, så ingen barnprocess ärver ett lås (stdout, SQLite) som
+    # tråden håller. Med spawn/forkserver startas workers utan trådarna.
+    wt = threading.Thread(target=writer, name="heavy-writer", daemon=True)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending: deque = deque()
+            for items, rid in chunks():
+                check_deadline()
+                pending.append((pool.submit(_parse_chunk, items), rid))
+                if wt.ident is None:
+                    wt.start()
+                if len(pending) >= workers * 2:
+                    fut, r = pending.popleft(); q.put((fut.result(), r))
+                if state["error"]:
+                    break
+            while pending and not state["error"]:
+                fut, r = pending.popleft(); q.put((fut.result(), r))
+    finally:
+        if wt.ident is not None:
+            q.put(None); wt.join()
+    if state["error"]:
+        raise state["error"]
+    return state["new"], last_rid, last_key
 
 # ── 8. import-loop ───────────────────────────────────────────────────
 def main():
+    global SRC_DB, DST_DB
+    # Hantera kommandoradsargument
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--src"); ap.add_argument("--dst")
+    ap.add_argument("--full", action="store_true",
+                    help="Ignorera watermark och skanna hela poker.db (rebuild)")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Antal parse-processer (default 1 = seriellt)")
+    cli = ap.parse_args()
+    if cli.src: SRC_DB = Path(cli.src).expanduser().resolve()
+    if cli.dst: DST_DB = Path(cli.dst).expanduser().resolve()
+    DST_DB.parent.mkdir(parents=True, exist_ok=True)
+
     while not SRC_DB.exists():
         print("⏳ väntar på poker.db …"); time.sleep(3)
 
-    src = sqlite3.connect(SRC_DB); src.row_factory = sqlite3.Row
+    src = connect(SRC_DB); src.row_factory = sqlite3.Row
     json_col = detect_json_col(src)
-    dst = sqlite3.connect(DST_DB); ensure(dst)
-
-    done = done_ids(dst)
-
-    # cache för partial_scores
-    ps_cache: Dict[str, Any] = {}
-    try:
-        for hid, js in src.execute("SELECT id, json FROM partial_scores"):
-            ps_cache[hid] = json.loads(js)
-    except sqlite3.OperationalError:
-        pass
+    dst = connect(DST_DB, check_same_thread=False); ensure(dst)
+    # Köposter som alla steg redan passerat behövs inte längre
+    if prune_queue(dst):
+        dst.commit()
+
+    # Watermark: bara händer med rowid > senast behandlade läses från poker.db.
+    # Saknas det (första körningen / --full / poker.db ombyggd) skannas allt
+    # och redan importerade händer hoppas över som tidigare.
+    source = str(SRC_DB.resolve())
+    wm = None if cli.full else checked_watermark(dst, src, WM_STAGE, source, HANDS_TBL)
+    done = done_ids(dst) if wm is None else set()
+
+    # partial_scores joinas in per hand i stället för att hela tabellen cachas
+    has_ps = src.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='partial_scores'"
+    ).fetchone() is not None
 
     # Kolla om chip_value_in_displayed_currency finns i databasen
     has_chip_value = False
@@ -389,48 +516,48 @@ def main():
     except:
         pass
 
-    cs, cd = src.cursor(), dst.cursor(); new = 0
+    cs = src.cursor(); new = 0
     
-    # Bygg SQL-query beroende på om chip_value finns
-    if has_chip_value:
-        query = f"SELECT id, hand_date, seq, chip_value_in_displayed_currency, {json_col} FROM {HANDS_TBL}"
-    else:
-        query = f"SELECT id, hand_date, seq, {json_col} FROM {HANDS_TBL}"
-    
-    for row in cs.execute(query):
-        hid, hdat, seq = row["id"], row["hand_date"], row["seq"]
-        if hid in done:
-            continue
+    # Bygg SQL-query beroende på om chip_value / partial_scores finns
+    query = (
+        f"SELECT h.rowid AS rid, h.id, h.hand_date, h.seq, h.{json_col} AS hand_json"
+        + (", h.chip_value_in_displayed_currency" if has_chip_value else "")
+        + (", ps.json AS ps_json" if has_ps else "")
+        + f" FROM {HANDS_TBL} h"
+        + (" LEFT JOIN partial_scores ps ON ps.id = h.id" if has_ps else "")
+        + " WHERE h.rowid > ? ORDER BY h.rowid"
+    )
+    last_rid, last_key = wm or 0, None   # last_key: poker.db-id vid last_rid
 
-        hand = json.loads(row[json_col])
+    if cli.workers > 1:
+        new, last_rid, last_key = import_parallel(dst, cs.execute(query, (last_rid,)), done, source,
+                                        cli.workers, last_rid)
+    else:
+        for row in cs.execute(query, (last_rid,)):
+            check_deadline()
+            hid, hdat, seq = row["id"], row["hand_date"], row["seq"]
+            last_rid, last_key = row["rid"], hid
+            if canonical_hand_id(hid) in done:
+                continue
+
+            extra_scores = json.loads(row["ps_json"]) if has_ps and row["ps_json"] else None
+            hand = json.loads(row["hand_json"])
         
-        # Hämta chip_value om den finns
-        chip_value = None
-        if has_chip_value:
-            chip_value = row["chip_value_in_displayed_currency"]
+            # Hämta chip_value om den finns
+            chip_value = None
+            if has_chip_value:
+                chip_value = row["chip_value_in_displayed_currency"]
         
-        streets, actions, players, info, score_rows = parse_hand(
-            hand, ps_cache.get(hid), hdat, seq, chip_value)
-
-        cd.execute("INSERT OR IGNORE INTO hand_info VALUES (?,?,?,?,?,?,?,?,?,?)", info)
-        cd.executemany("INSERT OR IGNORE INTO streets VALUES (?,?,?)", streets)
-        cd.executemany("INSERT OR IGNORE INTO players VALUES (?,?,?,?,?,?)", players)
-        cd.executemany(
-            """INSERT OR IGNORE INTO actions 
-            (hand_id, action_order, street, street_index, position, player_id, nickname,
-             action, amount_to, stack_before, stack_after, invested_this_action,
-             pot_before, pot_after, players_left, is_allin, action_score, decision_difficulty,
-             state_prefix, board_cards, holecards)
-            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-            actions)  # 21 kolumner med explicit kolumnnamn
-        cd.executemany(
-            "INSERT OR IGNORE INTO postflop_scores VALUES (?,?,?,?)", score_rows)
+            streets, actions, players, info, score_rows = parse_hand(
+                hand, extra_scores, hdat, seq, chip_value)
 
-        fill_missing_scores(dst, hid)
-        new += 1
-        if new % 200 == 0:
-            dst.commit(); print(f"• {new:,} HH importerade …")
+            write_parsed(dst, [(hid, (streets, actions, players, info, score_rows))])
+            new += 1
+            if new % 200 == 0:
+                set_watermark(dst, WM_STAGE, source, last_rid, last_key)
+                dst.commit(); print(f"• {new:,} HH importerade …")
 
+    set_watermark(dst, WM_STAGE, source, last_rid, last_key)
     dst.commit(); src.close(); dst.close()
     
     if NORMALIZE_CUR:
@@ -4,6 +4,8 @@ batch_preflop_analyzer.py  v1.9
 ────────────────────────────────────────────────────────────────────
 • Läser HH från poker.db
 • Matchar mot prefix-fri ranges_flat (action_sequence utan "PF:")
+  – laddas en gång till ett index i minnet (RangeIndex), inga SQL-frågor per spelare
+• Inkrementellt: rowid-watermark (etl_watermark) – bara nya händer avkodas
 • Sparar i heavy_analysis.db → preflop_scores:
 
    hand_id | position | player | combo | seq | freq | best
@@ -17,10 +19,12 @@ batch_preflop_analyzer.py  v1.9
     best = NULL  → noden saknas
 """
 
+import argparse
 import json
 import math
 import re
 import sqlite3
+from bisect import bisect_left
 from pathlib import Path
 import os
 
@@ -29,6 +33,10 @@ import sys
 ROOT_PROJECT = Path(__file__).resolve().parents[2]  # prom/
 sys.path.append(str(ROOT_PROJECT))
 from utils.paths import POKER_DB, HEAVY_DB
+sys.path.append(str(Path(__file__).resolve().parent))
+from script_paths import connect, check_deadline
+from etl_state import checked_watermark, set_watermark, queue_slice, mark_queue
+from utils.hand_ids import canonical_hand_id, migrate_hand_ids
 
 # ────────────── PROJEKTROT & KONFIGURATION ────────────────────
 ROOT = Path(__file__).resolve().parent
@@ -61,6 +69,7 @@ POS_SYNONYM = {"UTG": {"UTG", "LJ"}, "LJ": {"UTG", "LJ"}}
 RANKS   = "AKQJT98765432"
 TOK_RE  = re.compile(r"r\d+|[fcx]", re.I)          # raise+tal | f/c/x
 TOL     = 1e-9                                     # float-jämförelse
+WM_STAGE = "2_preflop_scores"
 
 # ────────────── Hjälpfunktioner ───────────────────────────────
 def canonical(combo: str) -> str:
@@ -87,39 +96,109 @@ def like_pattern(seq: str) -> str:
 def pos_variants(pos: str):
     return sorted(POS_SYNONYM.get(pos.upper(), {pos.upper()}))
 
-# ────────────── SQL-hjälp ─────────────────────────────────────
-
-def fetch_freq_and_max(conn, combo, pos, pat, act_token):
-    """Hämtar både frequency och max_frequency i en enda query för bättre prestanda."""
-    pl = pos_variants(pos)
-    ph = ",".join("?" * len(pl))
-    
-    if act_token.startswith("r"):                   # spelaren 3-bettar
-        row = conn.execute(f"""
-            SELECT frequency, 
-                   (SELECT MAX(frequency) FROM ranges_flat 
-                    WHERE position IN ({ph}) AND action_sequence LIKE ? AND combo = ?) as max_freq
-            FROM ranges_flat 
-            WHERE position IN ({ph}) AND action_sequence LIKE ? AND combo = ? 
-            AND action LIKE 'r%' 
-            ORDER BY CAST(SUBSTR(action,2) AS REAL) LIMIT 1
-        """, (*pl, pat, combo, *pl, pat, combo)).fetchone()
-    else:                                           # f / c / x
-        row = conn.execute(f"""
-            SELECT frequency,
-                   (SELECT MAX(frequency) FROM ranges_flat 
-                    WHERE position IN ({ph}) AND action_sequence LIKE ? AND combo = ?) as max_freq
-            FROM ranges_flat 
-            WHERE position IN ({ph}) AND action_sequence LIKE ? AND combo = ? 
-            AND action = ?
-        """, (*pl, pat, combo, *pl, pat, combo, act_token)).fetchone()
-    
-    return (row[0], row[1]) if row else (None, None)
+# ────────────── Range-index i minnet ──────────────────────────
+REAL_RE = re.compile(r"\s*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+
+def sql_real(s: str) -> float:
+    """Som SQLite CAST(s AS REAL): längsta numeriska prefix, annars 0.0 ('ai' → 0.0)."""
+    m = REAL_RE.match(s)
+    return float(m.group()) if m else 0.0
+
+class RangeNode:
+    """En (position, action_sequence, combo)-nod i ranges_flat."""
+    __slots__ = ("rank", "freqs", "max_freq", "min_raise")
+
+    def __init__(self, rank: int):
+        self.rank      = rank          # radordning i index-skanningen (position, seq, id)
+        self.freqs     = {}            # action → frequency (första raden vinner)
+        self.max_freq  = None
+        self.min_raise = None          # (raise-storlek, rank, frequency) för minsta r-draget
+
+class RangeIndex:
+    """
+    ranges_flat laddas en gång: (position, combo) → noder sorterade på
+    action_sequence. En LIKE 'SEQ%'-fråga blir bisect + prefix-skanning.
+    Samma semantik som den tidigare SQL-frågan:
+      • LIKE är skiftlägesokänslig → prefix jämförs i versaler
+      • position IN POS_SYNONYM-varianterna
+      • max_freq = MAX(frequency) över alla matchande noder och drag
+      • raise → draget med minst CAST(SUBSTR(action,2) AS REAL), övriga → action = ?
+    """
+    def __init__(self, conn):
+        nodes: dict[tuple, RangeNode] = {}
+        rows = conn.execute("""
+            SELECT position, action_sequence, combo, action, frequency
+            FROM ranges_flat ORDER BY position, action_sequence, id
+        """)
+        for rank, (pos, seq, combo, action, freq) in enumerate(rows):
+            node = nodes.get((pos, combo, seq))
+            if node is None:
+                node = nodes[(pos, combo, seq)] = RangeNode(rank)
+            node.freqs.setdefault(action, freq)
+            if node.max_freq is None or freq > node.max_freq:
+                node.max_freq = freq
+            if action[:1].lower() == "r":
+                cand = (sql_real(action[1:]), rank, freq)
+                if node.min_raise is None or cand[:2] < node.min_raise[:2]:
+                    node.min_raise = cand
+
+        grouped: dict[tuple, list] = {}
+        for (pos, combo, seq), node in nodes.items():
+            grouped.setdefault((pos, combo), []).append((seq.upper(), node.rank, node))
+        self._by = {}
+        for key, lst in grouped.items():
+            lst.sort()
+            self._by[key] = ([k for k, _, _ in lst], [n for _, _, n in lst])
+        self.size = len(nodes)
+
+    def _matching(self, combo, pos, prefix):
+        for p in pos_variants(pos):
+            keys, nodes = self._by.get((p, combo), ((), ()))
+            i = bisect_left(keys, prefix)
+            while i < len(keys) and keys[i].startswith(prefix):
+                yield nodes[i]
+                i += 1
+
+    def fetch_freq_and_max(self, combo, pos, pat, act_token):
+        """(frequency, max_frequency) för spelarens drag – (None, None) om draget saknas."""
+        prefix = pat[:-1] if pat.endswith("%") else pat
+        maxf, hit = None, None                       # hit = (sorteringsnyckel, frequency)
+        raise_tok = act_token.startswith("r")
+        for node in self._matching(combo, pos, prefix.upper()):
+            if maxf is None or node.max_freq > maxf:
+                maxf = node.max_freq
+            if raise_tok:
+                if node.min_raise and (hit is None or node.min_raise[:2] < hit[0]):
+                    hit = (node.min_raise[:2], node.min_raise[2])
+            elif act_token in node.freqs and (hit is None or node.rank < hit[0]):
+                hit = (node.rank, node.freqs[act_token])
+        return (hit[1], maxf) if hit else (None, None)
+
+_RANGE_CACHE: dict[tuple, RangeIndex] = {}
+
+def load_ranges(path: Path) -> RangeIndex:
+    """RangeIndex per (fil, mtime) – in-process-pipelinen laddar om bara om DB:n ändrats."""
+    key = (str(path), path.stat().st_mtime_ns)
+    if key not in _RANGE_CACHE:
+        _RANGE_CACHE.clear()
+        rng = connect(path)
+        _RANGE_CACHE[key] = RangeIndex(rng)
+        rng.close()
+    return _RANGE_CACHE[key]
 
 # ────────────── Huvudrutin ────────────────────────────────────
 def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--full", action="store_true",
+                    help="Ignorera watermark och skanna hela poker.db")
+    cli = ap.parse_args()
+
+    for p in SQLITE.values():
+        if not p.exists():
+            raise SystemExit(f"❌  saknar {p}")
+
     # — output-DB ----------------------------------------------
-    out = sqlite3.connect(SQLITE["OUT"])
+    out = connect(SQLITE["OUT"])
     out.execute("""
         CREATE TABLE IF NOT EXISTS preflop_scores(
             hand_id  TEXT,
@@ -137,23 +216,35 @@ def main() -> None:
         out.execute("ALTER TABLE preflop_scores ADD COLUMN player TEXT;")
     if "best" not in cols:
         out.execute("ALTER TABLE preflop_scores ADD COLUMN best TEXT;")
-
-    done = {row[0] for row in out.execute("SELECT DISTINCT hand_id FROM preflop_scores")}
+    # short_name saknar "Hand"-prefix – äldre rader skrivs om till kanonisk form
+    if migrate_hand_ids(out, ("preflop_scores",)):
+        out.commit()
+    # Allt i etl_queue t.o.m. upto finns redan i poker.db och läses nedan –
+    # markeras som klart efteråt, så steg 7 vet vilka händer som har preflop_scores
+    _, queue_upto = queue_slice(out, WM_STAGE)
 
     # — käll-DB -------------------------------------------------
-    hands = sqlite3.connect(SQLITE["HANDS"])
-    rng   = sqlite3.connect(SQLITE["RANGES"])
-    
-    # Skapa optimala index för bättre prestanda
-    rng.execute("CREATE INDEX IF NOT EXISTS idx_ranges_combo_pos_seq ON ranges_flat(combo, position, action_sequence)")
-    rng.execute("CREATE INDEX IF NOT EXISTS idx_ranges_freq ON ranges_flat(combo, position, action_sequence, frequency)")
+    hands = connect(SQLITE["HANDS"])
+    ranges = load_ranges(SQLITE["RANGES"])  # hela ranges_flat i minnet, en gång
+
+    # Kandidater väljs på rowid innan någon JSON avkodas: med watermark läses
+    # bara nya händer. Utan (första körning / --full / poker.db ombyggd)
+    # skannas allt och redan behandlade hand_id hoppas över som tidigare.
+    source = str(Path(SQLITE["HANDS"]).resolve())
+    wm = None if cli.full else checked_watermark(out, hands, WM_STAGE, source)
+    done = (set() if wm is not None else
+            {row[0] for row in out.execute("SELECT DISTINCT hand_id FROM preflop_scores")})
+    last_rid, last_key = wm or 0, None   # last_key: poker.db-id vid last_rid
 
     batch = []
     processed_hands = 0
 
-    for (raw_json,) in hands.execute("SELECT raw_json FROM hands"):
+    for rid, key, raw_json in hands.execute(
+            "SELECT rowid, id, raw_json FROM hands WHERE rowid > ? ORDER BY rowid", (last_rid,)):
+        check_deadline()
+        last_rid, last_key = rid, key
         hh = json.loads(raw_json)
-        hand_id = hh.get("short_name") or hh.get("stub")
+        hand_id = canonical_hand_id(hh.get("short_name") or hh.get("stub"))
         if hand_id in done or len(hh["positions"]) != 6:
             continue         # redan behandlad eller ej 6-handad
 
@@ -173,7 +264,7 @@ def main() -> None:
             combo   = canonical("".join(hh["positions"][pos]["hole_cards"]))
             player  = hh["positions"][pos]["name"] or ""
 
-            freq, maxf = fetch_freq_and_max(rng, combo, pos, pat, act_raw.lower())
+            freq, maxf = ranges.fetch_freq_and_max(combo, pos, pat, act_raw.lower())
 
             best = (
                 "y" if (freq is not None and maxf is not None and
@@ -193,11 +284,12 @@ def main() -> None:
                 "VALUES (?,?,?,?,?,?,?)",
                 batch
             )
+            set_watermark(out, WM_STAGE, source, last_rid, last_key)
             out.commit()
             print(f"✓ {processed_hands:,} händer bearbetade...")
             batch.clear()
 
-    # Commit sista batchen
+    # Commit sista batchen (watermark flyttas även om inga nya rader blev)
     if batch:
         out.executemany(
             "INSERT OR IGNORE INTO preflop_scores "
@@ -205,14 +297,13 @@ def main() -> None:
             "VALUES (?,?,?,?,?,?,?)",
             batch
         )
-        out.commit()
+    set_watermark(out, WM_STAGE, source, last_rid, last_key)
+    mark_queue(out, WM_STAGE, queue_upto)
+    out.commit()
 
-    rng.close(); hands.close(); out.close()
+    hands.close(); out.close()
     print(f"✅ v1.9 optimerad klar – {processed_hands:,} händer bearbetade med batch-commits.")
 
 # ----------------------------------------------------------------------
 if __name__ == "__main__":
-    for p in SQLITE.values():
-        if not p.exists():
-            raise SystemExit(f"❌  saknar {p}")
     main()
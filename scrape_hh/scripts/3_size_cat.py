@@ -3,6 +3,9 @@
 add_size_cat.py – lägger till/fyller size_frac (REAL) + size_cat (TEXT)
 i tabellen actions.
 
+• En enda set-baserad UPDATE … FROM hand_info (CASE genererad från PRE/POST)
+• Bara händer i stegets del av etl_queue (allt vid första körningen / --full)
+
 • Projektroten = första mapp uppåt som innehåller config.txt
 • Databasen antas ligga i   <ROOT>/local_data/database/heavy_analysis.db
   – om inte: ange -db "C:/full/path/heavy_analysis.db"
@@ -18,9 +21,11 @@ from pathlib import Path
 # -------------------------------------------------------------------
 # Import centraliserad path-hantering
 sys.path.append(str(Path(__file__).resolve().parent))
-from script_paths import ROOT, DST_DB
+from script_paths import ROOT, DST_DB, connect
+from etl_state import queue_slice, queue_filter, mark_queue
 
 DEFAULT_DB = DST_DB  # Använder centraliserad path-hantering
+WM_STAGE   = "3_size_cat"
 
 # ────────────────────────────────────────────────────────────────────
 # 1. Gränser för tiny / small / …   (ändra om du vill)
@@ -43,6 +48,14 @@ def label(frac: float, street: str) -> str:
             return lbl
     return "unknown"
 
+def band_case(bands: dict, x: str) -> str:
+    """SQL-motsvarigheten till label(): CASE WHEN lo <= x < hi … ELSE 'unknown'."""
+    whens = []
+    for lbl,(lo,hi) in bands.items():
+        cond = f"{x} >= {lo!r}" + (f" AND {x} < {hi!r}" if hi != inf else "")
+        whens.append(f"WHEN {cond} THEN '{lbl}'")
+    return "CASE " + " ".join(whens) + " ELSE 'unknown' END"
+
 # ────────────────────────────────────────────────────────────────────
 # 2. SQL-helpers
 # -------------------------------------------------------------------
@@ -54,24 +67,45 @@ def ensure_cols(con: sqlite3.Connection) -> None:
     if "size_cat" not in cols:
         con.execute("ALTER TABLE actions ADD COLUMN size_cat TEXT")
         print("➕ lade till size_cat")
-
-SQL = """
-SELECT a.rowid, a.street,
-       a.amount_to, a.invested_this_action, a.pot_before,
-       hi.big_blind
-FROM actions a
-JOIN hand_info hi ON hi.hand_id = a.hand_id
-WHERE a.size_cat IS NULL
-  AND (a.action LIKE 'r%' OR a.action LIKE 'b%')
+    # Partiellt index över okategoriserade raises: en inkrementell körning
+    # behöver inte skanna hela actions. Nyckeln size_cat är alltid NULL här,
+    # så posterna ligger i rowid-ordning.
+    con.execute("""
+        CREATE INDEX IF NOT EXISTS idx_actions_size_todo ON actions(size_cat)
+        WHERE size_cat IS NULL AND (action LIKE 'r%' OR action LIKE 'b%')
+    """)
+
+# size_frac: preflop amount_to / BB, postflop invested / pot_before
+#            (NULL om nämnaren saknas eller är 0 → size_cat 'unknown')
+FRAC = """
+CASE WHEN LOWER(a.street) = 'preflop'
+     THEN CAST(a.amount_to AS REAL) / NULLIF(hi.big_blind, 0)
+     ELSE CAST(a.invested_this_action AS REAL) / NULLIF(a.pot_before, 0)
+END
 """
 
-def frac(row: sqlite3.Row) -> float | None:
-    st = row["street"].lower()
-    if st == "preflop":
-        bb = row["big_blind"]
-        return row["amount_to"] / bb if bb else None
-    pot = row["pot_before"]
-    return row["invested_this_action"] / pot if pot else None
+def update_sql(scope: str = "1") -> str:
+    """
+    Hela kategoriseringen som en enda UPDATE … FROM. Banden per gata
+    genereras från PRE/POST (samma val som SIZING.get(street, POST)).
+    scope begränsar till köade händer (queue_filter).
+    """
+    streets = ", ".join(f"'{st}'" for st, b in SIZING.items() if b is PRE)
+    return f"""
+    UPDATE actions SET size_frac = s.f,
+                       size_cat  = CASE WHEN s.street IN ({streets})
+                                        THEN {band_case(PRE, "s.f")}
+                                        ELSE {band_case(POST, "s.f")} END
+    FROM (
+        SELECT a.rowid AS rid, a.street, {FRAC.strip()} AS f
+        FROM actions a
+        JOIN hand_info hi ON hi.hand_id = a.hand_id
+        WHERE a.size_cat IS NULL
+          AND (a.action LIKE 'r%' OR a.action LIKE 'b%')
+          AND {scope}
+    ) AS s
+    WHERE actions.rowid = s.rid
+    """
 
 # ────────────────────────────────────────────────────────────────────
 # 3. main
@@ -79,32 +113,21 @@ def frac(row: sqlite3.Row) -> float | None:
 def main() -> None:
     ap = argparse.ArgumentParser()
     ap.add_argument("-db","--database",help="sökväg till heavy_analysis.db")
+    ap.add_argument("--full", action="store_true",
+                    help="Ignorera etl_queue och kategorisera alla okategoriserade rader")
     args = ap.parse_args()
 
     db = Path(args.database).expanduser().resolve() if args.database else DEFAULT_DB
     if not db.exists():
         sys.exit(f"❌ Hittar inte databasen: {db}")
 
-    con = sqlite3.connect(db); con.row_factory = sqlite3.Row
+    con = connect(db)
     ensure_cols(con)
+    seen, upto = queue_slice(con, WM_STAGE, full=args.full)
 
-    cur = con.cursor(); batch = []; done = 0
-    for r in cur.execute(SQL):
-        f = frac(r)
-        lab = label(f,r["street"]) if f is not None else "unknown"
-        batch.append((f, lab, r["rowid"]))
-        if len(batch) >= 5000:
-            con.executemany(
-                "UPDATE actions SET size_frac=?, size_cat=? WHERE rowid=?", batch
-            )
-            con.commit(); done += len(batch); batch.clear()
-            print(f"✓ {done:,} rader uppdaterade …")
-
-    if batch:
-        con.executemany(
-            "UPDATE actions SET size_frac=?, size_cat=? WHERE rowid=?", batch
-        )
-        con.commit(); done += len(batch)
+    done = con.execute(update_sql(queue_filter("a.hand_id", seen, upto))).rowcount
+    mark_queue(con, WM_STAGE, upto)
+    con.commit()
 
     con.close()
     print(f"✅ klart – {done:,} actions fick size_frac + size_cat")
@@ -6,7 +6,12 @@ Lägger in action_label + ip_status i tabellen actions (heavy_analysis.db).
 
 • Läser regler från action_rules.yml för flexibilitet
 • Skapar kolumnerna om de saknas
-• Kör bara på rader där action_label IS NULL (kan köras om)
+• Kör bara på händer med någon rad där action_label IS NULL (kan köras om)
+• En enda strömmande läsning i (hand_id, action_order)-ordning – händerna
+  grupperas i farten och uppdateringar skrivs i stora transaktioner
+
+• Reglerna kompileras en gång till en tabell per scope + memo (RuleTable);
+  tests/test_action_label.py jämför mot YAML-reglerna tolkade rakt av
 
 Kör:  python 4_action_label.py
       python 4_action_label.py -db "C:/sökväg/annan.db"
@@ -14,13 +19,15 @@ Kör:  python 4_action_label.py
 
 from __future__ import annotations
 import argparse, sqlite3, sys, re, yaml
+from itertools import groupby
 from pathlib import Path
 from typing import List, Tuple, Dict, Any
 
 # ─────────────────── 0. projektrot & db ────────────────────────────
 # Import centraliserad path-hantering
 sys.path.append(str(Path(__file__).resolve().parent))
-from script_paths import ROOT, DST_DB
+from script_paths import ROOT, DST_DB, connect, check_deadline
+from etl_state import queue_slice, queue_filter, mark_queue
 
 DEFAULT_DB = DST_DB  # Använder centraliserad path-hantering
 YAML_PATH = Path(__file__).parent / "action_rules.yml"
@@ -47,6 +54,92 @@ FALLBACK_RULES = {
     }
 }
 
+# ─────────────────── Kompilerade regler ────────────────────────────
+# Kontextens fält i fast ordning – memo-nyckeln är (scope, *värden)
+CONTEXT_KEYS = (
+    'current_token', 'raise_count', 'raise_count_plus1', 'bet_count',
+    'player_prev_actions', 'player_position', 'is_preflop_aggressor',
+    'first_bet_this_street', 'prev_street_ended_with_two_checks',
+    'prev_street_had_bet',
+)
+SCOPES = ('PREFLOP', 'FLOP', 'TURN', 'RIVER', 'POSTFLOP')
+MEMO_MAX = 100_000
+TEMPLATE_RE = re.compile(r"(\{[^{}]*\})")
+
+def compile_condition(key: str, expected):
+    """Ett 'when'-villkor → predikat(context). Suffix: _gt (större än), _contains (i listan)."""
+    if key.endswith('_gt'):
+        base = key[:-3]
+        return lambda c: not c.get(base, 0) <= expected
+    if key.endswith('_contains'):
+        base = key[:-9]
+        return lambda c: expected in c.get(base, [])
+    return lambda c: not c.get(key) != expected
+
+def compile_result(rule: Dict[str, Any]):
+    """'result' / 'result_template' → funktion(context) → str (None = ingen result-nyckel)."""
+    if 'result' in rule:
+        res = rule['result']
+        return lambda c: res
+    if 'result_template' in rule:
+        parts = TEMPLATE_RE.split(rule['result_template'])
+        def render(c):
+            out = []
+            for part in parts:
+                name = part[1:-1] if part.startswith("{") and part.endswith("}") else None
+                out.append(str(c[name]) if name in c else part)
+            return "".join(out)
+        return render
+    return lambda c: None
+
+def rule_in_scope(rule: Dict[str, Any], scope: str) -> bool:
+    rule_scope = rule.get('scope', 'ANY')
+    postflop = scope in ('FLOP', 'TURN', 'RIVER')
+    return rule_scope in ('ANY', scope) or (postflop and rule_scope == 'POSTFLOP')
+
+class RuleTable:
+    """
+    action_rules.yml kompilerad en gång: per scope en prioritetsordnad lista
+    av (predikat, result-funktion), plus ett memo på den diskreta kontexten.
+    Ger samma etikett som reglerna tolkade i prioritetsordning, men utan
+    strängjämförelser per drag.
+    """
+    def __init__(self, rules: List[Dict[str, Any]]):
+        compiled = [
+            (rule, [compile_condition(k, v) for k, v in (rule.get('when') or {}).items()],
+             compile_result(rule))
+            for rule in rules
+        ]
+        self.by_scope = {
+            scope: [(preds, res) for rule, preds, res in compiled if rule_in_scope(rule, scope)]
+            for scope in SCOPES
+        }
+        self.memo: Dict[tuple, str | None] = {}
+
+    def match(self, key: tuple) -> str | None:
+        """key = (scope, *kontextvärden i CONTEXT_KEYS-ordning) → etikett eller None (fallback)."""
+        try:
+            return self.memo[key]
+        except KeyError:
+            pass
+        context = context_from_key(key)
+        result = None
+        for preds, res in self.by_scope[key[0]]:
+            if all(p(context) for p in preds):
+                result = res(context)
+                if result:                      # tom sträng = prova nästa regel
+                    break
+        result = result or None
+        if len(self.memo) >= MEMO_MAX:
+            self.memo.clear()
+        self.memo[key] = result
+        return result
+
+def context_from_key(key: tuple) -> Dict[str, Any]:
+    context = dict(zip(CONTEXT_KEYS, key[1:]))
+    context['player_prev_actions'] = list(context['player_prev_actions'])
+    return context
+
 # ─────────────────── 1. PositionTracker ────────────────────────────
 class PositionTracker:
     """IP/OOP-hjälp med UTG↔LJ-alias för 6-max."""
@@ -70,11 +163,23 @@ class PositionTracker:
         return "IP" if idx == (self.flop_btn - 1) % len(self.order) else "OOP"
 
 # ─────────────────── 2. ActionTracker (YAML-baserad) ───────────────
+PREV_STREETS = ['preflop', 'flop', 'turn', 'river']
+
+class HandState:
+    """Historik för EN hand – ersätts när handen byts, så minnet växer inte med antalet händer."""
+    __slots__ = ("hand_id", "streets", "preflop_aggressor")
+
+    def __init__(self, hand_id: str):
+        self.hand_id = hand_id
+        self.streets: Dict[str, List[Tuple[str, str]]] = {}   # gata → [(pos, token)]
+        self.preflop_aggressor: str | None = None
+
 class ActionTracker:
     """Etiketterar actions baserat på YAML-regler."""
     def __init__(self):
         self.rules = load_action_rules()
-        self.hands_history = {}  # hand_id -> hand data
+        self.table = RuleTable(self.rules)
+        self.hand: HandState | None = None     # bara aktuell hand
         self.new_street("preflop")
         
     def new_street(self, street: str):
@@ -85,44 +190,22 @@ class ActionTracker:
         self.first_bet = True
         self.street_actions = []
         
+    def start_hand(self, hand_id: str):
+        """Ny hand: släpp föregående hands historik."""
+        self.hand = HandState(hand_id)
+
     def record_action(self, hand_id: str, street: str, pos: str, tok: str):
         """Sparar historik för regelutvärdering."""
-        if hand_id not in self.hands_history:
-            self.hands_history[hand_id] = {
-                'streets': {},
-                'preflop_aggressor': None,
-                'prev_street_checks': 0
-            }
-        
-        hand = self.hands_history[hand_id]
-        if street not in hand['streets']:
-            hand['streets'][street] = []
-        
-        hand['streets'][street].append({'pos': pos, 'action': tok})
-        
+        if self.hand is None or self.hand.hand_id != hand_id:
+            self.start_hand(hand_id)
+
+        hand = self.hand
+        hand.streets.setdefault(street, []).append((pos, tok))
+
         # Spåra preflop aggressor
-        if street.lower() == 'preflop' and tok.startswith('r') and not hand['preflop_aggressor']:
-            hand['preflop_aggressor'] = pos
+        if street.lower() == 'preflop' and tok.startswith('r') and not hand.preflop_aggressor:
+            hand.preflop_aggressor = pos
             
-    def evaluate_conditions(self, conditions: Dict, context: Dict) -> bool:
-        """Utvärderar när-villkor från YAML."""
-        for key, expected in conditions.items():
-            actual = context.get(key)
-            
-            # Specialhantering för olika villkorstyper
-            if key.endswith('_gt'):
-                base_key = key[:-3]
-                if context.get(base_key, 0) <= expected:
-                    return False
-            elif key.endswith('_contains'):
-                base_key = key[:-9]
-                if expected not in context.get(base_key, []):
-                    return False
-            elif actual != expected:
-                return False
-                
-        return True
-        
     def process(self, hand_id: str, street: str, pos: str, tok: str, ip: str) -> str:
         # Ny gata?
         if street.lower() != self.street:
@@ -156,79 +239,48 @@ class ActionTracker:
             return "unknown"
             
         # Bygg kontext för regelutvärdering
-        hand = self.hands_history.get(hand_id, {})
-        player_prev_actions = []
-        
-        # Samla spelarens tidigare actions denna gata
-        for act in hand.get('streets', {}).get(street, []):
-            if act['pos'] == pos and act != hand['streets'][street][-1]:
-                player_prev_actions.append(act['action'])
-                
+        hand = self.hand
+
+        # Samla spelarens tidigare actions denna gata (den aktuella – sista
+        # posten – och identiska (pos, token)-poster räknas inte)
+        player_prev_actions = [a for p, a in hand.streets.get(street, ())
+                               if p == pos and a != tok]
+
         # Kolla om förra gatan slutade med två checkar
-        prev_streets = ['preflop', 'flop', 'turn', 'river']
-        prev_street_idx = prev_streets.index(street.lower()) - 1
+        prev_street_idx = PREV_STREETS.index(street.lower()) - 1
         prev_street_ended_with_checks = False
         prev_street_had_bet = False
-        
+
         if prev_street_idx >= 0:
-            prev_street = prev_streets[prev_street_idx]
-            prev_actions = hand.get('streets', {}).get(prev_street, [])
+            prev_actions = hand.streets.get(PREV_STREETS[prev_street_idx], ())
             if len(prev_actions) >= 2:
-                if prev_actions[-1]['action'] == 'x' and prev_actions[-2]['action'] == 'x':
+                if prev_actions[-1][1] == 'x' and prev_actions[-2][1] == 'x':
                     prev_street_ended_with_checks = True
                 # Kolla om det fanns bet/raise förra gatan
-                for act in prev_actions:
-                    if act['action'].startswith(('b', 'r')):
-                        prev_street_had_bet = True
-                        break
+                prev_street_had_bet = any(a.startswith(('b', 'r')) for _, a in prev_actions)
                         
-        context = {
-            'current_token': action_type,
-            'raise_count': self.raise_cnt - 1,  # antal raises innan denna
-            'raise_count_plus1': self.raise_cnt + 1,
-            'bet_count': self.bet_cnt,
-            'player_prev_actions': player_prev_actions,
-            'player_position': ip,
-            'is_preflop_aggressor': pos == hand.get('preflop_aggressor'),
-            'first_bet_this_street': self.first_bet and action_type == 'bet',
-            'prev_street_ended_with_two_checks': prev_street_ended_with_checks,
-            'prev_street_had_bet': prev_street_had_bet
-        }
-        
-        # Utvärdera YAML-regler
+        # Utvärdera YAML-regler (kompilerade + memo på kontexten)
         current_scope = street.upper() if street.upper() in ['PREFLOP', 'FLOP', 'TURN', 'RIVER'] else 'POSTFLOP'
-        if current_scope in ['FLOP', 'TURN', 'RIVER']:
-            postflop_scope = 'POSTFLOP'
-        else:
-            postflop_scope = None
-            
-        for rule in self.rules:
-            # Kolla scope
-            rule_scope = rule.get('scope', 'ANY')
-            if rule_scope not in ['ANY', current_scope]:
-                if not (postflop_scope and rule_scope == postflop_scope):
-                    continue
-                    
-            # Utvärdera villkor
-            conditions = rule.get('when', {})
-            if self.evaluate_conditions(conditions, context):
-                # Applicera regel
-                if 'result' in rule:
-                    result = rule['result']
-                elif 'result_template' in rule:
-                    # Ersätt variabler i template
-                    template = rule['result_template']
-                    for var, value in context.items():
-                        template = template.replace(f"{{{var}}}", str(value))
-                    result = template
-                else:
-                    continue
-                    
-                if result:  # Tom sträng = använd fallback
-                    if self.first_bet and action_type == 'bet':
-                        self.first_bet = False
-                    return result
-                    
+        key = (
+            current_scope,
+            action_type,
+            self.raise_cnt - 1,                 # antal raises innan denna
+            self.raise_cnt + 1,
+            self.bet_cnt,
+            tuple(player_prev_actions),
+            ip,
+            pos == hand.preflop_aggressor,
+            self.first_bet and action_type == 'bet',
+            prev_street_ended_with_checks,
+            prev_street_had_bet,
+        )
+        result = self.table.match(key)
+
+        if result:
+            if self.first_bet and action_type == 'bet':
+                self.first_bet = False
+            return result
+
         # Fallback till enkla regler om ingen YAML-regel matchar
         if street.lower() == "preflop" and action_type == "raise":
             return FALLBACK_RULES["preflop"].get(self.raise_cnt, f"{self.raise_cnt}bet")
@@ -242,24 +294,40 @@ class ActionTracker:
         return "unknown"
 
 # ─────────────────── 3. DB-helpers ─────────────────────────────────
+FLUSH_ROWS = 20_000
+
 def ensure_cols(con: sqlite3.Connection):
     cols = {c[1] for c in con.execute("PRAGMA table_info(actions)")}
     if "action_label" not in cols:
         con.execute("ALTER TABLE actions ADD COLUMN action_label TEXT")
     if "ip_status" not in cols:
         con.execute("ALTER TABLE actions ADD COLUMN ip_status TEXT")
+    # Partiellt index: händer som behöver etiketteras hittas utan full skanning
+    con.execute("""
+        CREATE INDEX IF NOT EXISTS idx_actions_label_todo
+        ON actions(hand_id) WHERE action_label IS NULL
+    """)
+
+# Alla rader för händer med minst en oetiketterad rad, i PK-ordning
+# (hand_id, action_order) – ingen sortering, ingen ID-lista i Python.
+# {scope} begränsar till stegets del av etl_queue (queue_filter).
+STREAM_SQL = """
+SELECT rowid, hand_id, street, position, action
+FROM actions
+WHERE hand_id IN (SELECT hand_id FROM actions WHERE action_label IS NULL AND {scope})
+ORDER BY hand_id, action_order
+"""
+WM_STAGE = "4_action_label"
 
-def process_hand(cur: sqlite3.Cursor, hid: str, act_tr: ActionTracker) -> List[Tuple[str,str,int]]:
-    rows = cur.execute(
-        "SELECT rowid, street, position, action "
-        "FROM actions WHERE hand_id=? ORDER BY action_order", (hid,)
-    ).fetchall()
+def process_hand(rows: List[sqlite3.Row], hid: str, act_tr: ActionTracker) -> List[Tuple[str,str,int]]:
+    """Etiketterar en hands rader (sorterade på action_order)."""
     if not rows: return []
     
     pre = [r["position"] for r in rows if r["street"] == "preflop"]
     pos_tr = PositionTracker(pre)
     
     # Reset tracker för ny hand
+    act_tr.start_hand(hid)
     act_tr.new_street("preflop")
     
     out, last_st = [], None
@@ -276,6 +344,8 @@ def process_hand(cur: sqlite3.Cursor, hid: str, act_tr: ActionTracker) -> List[T
 def main():
     p = argparse.ArgumentParser()
     p.add_argument("-db")
+    p.add_argument("--full", action="store_true",
+                   help="Ignorera etl_queue och etikettera alla oetiketterade händer")
     a = p.parse_args()
     
     db = Path(a.db).expanduser().resolve() if a.db else DEFAULT_DB
@@ -290,28 +360,36 @@ def main():
         print(f"⚠️  Fel vid YAML-laddning: {e}")
         print("   Använder inbyggda fallback-regler istället")
 
-    con = sqlite3.connect(db)
+    con = connect(db)
     con.row_factory = sqlite3.Row
     ensure_cols(con)
     cur = con.cursor()
-    
+    seen, upto = queue_slice(con, WM_STAGE, full=a.full)
+    scope = queue_filter("hand_id", seen, upto)
+
     # Skapa en ActionTracker som återanvänds
     act_tr = ActionTracker()
 
-    hids = [r[0] for r in cur.execute(
-        "SELECT DISTINCT hand_id FROM actions WHERE action_label IS NULL")]
-    total = 0
-    
-    for hid in hids:
-        upd = process_hand(cur, hid, act_tr)
-        if upd:
-            cur.executemany(
-                "UPDATE actions SET action_label=?, ip_status=? WHERE rowid=?", upd)
-            total += len(upd)
-            if total and total % 5000 == 0:
-                con.commit()
-                print(f"✓ {total:,} actions uppdaterade …")
-                
+    total, batch = 0, []
+
+    def flush():
+        nonlocal total
+        con.executemany(
+            "UPDATE actions SET action_label=?, ip_status=? WHERE rowid=?", batch)
+        con.commit()
+        total += len(batch); batch.clear()
+
+    for hid, rows in groupby(cur.execute(STREAM_SQL.format(scope=scope)),
+                             key=lambda r: r["hand_id"]):
+        check_deadline()
+        batch.extend(process_hand(list(rows), hid, act_tr))
+        if len(batch) >= FLUSH_ROWS:
+            flush()
+            print(f"✓ {total:,} actions uppdaterade …")
+
+    if batch:
+        flush()
+    mark_queue(con, WM_STAGE, upto)
     con.commit()
     con.close()
     print(f"✅ klart – {total:,} actions fick action_label + ip_status")
@@ -3,16 +3,32 @@
 # ────────────────
 # Läser heavy_analysis.db, lägger till/fyller kolumnen j_score (1–100)
 # baserat på range.txt (preflop) eller Treys-styrka (postflop) + risk.
+#
+# Cachar: kortsträngar parsas en gång (LRU), preflop slås upp i en
+# förberäknad tabell över alla 1326 kombinationer och Treys-styrkan
+# räknas en gång per unikt (hole, board)-par (LRU).
+#
+# --workers N: rowid-intervall fördelas över en process-pool, huvud-
+# processen är ensam writer.
+#
+# Bara händer i stegets del av etl_queue läses (allt vid första körningen
+# eller --full).
 
 from __future__ import annotations
 import argparse, sqlite3, math, re, sys, os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import combinations
 from pathlib import Path
 
 # ─── 0. Import centraliserad path-hantering ─────────────────────────
 sys.path.append(str(Path(__file__).resolve().parent))
-from script_paths import ROOT, DST_DB
+from script_paths import ROOT, DST_DB, connect, check_deadline
+from etl_state import queue_slice, queue_filter, mark_queue
 
 DEFAULT_DB = DST_DB  # Använder centraliserad path-hantering
+WM_STAGE   = "5_add_j_score"
 
 # ─── 1. treys (valfritt) ────────────────────────────────────────────
 try:
@@ -24,7 +40,10 @@ except ModuleNotFoundError:
 # ─── 2. verktyg för kortsträngar ────────────────────────────────────
 _CARD_RE = re.compile(r"([2-9TJQKA])([SHDCshdc])")
 RANKS    = "23456789TJQKA"
+CARD_CACHE     = 65_536              # unika kortsträngar (hole/board)
+STRENGTH_CACHE = 262_144             # unika (hole, board)-par
 
+@lru_cache(maxsize=CARD_CACHE)
 def clean_cards(s: str | None) -> str:
     """Plockar ut exakt två kort och returnerar t.ex. 'AdAc'."""
     cards = _CARD_RE.findall(s or "")
@@ -53,23 +72,24 @@ def canon(hole: str) -> str:
 # ─── 3. ladda range.txt (om den finns) ──────────────────────────────
 _RANGE_LIST: list[str] = []          # händer i styrkeordning
 _RANGE_MAP: dict[str, float] = {}    # 'AJo' → 0.83 …
+_RANGE_PATH: Path | None = None      # filen som _RANGE_MAP kommer från
 
 def load_range(path: str | None = None) -> None:
-    """Laddar range.txt och fyller _RANGE_MAP med värden 0–1."""
-    global _RANGE_LIST, _RANGE_MAP
-    if _RANGE_LIST:
-        return
+    """Laddar range.txt och fyller _RANGE_MAP med värden 0–1 (en gång per fil)."""
+    global _RANGE_LIST, _RANGE_MAP, _RANGE_PATH
     p = Path(path) if path else Path(__file__).with_name("range.txt")
-    if not p.exists():
-        return
-    txt = p.read_text(encoding="utf-8")
-    hands = [h.strip() for h in re.split(r"[,\s]+", txt) if h.strip()]
-    filt = [h for h in hands if re.fullmatch(r"[2-9TJQKA]{2}[so]?|[2-9TJQKA]{2}", h)]
-    if len(filt) < 10:
+    if p == _RANGE_PATH:
         return
-    _RANGE_LIST = filt
-    top = len(filt) - 1
-    _RANGE_MAP = {h: 1 - i / top for i, h in enumerate(filt)}
+    _RANGE_LIST, _RANGE_MAP, _RANGE_PATH = [], {}, p
+    if p.exists():
+        txt = p.read_text(encoding="utf-8")
+        hands = [h.strip() for h in re.split(r"[,\s]+", txt) if h.strip()]
+        filt = [h for h in hands if re.fullmatch(r"[2-9TJQKA]{2}[so]?|[2-9TJQKA]{2}", h)]
+        if len(filt) >= 10:
+            _RANGE_LIST = filt
+            top = len(filt) - 1
+            _RANGE_MAP = {h: 1 - i / top for i, h in enumerate(filt)}
+    build_preflop_table()                   # preflop_pct för alla kombinationer
 
 # ─── 4. Chen-formeln (fallback när hand ej finns i range.txt) ───────
 CHEN_BASE = dict(zip(
@@ -100,7 +120,23 @@ def preflop_pct(hole: str) -> float:
         return _RANGE_MAP[key]              # top-hand → 1.0
     return chen_pct(hole)
 
+# Alla 1326 kombinationer (i båda kortordningarna) → preflop_pct.
+# Byggs om när range.txt laddas; okända strängar räknas som förut.
+DECK = [r + s for r in RANKS for s in "shdc"]
+_PREFLOP_TABLE: dict[str, float] = {}
+
+def build_preflop_table() -> None:
+    _PREFLOP_TABLE.clear()
+    for c1, c2 in combinations(DECK, 2):
+        _PREFLOP_TABLE[c1 + c2] = preflop_pct(c1 + c2)
+        _PREFLOP_TABLE[c2 + c1] = preflop_pct(c2 + c1)
+
+def preflop_lookup(hole: str) -> float:
+    pct = _PREFLOP_TABLE.get(hole)
+    return pct if pct is not None else preflop_pct(hole)
+
 # ─── 5. Treys-styrka post-flop ──────────────────────────────────────
+@lru_cache(maxsize=STRENGTH_CACHE)
 def treys_pct(hole: str, board: str) -> float:
     tot_cards = (len(hole) // 2) + (len(board) // 2)
     if not _treys or tot_cards < 5:
@@ -128,6 +164,7 @@ FROM   actions
 WHERE  j_score IS NULL
 """
 SQL_UPD = "UPDATE actions SET j_score=? WHERE rowid=?"
+ROWID_SPAN = 50_000                  # rowids per worker-uppgift
 
 def score_row(r: sqlite3.Row) -> float:
     hole   = clean_cards(r["holecards"])
@@ -135,7 +172,7 @@ def score_row(r: sqlite3.Row) -> float:
     street = (r["street"] or "").lower()
     
     if street == "preflop":
-        base = preflop_pct(hole)
+        base = preflop_lookup(hole)
         adj = 1.0  # Ingen risk-justering preflop - rakt av från range.txt
     else:
         base = treys_pct(hole, board)
@@ -156,11 +193,57 @@ def ensure_col(con: sqlite3.Connection):
         con.execute("ALTER TABLE actions ADD COLUMN j_score REAL")
         print("➕ lade till kolumn j_score")
 
-# ─── 8. main ────────────────────────────────────────────────────────
+# ─── 8. parallell scoring ───────────────────────────────────────────
+def _score_range(db: str, lo: int, hi: int, scope: str) -> list[tuple[float, int]]:
+    """Worker-process: poängsätter oscorade rader med lo <= rowid <= hi (läser bara)."""
+    con = sqlite3.connect(f"{Path(db).as_uri()}?mode=ro", uri=True)
+    con.row_factory = sqlite3.Row
+    try:
+        return [(score_row(r), r["rowid"])
+                for r in con.execute(SQL_GET + f"AND {scope} AND rowid BETWEEN ? AND ?",
+                                     (lo, hi))]
+    finally:
+        con.close()
+
+def score_parallel(con: sqlite3.Connection, db: Path, range_path: str | None,
+                   workers: int, scope: str = "1") -> int:
+    """Fördelar WHERE j_score IS NULL i rowid-intervall; resultaten skrivs här, i ordning."""
+    lo, hi = con.execute(
+        f"SELECT MIN(rowid), MAX(rowid) FROM actions WHERE j_score IS NULL AND {scope}"
+    ).fetchone()
+    if lo is None:
+        return 0
+    con.commit()                         # workers läser en egen snapshot (WAL)
+
+    done = 0
+    def apply(fut):
+        nonlocal done
+        check_deadline()
+        batch = fut.result()
+        con.executemany(SQL_UPD, batch); con.commit()
+        done += len(batch)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=load_range,
+                             initargs=(range_path,)) as pool:
+        pending: deque = deque()
+        for start in range(lo, hi + 1, ROWID_SPAN):
+            pending.append(pool.submit(_score_range, str(db), start,
+                                       min(start + ROWID_SPAN - 1, hi), scope))
+            if len(pending) >= workers * 2:
+                apply(pending.popleft())
+        while pending:
+            apply(pending.popleft())
+    return done
+
+# ─── 9. main ────────────────────────────────────────────────────────
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("-db", "--database", help="Path till heavy_analysis.db")
     ap.add_argument("--range", help="Egen path till range.txt")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Antal scoring-processer (default 1 = seriellt)")
+    ap.add_argument("--full", action="store_true",
+                    help="Ignorera etl_queue och poängsätt alla rader utan j_score")
     args = ap.parse_args()
 
     load_range(args.range)                              # range.txt
@@ -168,18 +251,28 @@ def main():
     if not db.exists():
         sys.exit(f"❌ hittar inte databasen: {db}")
 
-    con = sqlite3.connect(db); con.row_factory = sqlite3.Row
+    con = connect(db); con.row_factory = sqlite3.Row
     ensure_col(con); cur = con.cursor()
+    seen, upto = queue_slice(con, WM_STAGE, full=args.full)
+    scope = queue_filter("hand_id", seen, upto)
 
-    batch, done = [], 0
-    for row in cur.execute(SQL_GET):
-        batch.append((score_row(row), row["rowid"]))
-        if len(batch) >= 5000:
-            cur.executemany(SQL_UPD, batch); con.commit()
-            done += len(batch); batch.clear()
-    if batch:
-        cur.executemany(SQL_UPD, batch); con.commit(); done += len(batch)
+    if args.workers > 1:
+        done = score_parallel(con, db, args.range, args.workers, scope)
+    else:
+        # Uppdateringarna går via con – att återanvända läs-cursorn avbröt
+        # SELECT:en efter första batchen (bara 5 000 rader per körning)
+        batch, done = [], 0
+        for row in cur.execute(SQL_GET + f"AND {scope}"):
+            batch.append((score_row(row), row["rowid"]))
+            if len(batch) >= 5000:
+                check_deadline()
+                con.executemany(SQL_UPD, batch); con.commit()
+                done += len(batch); batch.clear()
+        if batch:
+            con.executemany(SQL_UPD, batch); con.commit(); done += len(batch)
 
+    mark_queue(con, WM_STAGE, upto)
+    con.commit()
     con.close()
     print(f"✅ {done:,} actions fick j_score")
 
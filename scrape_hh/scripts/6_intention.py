@@ -10,20 +10,30 @@ Street + Action_label → JSON-fil → Intention
 • river + donk → river/donk.json → "polarised-bluff-or-value"
 
 Varje poker-situation har sin egen "personlighet"!
+
+Den upplösta mappningen publiceras som tabellen intention_map i
+heavy_analysis.db och intentions sätts med en enda UPDATE … FROM-join
+(styrka/storlek bucketas med CASE i SQL). Bara händer i stegets del av
+etl_queue som steg 4 och 5 redan behandlat tas med.
 """
 
 from __future__ import annotations
 import argparse, json, sqlite3, sys
 from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, Tuple
 
 # ════════════════════════════════════════════════════════════════════
 # Setup
 # ════════════════════════════════════════════════════════════════════
 # Import centraliserad path-hantering
 sys.path.append(str(Path(__file__).resolve().parent))
-from script_paths import ROOT, DST_DB
+from script_paths import ROOT, DST_DB, connect
+from etl_state import queue_slice, queue_filter, mark_queue, reset_queue
 
-DB_PATH = DST_DB  # Använder centraliserad path-hantering
+DB_PATH  = DST_DB  # Använder centraliserad path-hantering
+WM_STAGE = "6_intention"
+AFTER    = ("4_action_label", "5_add_j_score")   # action_label + j_score
 
 # JSON-filer kan finnas på olika ställen beroende på miljö
 # Standard path
@@ -41,8 +51,6 @@ if not JSON_ROOT.exists():
         if render_path.exists():
             JSON_ROOT = render_path
 
-if not DB_PATH.exists():
-    sys.exit(f"❌ {DB_PATH} saknas – bygg databasen först.")
 if not JSON_ROOT.exists():
     sys.exit(f"❌ {JSON_ROOT} saknas – lägg JSON-filerna där.")
 
@@ -54,135 +62,118 @@ assert JSON_ROOT is not None
 # ════════════════════════════════════════════════════════════════════
 # Smart JSON-baserat System
 # ════════════════════════════════════════════════════════════════════
-def get_intention(street: str, action_label: str, j_score: float, 
-                 invested: int, pot_before: int, debug: bool = False) -> str:
-    """
-    Smart intention från poker-kontext:
-    1. Street + action_label → JSON-fil
-    2. J_score → handstyrka (low/medium/high)  
-    3. Invested/pot → storlek (small/medium/large)
-    4. JSON mapping → intention
-    """
-    # Speciell hantering för check/call/fold
-    if action_label.lower() in ['check', 'call', 'fold']:
-        # Check behöver ingen intention
-        if action_label.lower() == 'check':
-            return "check"
-        # Call och fold kan ha intentions baserat på handstyrka
-        if action_label.lower() in ['call', 'fold']:
-            # Kolla om JSON finns, annars använd enkel logik
-            json_file = JSON_ROOT / street.lower() / f"{action_label.lower()}.json"
-            if not json_file.exists():
-                # Enkel fallback för call/fold
-                if action_label.lower() == 'call':
-                    if j_score > 66:
-                        return "call-strong"
-                    elif j_score > 33:
-                        return "call-medium"
-                    else:
-                        return "call-weak"
-                else:  # fold
-                    if j_score > 66:
-                        return "fold-strong"  # suspicious fold
-                    elif j_score > 33:
-                        return "fold-medium"
-                    else:
-                        return "fold-weak"
-    
-    # Steg 1: Ladda JSON för denna poker-situation
-    json_file = JSON_ROOT / street.lower() / f"{action_label.lower()}.json"
-    if not json_file.exists():
-        if debug:
-            print(f"⚠️  Ingen JSON: {json_file}")
-        # Försök med generisk raise.json eller bet.json som fallback
-        if "bet" in action_label.lower():
-            fallback_file = JSON_ROOT / street.lower() / "raise.json"
-            if fallback_file.exists():
-                json_file = fallback_file
-                if debug:
-                    print(f"📎 Använder fallback: {fallback_file}")
-            else:
-                return f"{action_label}-unknown"
-        else:
-            return f"{action_label}-unknown"
-    
-    try:
-        with open(json_file, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-    except Exception as e:
-        if debug:
-            print(f"❌ Fel vid läsning av {json_file}: {e}")
-        return f"{action_label}-error"
-    
-    # Steg 2: Handstyrka från j_score
-    if j_score <= 33:
-        strength = "low"
-    elif j_score <= 66:
-        strength = "medium"
-    else:
-        strength = "high"
-    
-    # Steg 3: Storlek från ratio
+# Alla JSON-filer läses EN gång per körning till IntentionTable. Fallback-
+# kedjan (detailed_mappings → strength_mappings → raise.json → "-unknown")
+# löses upp i förväg: varje (street, action_label) får en platt tabell
+# (styrka, storlek) → intention, så en rad kostar två bucketar + ett dict-
+# uppslag i stället för fil-I/O.
+STRENGTHS = ("low", "medium", "high")
+SIZES     = ("tiny", "small", "medium", "big", "pot", "over", "huge")
+
+# Script 6 använder fortfarande "small/medium/large" som gruppering
+# Mappa de 7 kategorierna till 3 grupper för bakåtkompatibilitet
+SIZE_TO_GROUP = {
+    "tiny": "small",
+    "small": "small",
+    "medium": "medium",
+    "big": "large",
+    "pot": "large",
+    "over": "large",
+    "huge": "large"
+}
+# Enkel fallback för call/fold utan JSON: styrka → suffix
+SIMPLE_STRENGTH = {"low": "weak", "medium": "medium", "high": "strong"}
+
+# Övre gränser: styrka j_score <= gräns, storlek ratio < gräns (sista = resten)
+STRENGTH_LIMITS = (("low", 33), ("medium", 66))
+SIZE_LIMITS     = (("tiny", 0.20), ("small", 0.35), ("medium", 0.55),
+                   ("big", 0.85), ("pot", 1.10), ("over", 1.75))
+
+def strength_bucket(j_score: float) -> str:
+    """J_score → handstyrka (low/medium/high)."""
+    for name, limit in STRENGTH_LIMITS:
+        if j_score <= limit:
+            return name
+    return "high"
+
+def size_bucket(invested: int, pot_before: int) -> str:
+    """Invested/pot → en av de 7 kategorierna från JSON-filerna."""
     ratio = (invested or 0) / (pot_before or 1) if pot_before else 0
-    
-    # Matchar nu de 7 kategorierna från JSON-filerna:
-    if ratio < 0.20:
-        size = "tiny"
-    elif ratio < 0.35:
-        size = "small"
-    elif ratio < 0.55:
-        size = "medium"
-    elif ratio < 0.85:
-        size = "big"
-    elif ratio < 1.10:
-        size = "pot"
-    elif ratio < 1.75:
-        size = "over"
-    else:
-        size = "huge"
-    
-    # Script 6 använder fortfarande "small/medium/large" som gruppering
-    # Mappa de 7 kategorierna till 3 grupper för bakåtkompatibilitet
-    size_to_group = {
-        "tiny": "small",
-        "small": "small", 
-        "medium": "medium",
-        "big": "large",
-        "pot": "large",
-        "over": "large",
-        "huge": "large"
-    }
-    size_group = size_to_group[size]
-    
-    if debug:
-        print(f"🎯 {street}/{action_label}: j_score={j_score}→{strength}, "
-              f"ratio={ratio:.2f}→{size} (group: {size_group})")
-    
-    # Steg 4: Hämta intention från JSON
+    for name, limit in SIZE_LIMITS:
+        if ratio < limit:
+            return name
+    return "huge"
+
+def resolve_config(config: dict, action_label: str) -> Dict[Tuple[str, str], str]:
+    """En JSON-konfig → {(styrka, storlek): intention} enligt fallback-kedjan."""
     mappings = config.get("strength_mappings", {})
-    
-    # Försök först med detailed_mappings (7 kategorier)
     detailed_mappings = config.get("detailed_mappings", {})
-    if strength in detailed_mappings and size in detailed_mappings[strength]:
-        intention = detailed_mappings[strength][size]
-        if intention:
-            if debug:
-                print(f"✅ detailed: {strength}×{size} → {intention}")
-            return intention
-    
-    # Fallback till strength_mappings (3 grupper) för bakåtkompatibilitet
-    if strength in mappings and size_group in mappings[strength]:
-        intention = mappings[strength][size_group]
-        if intention:
-            if debug:
-                print(f"✅ grouped: {strength}×{size_group} → {intention}")
-            return intention
-    
-    # Fallback om mapping saknas
-    fallback = f"{action_label}-{strength}-{size}"
-    if debug:
-        print(f"📎 Fallback: {fallback}")
-    return fallback
+    table = {}
+    for strength in STRENGTHS:
+        for size in SIZES:
+            size_group = SIZE_TO_GROUP[size]
+            intention = None
+            # Försök först med detailed_mappings (7 kategorier)
+            if strength in detailed_mappings and size in detailed_mappings[strength]:
+                intention = detailed_mappings[strength][size] or None
+            # Fallback till strength_mappings (3 grupper) för bakåtkompatibilitet
+            if not intention and strength in mappings and size_group in mappings[strength]:
+                intention = mappings[strength][size_group] or None
+            # Fallback om mapping saknas
+            table[(strength, size)] = intention or f"{action_label}-{strength}-{size}"
+    return table
+
+def constant_table(intention: str) -> Dict[Tuple[str, str], str]:
+    return {(st, sz): intention for st in STRENGTHS for sz in SIZES}
+
+class IntentionTable:
+    """Oföränderlig uppslagstabell (street, action_label) → {(styrka, storlek): intention}."""
+
+    def __init__(self, root: Path):
+        # (gata, filnamn utan .json) → konfig, eller None om filen inte gick att läsa
+        self.configs: Dict[Tuple[str, str], dict | None] = {}
+        for json_file in sorted(root.glob("*/*.json")):
+            try:
+                with open(json_file, 'r', encoding='utf-8') as f:
+                    self.configs[(json_file.parent.name, json_file.stem)] = json.load(f)
+            except Exception as e:
+                print(f"❌ Fel vid läsning av {json_file}: {e}")
+                self.configs[(json_file.parent.name, json_file.stem)] = None
+        self._tables: Dict[Tuple[str, str], MappingProxyType] = {}
+        for street, label in self.configs:          # allt som har en fil löses direkt
+            self.table(street, label)
+
+    def _resolve(self, street: str, action_label: str) -> Dict[Tuple[str, str], str]:
+        st, lbl = street.lower(), action_label.lower()
+        # Check behöver ingen intention
+        if lbl == "check":
+            return constant_table("check")
+        key = (st, lbl)
+        if key not in self.configs:
+            # Call och fold utan JSON: enkel logik på handstyrka
+            if lbl in ("call", "fold"):
+                return {(s, z): f"{lbl}-{SIMPLE_STRENGTH[s]}" for s in STRENGTHS for z in SIZES}
+            # Försök med generisk raise.json som fallback för bet-varianter
+            if "bet" in lbl and (st, "raise") in self.configs:
+                key = (st, "raise")
+            else:
+                return constant_table(f"{action_label}-unknown")
+        config = self.configs[key]
+        if config is None:
+            return constant_table(f"{action_label}-error")
+        return resolve_config(config, action_label)
+
+    def table(self, street: str, action_label: str) -> MappingProxyType:
+        key = (street, action_label)
+        tbl = self._tables.get(key)
+        if tbl is None:
+            tbl = self._tables[key] = MappingProxyType(self._resolve(street, action_label))
+        return tbl
+
+    def lookup(self, street: str, action_label: str, j_score: float,
+               invested: int, pot_before: int) -> str:
+        return self.table(street, action_label)[
+            (strength_bucket(j_score), size_bucket(invested, pot_before))]
 
 def ensure_intention_column(con: sqlite3.Connection) -> None:
     """Säkerställer att intention-kolumnen finns."""
@@ -191,6 +182,60 @@ def ensure_intention_column(con: sqlite3.Connection) -> None:
         con.execute("ALTER TABLE actions ADD COLUMN intention TEXT")
         con.commit()
         print("➕ Lade till kolumn intention")
+    # Partiellt index: inkrementella körningar hittar nya rader utan full skanning
+    con.execute("""
+        CREATE INDEX IF NOT EXISTS idx_actions_intention_todo ON actions(intention)
+        WHERE intention IS NULL AND action_label IS NOT NULL AND j_score IS NOT NULL
+    """)
+
+# ════════════════════════════════════════════════════════════════════
+# intention_map + set-baserad tilldelning
+# ════════════════════════════════════════════════════════════════════
+MAP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS intention_map(
+    street       TEXT,
+    action_label TEXT,
+    strength     TEXT,
+    size         TEXT,
+    intention    TEXT,
+    PRIMARY KEY(street, action_label, strength, size)
+) WITHOUT ROWID
+"""
+
+PENDING = ("actions.intention IS NULL AND actions.action_label IS NOT NULL"
+           " AND actions.j_score IS NOT NULL")
+
+# Samma bucketar som strength_bucket()/size_bucket(), som SQL-uttryck
+STRENGTH_SQL = ("CASE " + " ".join(
+    f"WHEN actions.j_score <= {limit!r} THEN '{name}'" for name, limit in STRENGTH_LIMITS)
+    + " ELSE 'high' END")
+RATIO_SQL = ("CAST(COALESCE(actions.invested_this_action, 0) AS REAL)"
+             " / COALESCE(NULLIF(actions.pot_before, 0), 1)")
+SIZE_SQL = ("CASE " + " ".join(
+    f"WHEN {RATIO_SQL} < {limit!r} THEN '{name}'" for name, limit in SIZE_LIMITS)
+    + " ELSE 'huge' END")
+
+def publish_intention_map(con: sqlite3.Connection, intentions: IntentionTable,
+                          pairs) -> int:
+    """Skriver om intention_map med alla (street, label, styrka, storlek) → intention."""
+    con.execute(MAP_SCHEMA)
+    con.execute("DELETE FROM intention_map")
+    rows = [(street, label, strength, size, intention)
+            for street, label in pairs
+            for (strength, size), intention in intentions.table(street, label).items()]
+    con.executemany("INSERT INTO intention_map VALUES (?,?,?,?,?)", rows)
+    return len(rows)
+
+def update_sql(target: str) -> str:
+    return f"""
+    UPDATE actions SET intention = m.intention
+    FROM intention_map AS m
+    WHERE {target}
+      AND m.street       = actions.street
+      AND m.action_label = actions.action_label
+      AND m.strength     = {STRENGTH_SQL}
+      AND m.size         = {SIZE_SQL}
+    """
 
 # ════════════════════════════════════════════════════════════════════
 # Main Processing
@@ -200,10 +245,15 @@ def main():
     parser.add_argument("--debug", action="store_true", help="Debug output")
     parser.add_argument("--limit", type=int, help="Begränsa antal rader för testning")
     parser.add_argument("--reset", action="store_true", help="Återställ alla intentions (sätt till NULL)")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignorera etl_queue och sätt intention på alla rader som saknar den")
     args = parser.parse_args()
 
+    if not DB_PATH.exists():
+        sys.exit(f"❌ {DB_PATH} saknas – bygg databasen först.")
+
     # Öppna databas
-    con = sqlite3.connect(DB_PATH)
+    con = connect(DB_PATH)
     con.row_factory = sqlite3.Row
     ensure_intention_column(con)
     cur = con.cursor()
@@ -211,65 +261,49 @@ def main():
     # Om --reset flaggan är satt, återställ alla intentions
     if args.reset:
         cur.execute("UPDATE actions SET intention = NULL")
-        con.commit()
         count = cur.rowcount
+        reset_queue(con, WM_STAGE)             # nästa körning tar alla händer
+        con.commit()
         print(f"🔄 Återställde {count:,} intentions till NULL")
         con.close()
         return
 
-    # Hämta rader som behöver intentions - ta bort exkluderingen av check/call/fold
-    sql = """
-    SELECT rowid, hand_id, street, action_label, j_score,
-           invested_this_action AS inv, pot_before AS pb
-    FROM actions
-    WHERE intention IS NULL 
-      AND action_label IS NOT NULL 
-      AND j_score IS NOT NULL
-    ORDER BY hand_id, rowid
-    """
-    
+    # Rader som behöver intentions (check/call/fold ingår), i stegets del av kön
+    seen, upto = queue_slice(con, WM_STAGE, AFTER, full=args.full)
+    pending = f"{PENDING} AND {queue_filter('actions.hand_id', seen, upto)}"
+    target = pending
     if args.limit:
-        sql += f" LIMIT {args.limit}"
-    
-    rows = cur.execute(sql).fetchall()
-    print(f"📊 Bearbetar {len(rows):,} actions med intentions...")
-
-    # Bearbeta varje rad
-    batch = []
-    processed = 0
-    stats = {}  # För att räkna olika action_labels
-
-    for row in rows:
-        action_label = row["action_label"]
-        stats[action_label] = stats.get(action_label, 0) + 1
-        
-        intention = get_intention(
-            street=row["street"],
-            action_label=action_label, 
-            j_score=row["j_score"],
-            invested=row["inv"] or 0,
-            pot_before=row["pb"] or 1,
-            debug=args.debug
-        )
-        
-        batch.append((intention, row["rowid"]))
-        processed += 1
-        
-        # Batch commit varje 500:e rad
-        if len(batch) >= 500:
-            cur.executemany("UPDATE actions SET intention=? WHERE rowid=?", batch)
-            con.commit()
-            batch.clear()
-            print(f"✓ {processed:,} intentions tillagda...")
-
-    # Sista batchen
-    if batch:
-        cur.executemany("UPDATE actions SET intention=? WHERE rowid=?", batch)
-        con.commit()
+        target += (f" AND actions.rowid IN (SELECT rowid FROM actions WHERE {pending}"
+                   f" ORDER BY hand_id, rowid LIMIT {int(args.limit)})")
+
+    stats = con.execute(f"""
+        SELECT action_label, COUNT(*) FROM actions WHERE {target}
+        GROUP BY action_label ORDER BY COUNT(*) DESC
+    """).fetchall()
+    total = sum(n for _, n in stats)
+    print(f"📊 Bearbetar {total:,} actions med intentions...")
+
+    # Alla JSON-mappningar laddas en gång och publiceras som intention_map
+    intentions = IntentionTable(JSON_ROOT)
+    pairs = set(intentions.configs) | {
+        (r[0], r[1]) for r in con.execute(
+            f"SELECT DISTINCT street, action_label FROM actions WHERE {target}")}
+    n_map = publish_intention_map(con, intentions, pairs)
+    print(f"📚 {len(intentions.configs)} JSON-mappningar → {n_map:,} rader i intention_map")
+    if args.debug:
+        for street, label in sorted(pairs):
+            tbl = intentions.table(street, label)
+            print(f"🎯 {street}/{label}: {sorted(set(tbl.values()))}")
+
+    # En set-baserad UPDATE … FROM join mot intention_map
+    processed = con.execute(update_sql(target)).rowcount
+    if not args.limit:                 # --limit lämnar resten av kön kvar
+        mark_queue(con, WM_STAGE, upto)
+    con.commit()
 
     # Visa statistik
     print("\n📈 Statistik över action_labels:")
-    for label, count in sorted(stats.items(), key=lambda x: x[1], reverse=True):
+    for label, count in stats:
         print(f"   {label}: {count:,}")
 
     con.close()
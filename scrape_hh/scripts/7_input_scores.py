@@ -6,8 +6,12 @@
 Detta script:
 1. Läser preflop scores från preflop_scores tabellen
 2. Läser postflop scores från postflop_scores tabellen  
-3. Mappar dessa till nya kolumner i actions tabellen
-4. Normaliserar alla scores till 1-100 skala
+3. Mappar dessa till nya kolumner i actions tabellen (råvärden i *_score_raw)
+4. Normaliserar scores till 1-100 skala
+
+Normaliseringens min/max sparas i score_calibration med ett versionsnummer.
+Bara nymappade rader normaliseras; alla rader skalas om först när
+råvärdenas intervall flyttar sig mer än CAL_TOLERANCE.
 
 Körs som sista steget efter att alla andra analyser är klara.
 """
@@ -16,6 +20,8 @@ from __future__ import annotations
 import argparse
 import sqlite3
 import sys
+from bisect import bisect_left
+from datetime import datetime
 from pathlib import Path
 from typing import List, Tuple
 
@@ -26,9 +32,26 @@ from typing import List, Tuple
 sys.path.append(str(Path(__file__).resolve().parent))
 # Import av script_paths - linter varnar men det fungerar korrekt
 # eftersom vi lägger till sökvägen dynamiskt ovan
-from script_paths import ROOT, DST_DB  # noqa: E402 # pylint: disable=import-error  # type: ignore
+from script_paths import ROOT, DST_DB, connect, check_deadline  # noqa: E402 # pylint: disable=import-error  # type: ignore
+from utils.hand_ids import migrate_hand_ids  # noqa: E402 # pylint: disable=import-error  # type: ignore
+from etl_state import queue_slice, queue_filter, mark_queue, reset_queue  # noqa: E402 # pylint: disable=import-error  # type: ignore
 
 DEFAULT_DB = DST_DB  # Använder centraliserad path-hantering
+POSTFLOP_CHUNK = 5_000   # postflop-actions per läs/skriv-omgång
+MAX_SQL_VARS   = 999
+CAL_TOLERANCE  = 0.01    # andel av kalibrerat intervall innan full omskalning
+
+WM_STAGE = "7_input_scores"
+AFTER    = ("2_preflop_scores",)   # postflop_scores skrivs redan av steg 1
+
+# score_calibration-nyckel → normaliserad kolumn (råvärdet ligger i <kolumn>_raw)
+SCORE_COLUMNS = {"preflop": "preflop_score", "postflop": "postflop_score"}
+
+# Actions som väntar på en score (bara actions som har scores i källtabellerna)
+PREFLOP_PENDING = ("actions.street = 'preflop' AND actions.preflop_score_raw IS NULL"
+                   " AND actions.action IN ('r', 'c', 'f')")
+POSTFLOP_PENDING = ("actions.street != 'preflop' AND actions.postflop_score_raw IS NULL"
+                    " AND actions.action IN ('r', 'c', 'f', 'x')")
 
 # ────────────────────────────────────────────────────────────────
 # 1. Schema-uppdatering
@@ -54,236 +77,172 @@ def ensure_score_columns(con: sqlite3.Connection):
         cur.execute("ALTER TABLE actions ADD COLUMN solver_best TEXT")
         print("✅ Lade till kolumn: solver_best")
     
+    for col in SCORE_COLUMNS.values():
+        if f"{col}_raw" not in existing_cols:
+            cur.execute(f"ALTER TABLE actions ADD COLUMN {col}_raw REAL")
+            print(f"✅ Lade till kolumn: {col}_raw")
+            if col in existing_cols:
+                # Gamla värden är redan normaliserade – mappas om från källtabellerna
+                cur.execute(f"UPDATE actions SET {col} = NULL WHERE {col} IS NOT NULL")
+                print(f"🔄 {cur.rowcount:,} {col} mappas om för att få råvärden")
+                reset_queue(con, WM_STAGE)     # alla händer, inte bara kön
+    
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS score_calibration(
+            score      TEXT PRIMARY KEY,   -- 'preflop' / 'postflop'
+            version    INTEGER,
+            min_raw    REAL,
+            max_raw    REAL,
+            updated_at TEXT
+        )
+    """)
+    
     con.commit()
 
 # ────────────────────────────────────────────────────────────────
-# 2. Hjälpfunktioner för hand_id konvertering
-# ────────────────────────────────────────────────────────────────
-def normalize_hand_id(hand_id: str) -> str:
-    """Tar bort 'Hand' prefix om det finns för att få bara numret."""
-    if hand_id and hand_id.startswith("Hand"):
-        return hand_id[4:]  # Ta bort "Hand"
-    return hand_id
-
-def denormalize_hand_id(hand_id: str) -> str:
-    """Lägger till 'Hand' prefix om det saknas."""
-    if hand_id and not hand_id.startswith("Hand"):
-        return f"Hand{hand_id}"
-    return hand_id
-
-# ────────────────────────────────────────────────────────────────
-# 3. Mapping-funktioner
+# 2. Mapping-funktioner
 # ────────────────────────────────────────────────────────────────
-def map_preflop_scores(con: sqlite3.Connection) -> int:
-    """
-    Mappar preflop_scores (freq) till preflop_score kolumnen.
-    Matchar på hand_id + position för preflop actions.
-    Hanterar både "Hand249244191" och "249244191" format.
+def map_preflop_scores(con: sqlite3.Connection, scope: str = "1") -> int:
     """
-    cur = con.cursor()
-    
-    # Hämta preflop actions som saknar scores
-    sql_get_actions = """
-    SELECT rowid, hand_id, position 
-    FROM actions 
-    WHERE street = 'preflop' 
-      AND preflop_score IS NULL 
-      AND action IN ('r', 'c', 'f')  -- Bara actions som har scores i preflop_scores tabellen
+    Mappar preflop_scores (freq) till preflop_score_raw kolumnen.
+    Matchar på hand_id + position för preflop actions – en set-baserad
+    UPDATE … FROM, eftersom hand_id är kanoniskt i båda tabellerna.
+    scope begränsar till köade händer (queue_filter).
     """
-    
-    actions = cur.execute(sql_get_actions).fetchall()
-    if not actions:
+    pending = con.execute(
+        f"SELECT COUNT(*) FROM actions WHERE {PREFLOP_PENDING} AND {scope}").fetchone()[0]
+    if not pending:
         return 0
     
-    # Hämta unika hand_ids som behöver scores
-    unique_hand_ids = list(set(row[1] for row in actions))
-    
-    # Skapa varianter av hand_ids för flexibel matchning
-    hand_id_variants = set()
-    for hid in unique_hand_ids:
-        hand_id_variants.add(hid)
-        hand_id_variants.add(normalize_hand_id(hid))
-        hand_id_variants.add(denormalize_hand_id(hid))
-    
-    # Hämta BARA relevanta preflop_scores
-    placeholders = ','.join('?' for _ in hand_id_variants)
-    sql_get_scores = f"""
-    SELECT hand_id, position, freq, best 
-    FROM preflop_scores
-    WHERE freq IS NOT NULL
-      AND hand_id IN ({placeholders})
-    """
+    matched = con.execute(f"""
+        UPDATE actions 
+        SET preflop_score_raw = p.freq, solver_best = p.best
+        FROM preflop_scores AS p
+        WHERE {PREFLOP_PENDING} AND {scope}
+          AND p.hand_id  = actions.hand_id
+          AND p.position = actions.position
+          AND p.freq IS NOT NULL
+    """).rowcount
+    con.commit()
+    
+    print(f"   📊 Matchade: {matched:,} actions")
+    print(f"   ❌ Ej matchade: {pending - matched:,} actions")
     
-    scores = {}
-    vars_per_id   = 1            # just hand_id
-    MAX_SQL_VARS  = 999
-    CHUNK         = MAX_SQL_VARS // vars_per_id      # 999 is safe
+    return matched
 
-    hand_list = list(hand_id_variants)
+class HandNodes:
+    """
+    En hands postflop-noder: node_string → action_score, plus nodernas
+    längder i stigande ordning för prefix-fallbacken.
+    """
+    __slots__ = ("scores", "lengths")
 
-    for off in range(0, len(hand_list), CHUNK):
-        chunk = hand_list[off : off + CHUNK]
+    def __init__(self):
+        self.scores: dict[str, float] = {}
+        self.lengths: list[int] = []
 
-        placeholders = ",".join("?" for _ in chunk)
-        sql = f"""
-            SELECT hand_id, position, freq, best
-            FROM   preflop_scores
-            WHERE  freq IS NOT NULL
-            AND  hand_id IN ({placeholders})
-        """
+    def add(self, node: str, score: float):
+        if node not in self.scores:
+            i = bisect_left(self.lengths, len(node))
+            if i == len(self.lengths) or self.lengths[i] != len(node):
+                self.lengths.insert(i, len(node))
+        self.scores[node] = score
 
-        cur.execute(sql, chunk)                 # <-- exactly len(chunk) bindings
+    def prefix(self, node_string: str) -> float | None:
+        """Kortaste lagrade nod som är ett prefix av node_string (som den gamla skanningen)."""
+        scores = self.scores
+        for n in self.lengths[:bisect_left(self.lengths, len(node_string))]:
+            score = scores.get(node_string[:n])
+            if score is not None:
+                return score
+        return None
 
-        for hand_id, position, freq, best in cur:
-            score = (freq, best)
-            scores[(hand_id,                     position)] = score
-            scores[(denormalize_hand_id(hand_id), position)] = score
-            scores[(normalize_hand_id(hand_id),   position)] = score
-    
-    # Mappa scores till actions
-    updates = []
-    matched = 0
-    not_matched = 0
-    
-    for rowid, hand_id, position in actions:
-        # Prova olika varianter av hand_id
-        keys_to_try = [
-            (hand_id, position),
-            (normalize_hand_id(hand_id), position),
-            (denormalize_hand_id(hand_id), position)
-        ]
-        
-        found = False
-        for key in keys_to_try:
-            if key in scores:
-                freq, best = scores[key]
-                updates.append((freq, best, rowid))
-                matched += 1
-                found = True
-                break
-        
-        if not found:
-            not_matched += 1
-    
-    # Uppdatera actions-tabellen i batches
-    if updates:
-        batch_size = 1000
-        for i in range(0, len(updates), batch_size):
-            batch = updates[i:i + batch_size]
-            cur.executemany(
-                "UPDATE actions SET preflop_score = ?, solver_best = ? WHERE rowid = ?",
-                batch
-            )
-        con.commit()
-    
-    print(f"   📊 Matchade: {matched:,} actions")
-    print(f"   ❌ Ej matchade: {not_matched:,} actions")
-    
-    return len(updates)
+def load_postflop_nodes(cur: sqlite3.Cursor, hand_ids) -> dict[str, HandNodes]:
+    """hand_id → HandNodes, bara för de givna händerna."""
+    hand_ids = list(hand_ids)
+    nodes: dict[str, HandNodes] = {}
+    for off in range(0, len(hand_ids), MAX_SQL_VARS):
+        chunk = hand_ids[off : off + MAX_SQL_VARS]
+        placeholders = ",".join("?" for _ in chunk)
+        cur.execute(f"""
+            SELECT hand_id, node_string, action_score
+            FROM   postflop_scores
+            WHERE  action_score IS NOT NULL
+              AND  hand_id IN ({placeholders})
+            ORDER  BY hand_id, node_string
+        """, chunk)
+        for hand_id, node_string, action_score in cur:
+            nodes.setdefault(hand_id, HandNodes()).add(node_string, action_score)
+    return nodes
 
-def map_postflop_scores(con: sqlite3.Connection) -> int:
+def map_postflop_scores(con: sqlite3.Connection, scope: str = "1") -> int:
     """
-    Mappar postflop_scores (action_score) till postflop_score kolumnen.
+    Mappar postflop_scores (action_score) till postflop_score_raw kolumnen.
     Matchar på hand_id + node_string som ska motsvara state_prefix + action.
+
+    Direkta träffar sätts med en set-baserad UPDATE … FROM. Resterande
+    actions behandlas i rowid-ordning, POSTFLOP_CHUNK åt gången, mot
+    kortare noder i samma hand (prefix-matchning). scope begränsar till
+    köade händer (queue_filter).
     """
     cur = con.cursor()
     
-    # Hämta postflop actions som saknar scores
-    sql_get_actions = """
+    matched_direct = con.execute(f"""
+        UPDATE actions 
+        SET postflop_score_raw = s.action_score
+        FROM postflop_scores AS s
+        WHERE {POSTFLOP_PENDING} AND {scope}
+          AND s.hand_id     = actions.hand_id
+          AND s.node_string = actions.state_prefix || actions.action
+          AND s.action_score IS NOT NULL
+    """).rowcount
+    con.commit()
+    
+    # Postflop actions som fortfarande saknar scores, en chunk efter senast sedda rowid
+    sql_get_actions = f"""
     SELECT rowid, hand_id, state_prefix, action 
     FROM actions 
-    WHERE street != 'preflop' 
-      AND postflop_score IS NULL 
-      AND action IN ('r', 'c', 'f', 'x')
-    LIMIT 1000  -- Begränsa för att inte överbelasta minnet
+    WHERE {POSTFLOP_PENDING} AND {scope}
+      AND rowid > ?
+    ORDER BY rowid
+    LIMIT ?
     """
     
-    actions = cur.execute(sql_get_actions).fetchall()
-    if not actions:
-        return 0
-    
-    # Hämta unika hand_ids
-    unique_hand_ids = list(set(row[1] for row in actions))
-    
-    # Skapa varianter av hand_ids
-    hand_id_variants = set()
-    for hid in unique_hand_ids:
-        hand_id_variants.add(hid)
-        hand_id_variants.add(normalize_hand_id(hid))
-        hand_id_variants.add(denormalize_hand_id(hid))
-    
-    # Hämta BARA relevanta postflop_scores
-    placeholders = ','.join('?' for _ in hand_id_variants)
-    sql_get_scores = f"""
-    SELECT hand_id, node_string, action_score 
-    FROM postflop_scores
-    WHERE action_score IS NOT NULL
-      AND hand_id IN ({placeholders})
-    """
-    
-    scores = {}
-    for hand_id, node_string, action_score in cur.execute(sql_get_scores, list(hand_id_variants)):
-        # Spara med alla varianter av hand_id
-        scores[(hand_id, node_string)] = action_score
-        scores[(normalize_hand_id(hand_id), node_string)] = action_score
-        scores[(denormalize_hand_id(hand_id), node_string)] = action_score
-    
-    # Mappa scores till actions
-    updates = []
-    matched_direct = 0
     matched_prefix = 0
     not_matched = 0
-    
-    for rowid, hand_id, state_prefix, action in actions:
-        # Bygg expected node_string genom att kombinera state_prefix + action
-        node_string = state_prefix + action
-        
-        # Prova olika varianter av hand_id
-        keys_to_try = [
-            (hand_id, node_string),
-            (normalize_hand_id(hand_id), node_string),
-            (denormalize_hand_id(hand_id), node_string)
-        ]
-        
-        found = False
-        for key in keys_to_try:
-            if key in scores:
-                action_score = scores[key]
-                updates.append((action_score, rowid))
-                matched_direct += 1
-                found = True
-                break
+    last_rowid = 0
+    
+    while True:
+        check_deadline()
+        actions = cur.execute(sql_get_actions, (last_rowid, POSTFLOP_CHUNK)).fetchall()
+        if not actions:
+            break
+        last_rowid = actions[-1][0]
+        nodes = load_postflop_nodes(cur, {row[1] for row in actions})
         
-        if not found:
-            # Försök även med kortare noder (för prefix-matching)
-            # Begränsa sökningen till relevanta hand_ids
-            for (stored_hand_id, stored_node), action_score in scores.items():
-                if stored_hand_id in [hand_id, normalize_hand_id(hand_id), denormalize_hand_id(hand_id)]:
-                    if node_string.startswith(stored_node):
-                        updates.append((action_score, rowid))
-                        matched_prefix += 1
-                        found = True
-                        break
+        # Försök med kortare noder (för prefix-matching)
+        updates = []
+        for rowid, hand_id, state_prefix, action in actions:
+            hn = nodes.get(hand_id)
+            score = hn.prefix(state_prefix + action) if hn else None
+            if score is not None:
+                updates.append((score, rowid))
+            else:
+                not_matched += 1
         
-        if not found:
-            not_matched += 1
-    
-    # Uppdatera actions-tabellen i batches
-    if updates:
-        batch_size = 1000
-        for i in range(0, len(updates), batch_size):
-            batch = updates[i:i + batch_size]
-            cur.executemany(
-                "UPDATE actions SET postflop_score = ? WHERE rowid = ?",
-                batch
+        if updates:
+            con.executemany(
+                "UPDATE actions SET postflop_score_raw = ? WHERE rowid = ?",
+                updates
             )
-        con.commit()
+            con.commit()
+            matched_prefix += len(updates)
     
     print(f"   📊 Direkta matchningar: {matched_direct:,}")
     print(f"   📊 Prefix-matchningar: {matched_prefix:,}")
     print(f"   ❌ Ej matchade: {not_matched:,}")
     
-    return len(updates)
+    return matched_direct + matched_prefix
 
 def create_missing_indexes(con: sqlite3.Connection):
     """Skapar index för bättre prestanda."""
@@ -310,6 +269,17 @@ def create_missing_indexes(con: sqlite3.Connection):
         ON actions(postflop_score)
     """)
     
+    for col in SCORE_COLUMNS.values():
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_actions_{col}_raw 
+            ON actions({col}_raw)
+        """)
+        # Mappade men ännu inte normaliserade rader
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_actions_{col}_norm_todo 
+            ON actions({col}) WHERE {col} IS NULL AND {col}_raw IS NOT NULL
+        """)
+    
     # Index för score-tabellerna
     cur.execute("""
         CREATE INDEX IF NOT EXISTS idx_preflop_scores_hand_position 
@@ -324,7 +294,7 @@ def create_missing_indexes(con: sqlite3.Connection):
     con.commit()
 
 # ────────────────────────────────────────────────────────────────
-# 4. Statistik och validering
+# 3. Statistik och validering
 # ────────────────────────────────────────────────────────────────
 def show_statistics(con: sqlite3.Connection, verbose: bool = False):
     """Visar statistik över mappade scores."""
@@ -405,79 +375,89 @@ def show_statistics(con: sqlite3.Connection, verbose: bool = False):
             for score_range, count in postflop_results:
                 print(f"     {score_range}: {count:,} actions")
 
-def normalize_scores_to_100_scale(con: sqlite3.Connection) -> tuple[int, int]:
+def normalize_score_column(con: sqlite3.Connection, kind: str,
+                           rescale: bool = False) -> int:
     """
-    Normaliserar alla scores till 1-100 skala.
-    
-    Returns:
-        tuple: (preflop_normalized, postflop_normalized) antal normaliserade scores
+    Normaliserar en score-kolumn till 1-100 enligt score_calibration.
+
+    Nya rader (råvärde men inget normaliserat värde) skalas med sparad
+    kalibrering. Ligger deras råvärden mer än CAL_TOLERANCE utanför det
+    kalibrerade intervallet (eller rescale=True) sparas ny min/max med
+    nästa version och hela kolumnen skalas om.
     """
+    col = SCORE_COLUMNS[kind]
+    raw = f"{col}_raw"
     cur = con.cursor()
     
-    print("📊 Analyserar score-distribution...")
-    
-    # Analysera preflop scores
-    cur.execute("""
-        SELECT MIN(preflop_score), MAX(preflop_score), AVG(preflop_score), COUNT(*)
+    cal = cur.execute(
+        "SELECT version, min_raw, max_raw FROM score_calibration WHERE score = ?",
+        (kind,)).fetchone()
+    new_min, new_max, new_count = cur.execute(f"""
+        SELECT MIN({raw}), MAX({raw}), COUNT(*)
         FROM actions 
-        WHERE preflop_score IS NOT NULL
-    """)
-    preflop_stats = cur.fetchone()
-    
-    if preflop_stats and preflop_stats[3] > 0:  # Om vi har data
-        min_pre, max_pre, avg_pre, count_pre = preflop_stats
-        print(f"   Preflop: min={min_pre:.2f}, max={max_pre:.2f}, avg={avg_pre:.2f}, count={count_pre:,}")
-        
-        # Normalisera preflop scores till 1-100
-        if max_pre != min_pre:  # Undvik division med noll
-            cur.execute("""
-                UPDATE actions 
-                SET preflop_score = 1 + ((preflop_score - ?) / (? - ?)) * 99
-                WHERE preflop_score IS NOT NULL
-            """, (min_pre, max_pre, min_pre))
-            preflop_normalized = cur.rowcount
-        else:
-            # Om alla scores är samma, sätt dem till 50
-            cur.execute("""
-                UPDATE actions 
-                SET preflop_score = 50 
-                WHERE preflop_score IS NOT NULL
-            """)
-            preflop_normalized = cur.rowcount
+        WHERE {col} IS NULL AND {raw} IS NOT NULL
+    """).fetchone()
+    
+    if cal is not None and not rescale:
+        version, min_raw, max_raw = cal
+        if new_count == 0:
+            return 0
+        tol = (max_raw - min_raw) * CAL_TOLERANCE
+        moved = new_min < min_raw - tol or new_max > max_raw + tol
     else:
-        preflop_normalized = 0
+        moved = True
     
-    # Analysera postflop scores
-    cur.execute("""
-        SELECT MIN(postflop_score), MAX(postflop_score), AVG(postflop_score), COUNT(*)
-        FROM actions 
-        WHERE postflop_score IS NOT NULL
-    """)
-    postflop_stats = cur.fetchone()
-    
-    if postflop_stats and postflop_stats[3] > 0:  # Om vi har data
-        min_post, max_post, avg_post, count_post = postflop_stats
-        print(f"   Postflop: min={min_post:.2f}, max={max_post:.2f}, avg={avg_post:.2f}, count={count_post:,}")
-        
-        # Normalisera postflop scores till 1-100
-        if max_post != min_post:  # Undvik division med noll
-            cur.execute("""
-                UPDATE actions 
-                SET postflop_score = 1 + ((postflop_score - ?) / (? - ?)) * 99
-                WHERE postflop_score IS NOT NULL
-            """, (min_post, max_post, min_post))
-            postflop_normalized = cur.rowcount
-        else:
-            # Om alla scores är samma, sätt dem till 50
-            cur.execute("""
-                UPDATE actions 
-                SET postflop_score = 50 
-                WHERE postflop_score IS NOT NULL
-            """)
-            postflop_normalized = cur.rowcount
+    if moved:
+        # Analysera hela score-distributionen
+        min_raw, max_raw, avg_raw, count = cur.execute(f"""
+            SELECT MIN({raw}), MAX({raw}), AVG({raw}), COUNT(*)
+            FROM actions 
+            WHERE {raw} IS NOT NULL
+        """).fetchone()
+        if count == 0:
+            return 0
+        version = (cal[0] if cal else 0) + 1
+        cur.execute("""
+            INSERT INTO score_calibration(score, version, min_raw, max_raw, updated_at)
+            VALUES (?,?,?,?,?)
+            ON CONFLICT(score) DO UPDATE SET
+                version    = excluded.version,
+                min_raw    = excluded.min_raw,
+                max_raw    = excluded.max_raw,
+                updated_at = excluded.updated_at
+        """, (kind, version, min_raw, max_raw, datetime.now().isoformat(timespec="seconds")))
+        print(f"   {kind.capitalize()}: min={min_raw:.2f}, max={max_raw:.2f}, avg={avg_raw:.2f}, "
+              f"count={count:,} → kalibrering v{version}, full omskalning")
+        target = f"{raw} IS NOT NULL"
+    else:
+        print(f"   {kind.capitalize()}: {new_count:,} nya rader, kalibrering v{version} "
+              f"(min={min_raw:.2f}, max={max_raw:.2f})")
+        target = f"{col} IS NULL AND {raw} IS NOT NULL"
+    
+    if max_raw != min_raw:  # Undvik division med noll
+        # Nya värden inom toleransen kan hamna strax utanför – kläm till 1-100
+        cur.execute(f"""
+            UPDATE actions 
+            SET {col} = MAX(1.0, MIN(100.0, 1 + (({raw} - ?) / (? - ?)) * 99))
+            WHERE {target}
+        """, (min_raw, max_raw, min_raw))
     else:
-        postflop_normalized = 0
+        # Om alla scores är samma, sätt dem till 50
+        cur.execute(f"UPDATE actions SET {col} = 50 WHERE {target}")
+    return cur.rowcount
+
+def normalize_scores_to_100_scale(con: sqlite3.Connection,
+                                  rescale: bool = False) -> tuple[int, int]:
+    """
+    Normaliserar nya scores till 1-100 skala (se normalize_score_column).
     
+    Returns:
+        tuple: (preflop_normalized, postflop_normalized) antal normaliserade scores
+    """
+    print("📊 Analyserar score-distribution...")
+    
+    preflop_normalized = normalize_score_column(con, "preflop", rescale)
+    postflop_normalized = normalize_score_column(con, "postflop", rescale)
     con.commit()
     
     print(f"✅ Normaliserade {preflop_normalized:,} preflop scores till 1-100 skala")
@@ -486,7 +466,7 @@ def normalize_scores_to_100_scale(con: sqlite3.Connection) -> tuple[int, int]:
     return preflop_normalized, postflop_normalized
 
 # ────────────────────────────────────────────────────────────────
-# 5. Main-funktion
+# 4. Main-funktion
 # ────────────────────────────────────────────────────────────────
 def main():
     parser = argparse.ArgumentParser(description="Mappar scores till nya preflop_score och postflop_score kolumner")
@@ -494,6 +474,10 @@ def main():
     parser.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
     parser.add_argument("--stats-only", action="store_true", help="Visa endast statistik")
     parser.add_argument("--normalize", action="store_true", help="Normalisera scores till 1-100 skala")
+    parser.add_argument("--rescale", action="store_true",
+                        help="Ny kalibrering och full omskalning av alla scores")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignorera etl_queue och mappa alla actions utan scores")
     args = parser.parse_args()
     
     db_path = Path(args.db).expanduser().resolve() if args.db else DEFAULT_DB
@@ -502,7 +486,7 @@ def main():
         sys.exit(f"❌ Hittar inte databasen: {db_path}")
     
     # Kolla att nödvändiga tabeller finns
-    con = sqlite3.connect(db_path)
+    con = connect(db_path)
     con.row_factory = sqlite3.Row
     
     tables = [row[0] for row in con.execute(
@@ -527,22 +511,31 @@ def main():
     # Säkerställ att score-kolumnerna finns
     ensure_score_columns(con)
     
+    # Äldre rader kan ha hand_id utan "Hand"-prefix → kanonisk form
+    if migrate_hand_ids(con, ("actions", "preflop_scores", "postflop_scores")):
+        con.commit()
+        print("🔄 hand_id migrerade till kanonisk form")
+    
     if args.verbose:
         print("📈 Skapar index för bättre prestanda...")
     
     # Skapa index för bättre prestanda
     create_missing_indexes(con)
     
+    # Bara händer i stegets del av etl_queue (allt första gången / --full)
+    seen, upto = queue_slice(con, WM_STAGE, AFTER, full=args.full)
+    scope = queue_filter("actions.hand_id", seen, upto)
+    
     # Räkna rader som behöver uppdateras
     cur = con.cursor()
-    preflop_missing = cur.execute("""
+    preflop_missing = cur.execute(f"""
         SELECT COUNT(*) FROM actions 
-        WHERE street = 'preflop' AND preflop_score IS NULL
+        WHERE street = 'preflop' AND preflop_score_raw IS NULL AND {scope}
     """).fetchone()[0]
     
-    postflop_missing = cur.execute("""
+    postflop_missing = cur.execute(f"""
         SELECT COUNT(*) FROM actions 
-        WHERE street != 'preflop' AND postflop_score IS NULL
+        WHERE street != 'preflop' AND postflop_score_raw IS NULL AND {scope}
     """).fetchone()[0]
     
     if args.verbose:
@@ -553,7 +546,7 @@ def main():
     if preflop_missing > 0:
         if args.verbose:
             print("🔄 Mappar preflop scores...")
-        preflop_updated = map_preflop_scores(con)
+        preflop_updated = map_preflop_scores(con, scope)
         print(f"✅ Preflop: {preflop_updated:,} actions fick scores")
     else:
         preflop_updated = 0
@@ -564,13 +557,16 @@ def main():
     if postflop_missing > 0:
         if args.verbose:
             print("🔄 Mappar postflop scores...")
-        postflop_updated = map_postflop_scores(con)
+        postflop_updated = map_postflop_scores(con, scope)
         print(f"✅ Postflop: {postflop_updated:,} actions fick scores")
     else:
         postflop_updated = 0
         if args.verbose:
             print("⏭️  Postflop: inga scores att mappa")
     
+    mark_queue(con, WM_STAGE, upto)
+    con.commit()
+    
     # Slutrapport
     total_updated = preflop_updated + postflop_updated
     if total_updated > 0:
@@ -578,9 +574,9 @@ def main():
     else:
         print("ℹ️  Inga nya scores att mappa")
     
-    # Normalisera scores till 1-100 skala (körs alltid eller med --normalize flag)
+    # Normalisera nya scores till 1-100 skala (full omskalning bara vid behov)
     print("\n🔧 Normaliserar scores till 1-100 skala...")
-    normalize_scores_to_100_scale(con)
+    normalize_scores_to_100_scale(con, args.rescale)
     
     # Visa statistik
     show_statistics(con, args.verbose)
@@ -6,6 +6,24 @@
 ▪ player_summary          – one row per player for /player/{id}/stats & comparison
 
 Run this right after 7_input_scores.py in the ETL chain.
+
+Incremental: additive per-player counters (player_counters) and global
+counters (dashboard_counters) are merged from the hands in this stage's slice
+of etl_queue (the hands queued by 1_build_heavy_analysis.py that stages 3–7
+have finished).  player_summary is a view over the counters,
+so averages are derived at read time.  --full, or a new score calibration
+version from 7_input_scores.py, rebuilds the counters from scratch.
+
+Tilt and bet deviance come from rolling feature tables updated the same way:
+player_features (previous-hand result, j_score sums after losing/winning
+hands, size-deviance sums) and size_stats (population raise sizes per
+street/label).  A batch's raises are compared with the population average
+as of that batch; a full rebuild compares everything with today's average.
+
+Readers never see a missing table: dashboard_summary and top25_players are
+built as *_next tables and renamed into place in one short transaction, which
+also bumps the published generation (dashboard_state 'generation' and the
+generation column of dashboard_summary).
 """
 from __future__ import annotations
 import sqlite3
@@ -18,31 +36,219 @@ import logging
 ROOT = Path(__file__).resolve().parents[2]  # project root
 sys.path.append(str(ROOT))
 from utils.paths import HEAVY_DB, IS_RENDER  # noqa
+sys.path.append(str(Path(__file__).resolve().parent))
+from script_paths import connect  # noqa
+from etl_state import queue_slice, mark_queue  # noqa
 
 log = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)8s  %(message)s")
 
 def get_db(path: Path | str | None = None) -> sqlite3.Connection:
     db_path = Path(path) if path else HEAVY_DB
     db_path.parent.mkdir(parents=True, exist_ok=True)
-    con = sqlite3.connect(db_path)
+    con = connect(db_path)
     con.row_factory = sqlite3.Row
     # Slight pragmas – these tables are tiny so WAL isn't strictly needed
     con.execute("PRAGMA journal_mode=WAL")
     return con
 
 # ---------------------------------------------------------------------------
-# Dashboard summary (single row)
+# Additive counters – merged from new hands only
+WM_STAGE = "8_materialise_dashboard"
+# Stages whose columns the counters read – the slice never runs ahead of them
+AFTER = ("3_size_cat", "4_action_label", "5_add_j_score", "7_input_scores")
+
+COUNTERS_DDL = """
+CREATE TABLE IF NOT EXISTS player_counters(
+    player_id        TEXT,
+    nickname         TEXT,
+    total_hands      INTEGER,
+    total_actions    INTEGER,
+    j_sum            REAL,    j_cnt     INTEGER,
+    vpip_cnt         INTEGER,
+    pfr_cnt          INTEGER,
+    preflop_actions  INTEGER,
+    pre_sum          REAL,    pre_cnt   INTEGER,
+    post_sum         REAL,    post_cnt  INTEGER,
+    winnings_sum     REAL,
+    bb_sum           REAL,    bb_cnt    INTEGER,
+    solver_cnt       INTEGER,
+    solver_yes_cnt   INTEGER,
+    river_calls      INTEGER,
+    river_calls_won  INTEGER,
+    PRIMARY KEY(player_id, nickname)
+);
+CREATE TABLE IF NOT EXISTS dashboard_counters(
+    id            INTEGER PRIMARY KEY CHECK (id = 0),
+    total_hands   INTEGER,
+    total_actions INTEGER,
+    vpip_cnt      INTEGER,
+    pfr_cnt       INTEGER,
+    j_sum         REAL,
+    j_cnt         INTEGER
+);
+CREATE TABLE IF NOT EXISTS player_features(
+    player_id        TEXT PRIMARY KEY,
+    last_hand_rowid  INTEGER,           -- hand_info rowid of the latest hand
+    last_money_won   REAL,              -- … and its result (previous hand for the next batch)
+    loss_j_sum       REAL,    loss_j_cnt  INTEGER,   -- j_score after a losing hand
+    win_j_sum        REAL,    win_j_cnt   INTEGER,   -- j_score after a non-losing hand
+    dev_sum          REAL,    dev_cnt     INTEGER    -- |size - avg size| / avg size * 100
+);
+CREATE TABLE IF NOT EXISTS size_stats(
+    street        TEXT,
+    action_label  TEXT,
+    n             INTEGER,
+    size_sum      REAL,
+    PRIMARY KEY(street, action_label)
+);
+CREATE TABLE IF NOT EXISTS dashboard_state(
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# The hands being merged (queue slice, or every hand on a full rebuild)
+MERGE_HANDS_DDL = "CREATE TEMP TABLE IF NOT EXISTS merge_hands(hand_id TEXT PRIMARY KEY)"
+
+# Actions of the hands being merged
+NEW_ACTIONS = """
+    FROM actions a
+    WHERE a.hand_id IN (SELECT hand_id FROM merge_hands)
+      AND a.player_id IS NOT NULL AND a.player_id!=''
+"""
+
+MERGE_PLAYER_SQL = f"""
+INSERT INTO player_counters
+SELECT 
+    a.player_id,
+    a.nickname,
+    COUNT(DISTINCT a.hand_id),
+    COUNT(a.action_order),
+    TOTAL(a.j_score),                                           COUNT(a.j_score),
+    SUM(CASE WHEN a.action!='f' AND a.street='preflop' THEN 1 ELSE 0 END),
+    SUM(CASE WHEN a.action='r'  AND a.street='preflop' THEN 1 ELSE 0 END),
+    SUM(CASE WHEN a.street='preflop' THEN 1 ELSE 0 END),
+    TOTAL(a.preflop_score),                                     COUNT(a.preflop_score),
+    TOTAL(a.postflop_score),                                    COUNT(a.postflop_score),
+    TOTAL(p.money_won),
+    TOTAL(h.big_blind),                                         COUNT(h.big_blind),
+    COUNT(CASE WHEN a.solver_best IS NOT NULL THEN 1 END),
+    COUNT(CASE WHEN a.solver_best = 'y' THEN 1 END),
+    COUNT(CASE WHEN a.street='river' AND a.action_label='call' THEN 1 END),
+    COUNT(CASE WHEN a.street='river' AND a.action_label='call'
+                AND p.money_won>0 THEN 1 END)
+FROM actions a
+LEFT JOIN players   p ON p.hand_id=a.hand_id AND p.position=a.position
+LEFT JOIN hand_info h ON h.hand_id=a.hand_id
+WHERE a.hand_id IN (SELECT hand_id FROM merge_hands)
+  AND a.player_id IS NOT NULL AND a.player_id!=''
+GROUP BY a.player_id, a.nickname
+ON CONFLICT(player_id, nickname) DO UPDATE SET
+    {", ".join(f"{c} = {c} + excluded.{c}" for c in (
+        "total_hands", "total_actions", "j_sum", "j_cnt", "vpip_cnt", "pfr_cnt",
+        "preflop_actions", "pre_sum", "pre_cnt", "post_sum", "post_cnt",
+        "winnings_sum", "bb_sum", "bb_cnt", "solver_cnt", "solver_yes_cnt",
+        "river_calls", "river_calls_won"))};
+"""
+
+MERGE_DASHBOARD_SQL = f"""
+INSERT INTO dashboard_counters
+SELECT 
+    0,
+    COUNT(DISTINCT a.hand_id),
+    COUNT(a.action_order),
+    SUM(CASE WHEN a.action!='f' AND a.street='preflop' THEN 1 ELSE 0 END),
+    SUM(CASE WHEN a.action='r'  AND a.street='preflop' THEN 1 ELSE 0 END),
+    TOTAL(a.j_score),
+    COUNT(a.j_score)
+{NEW_ACTIONS}
+ON CONFLICT(id) DO UPDATE SET
+    {", ".join(f"{c} = {c} + COALESCE(excluded.{c}, 0)" for c in (
+        "total_hands", "total_actions", "vpip_cnt", "pfr_cnt", "j_sum", "j_cnt"))};
+"""
+
+# Rolling features for top25_players ------------------------------------------
+# Raises of the new hands
+NEW_RAISES = """
+    FROM actions a
+    WHERE a.hand_id IN (SELECT hand_id FROM merge_hands)
+      AND a.action='r'  AND a.size_frac IS NOT NULL AND a.action_label IS NOT NULL
+"""
+
+MERGE_SIZE_STATS_SQL = f"""
+INSERT INTO size_stats
+SELECT a.street, a.action_label, COUNT(*), TOTAL(a.size_frac)
+{NEW_RAISES}
+GROUP BY a.street, a.action_label
+ON CONFLICT(street, action_label) DO UPDATE SET
+    n        = n + excluded.n,
+    size_sum = size_sum + excluded.size_sum;
+"""
+
+# One row per (player, new hand): result + j_score sums; prev = result of the
+# player's previous hand (from player_features for the first hand in the batch)
+MERGE_FEATURES_SQL = """
+WITH hands AS (
+    SELECT a.player_id, h.rowid AS hand_rowid, p.money_won,
+           TOTAL(a.j_score) AS j_sum, COUNT(a.j_score) AS j_cnt
+    FROM   actions a
+    JOIN   hand_info h ON h.hand_id=a.hand_id
+    JOIN   players   p ON p.hand_id=a.hand_id AND p.position=a.position
+    WHERE  a.hand_id IN (SELECT hand_id FROM merge_hands)
+      AND  a.player_id IS NOT NULL AND a.player_id!=''
+    GROUP  BY a.player_id, h.rowid
+),
+seq AS (
+    SELECT h.*,
+           COALESCE(LAG(h.money_won) OVER (PARTITION BY h.player_id ORDER BY h.hand_rowid),
+                    f.last_money_won) AS prev_money_won
+    FROM   hands h
+    LEFT JOIN player_features f ON f.player_id = h.player_id
+),
+dev AS (
+    SELECT a.player_id,
+           TOTAL(ABS(a.size_frac - s.size_sum/s.n) / NULLIF(s.size_sum/s.n,0) * 100) AS dev_sum,
+           COUNT(ABS(a.size_frac - s.size_sum/s.n) / NULLIF(s.size_sum/s.n,0))       AS dev_cnt
+    FROM   actions a
+    JOIN   size_stats s ON s.street=a.street AND s.action_label=a.action_label
+    WHERE  a.hand_id IN (SELECT hand_id FROM merge_hands)
+      AND  a.action='r'  AND a.size_frac IS NOT NULL
+    GROUP  BY a.player_id
+)
+INSERT INTO player_features
+SELECT q.player_id,
+       MAX(q.hand_rowid), q.money_won,          -- bare column → row with MAX(hand_rowid)
+       TOTAL(CASE WHEN q.prev_money_won<0  THEN q.j_sum END),
+       TOTAL(CASE WHEN q.prev_money_won<0  THEN q.j_cnt END),
+       TOTAL(CASE WHEN q.prev_money_won>=0 THEN q.j_sum END),
+       TOTAL(CASE WHEN q.prev_money_won>=0 THEN q.j_cnt END),
+       COALESCE(d.dev_sum, 0), COALESCE(d.dev_cnt, 0)
+FROM   seq q
+LEFT JOIN dev d ON d.player_id = q.player_id
+WHERE  true
+GROUP  BY q.player_id
+ON CONFLICT(player_id) DO UPDATE SET
+    last_hand_rowid = excluded.last_hand_rowid,
+    last_money_won  = excluded.last_money_won,
+    loss_j_sum      = loss_j_sum + excluded.loss_j_sum,
+    loss_j_cnt      = loss_j_cnt + excluded.loss_j_cnt,
+    win_j_sum       = win_j_sum  + excluded.win_j_sum,
+    win_j_cnt       = win_j_cnt  + excluded.win_j_cnt,
+    dev_sum         = dev_sum    + excluded.dev_sum,
+    dev_cnt         = dev_cnt    + excluded.dev_cnt;
+"""
+
+# ---------------------------------------------------------------------------
+# Dashboard summary (single row) – derived from the global counters
 DASHBOARD_SQL = """
 SELECT 
-    COUNT(DISTINCT player_id)                       AS total_players,
-    COUNT(DISTINCT hand_id)                         AS total_hands,
-    AVG(CASE WHEN action!='f' AND street='preflop' THEN 1 ELSE 0 END)*100  AS avg_vpip,
-    AVG(CASE WHEN action='r'  AND street='preflop' THEN 1 ELSE 0 END)*100  AS avg_pfr,
-    AVG(j_score)                                    AS avg_j_score,
-    COUNT(action_order)                             AS total_actions
-FROM actions
-WHERE player_id IS NOT NULL AND player_id!='';
+    (SELECT COUNT(DISTINCT player_id) FROM player_counters)   AS total_players,
+    total_hands                                               AS total_hands,
+    vpip_cnt*100.0/NULLIF(total_actions,0)                    AS avg_vpip,
+    pfr_cnt*100.0/NULLIF(total_actions,0)                     AS avg_pfr,
+    j_sum/NULLIF(j_cnt,0)                                     AS avg_j_score,
+    total_actions                                             AS total_actions
+FROM dashboard_counters;
 """
 
 # ---------------------------------------------------------------------------
@@ -79,98 +285,46 @@ LIMIT 25;
 """
 
 # ---------------------------------------------------------------------------
-# Player summary – one row / player; mirrors get_player_stats()
+# Player summary – one row / player; mirrors get_player_stats().
+# A view: averages are derived from the counters at read time.
 PLAYER_SUMMARY_SQL = """
 SELECT 
-    a.player_id                                                   AS player_id,
-    a.nickname                                                    AS nickname,
-    COUNT(DISTINCT a.hand_id)                                     AS total_hands,
-    COUNT(a.action_order)                                         AS total_actions,
-    AVG(a.j_score)                                                AS avg_j_score,
-    SUM(CASE WHEN a.action!='f' AND a.street='preflop' THEN 1 ELSE 0 END) AS vpip_cnt,
-    SUM(CASE WHEN a.action='r'  AND a.street='preflop' THEN 1 ELSE 0 END) AS pfr_cnt,
-    SUM(CASE WHEN a.street='preflop' THEN 1 END)                 AS preflop_actions,
-    ROUND(AVG(a.preflop_score),1)                                 AS avg_preflop_score,
-    ROUND(AVG(a.postflop_score),1)                                AS avg_postflop_score
-FROM actions a
-WHERE a.player_id IS NOT NULL AND a.player_id!=''
-GROUP BY a.player_id, a.nickname;
+    player_id,
+    nickname,
+    total_hands,
+    total_actions,
+    j_sum/NULLIF(j_cnt,0)                                         AS avg_j_score,
+    vpip_cnt,
+    pfr_cnt,
+    NULLIF(preflop_actions,0)                                     AS preflop_actions,
+    ROUND(pre_sum/NULLIF(pre_cnt,0),1)                            AS avg_preflop_score,
+    ROUND(post_sum/NULLIF(post_cnt,0),1)                          AS avg_postflop_score
+FROM player_counters;
 """
 
 
 TOP_PLAYERS_SQL_FMT = """
 WITH base AS (
+    /* from player_counters – same figures as aggregating all actions */
     SELECT
-        a.player_id,
-        a.nickname,
-        COUNT(DISTINCT a.hand_id)                           AS hands_played,
-        ROUND(AVG(a.j_score),1)                             AS avg_j_score,
-        ROUND(AVG(CASE WHEN a.action!='f'
-                       AND a.street='preflop' THEN 1 END)*100,1)         AS vpip,
-        ROUND(AVG(CASE WHEN a.action='r'
-                       AND a.street='preflop' THEN 1 END)*100,1)         AS pfr,
-        ROUND(AVG(a.preflop_score),1)                       AS avg_preflop_score,
-        ROUND(AVG(a.postflop_score),1)                      AS avg_postflop_score,
+        player_id,
+        nickname,
+        total_hands                                         AS hands_played,
+        ROUND(j_sum/NULLIF(j_cnt,0),1)                      AS avg_j_score,
+        /* AVG(CASE … THEN 1 END)*100 is 100 as soon as one row matches */
+        CASE WHEN vpip_cnt>0 THEN 100.0 END                 AS vpip,
+        CASE WHEN pfr_cnt>0  THEN 100.0 END                 AS pfr,
+        ROUND(pre_sum/NULLIF(pre_cnt,0),1)                  AS avg_preflop_score,
+        ROUND(post_sum/NULLIF(post_cnt,0),1)                AS avg_postflop_score,
 
         /* needed for win-rate */
-        SUM(p.money_won)                                    AS total_winnings,
-        AVG(h.big_blind)                                    AS avg_big_blind,
-
-        /* counts for solver precision */
-        COUNT(CASE WHEN a.solver_best IS NOT NULL THEN 1 END) AS solver_cnt,
-        COUNT(CASE WHEN a.solver_best = 'y' THEN 1 END)       AS solver_yes_cnt,
-
-        /* counts for river calldown accuracy */
-        COUNT(CASE WHEN a.street='river'
-                    AND a.action_label='call' THEN 1 END)       AS river_calls,
-        COUNT(CASE WHEN a.street='river'
-                    AND a.action_label='call'
-                    AND p.money_won>0 THEN 1 END)               AS river_calls_won
-    FROM   actions a
-    LEFT JOIN players   p ON p.hand_id=a.hand_id AND p.position=a.position
-    LEFT JOIN hand_info h ON h.hand_id=a.hand_id
-    WHERE  a.player_id IS NOT NULL AND a.player_id!=''
-    GROUP  BY a.player_id, a.nickname
-    HAVING COUNT(DISTINCT a.hand_id) > 10
-),
-
-/* average raise-size per street + label → for deviance calc */
-avg_sizes AS (
-    SELECT street, action_label, AVG(size_frac) AS avg_size
-    FROM   actions
-    WHERE  action='r' AND size_frac IS NOT NULL
-    GROUP  BY street, action_label
-),
-
-bet_dev AS (
-    SELECT
-        a.player_id,
-        ROUND(AVG(
-            ABS(a.size_frac - s.avg_size) / NULLIF(s.avg_size,0) * 100
-        ),0) AS bet_deviance
-    FROM   actions a
-    JOIN   avg_sizes s
-           ON s.street=a.street AND s.action_label=a.action_label
-    WHERE  a.action='r' AND a.size_frac IS NOT NULL
-    GROUP  BY a.player_id
-),
+        winnings_sum                                        AS total_winnings,
+        bb_sum/NULLIF(bb_cnt,0)                             AS avg_big_blind,
 
-tilt AS (
-    /* performance drop after a losing hand */
-    SELECT player_id,
-           ROUND(100 - (
-               AVG(CASE WHEN prev_money_won<0  THEN j_score END) /
-               NULLIF(AVG(CASE WHEN prev_money_won>=0 THEN j_score END),0)
-           )*100,0) AS tilt_factor
-    FROM (
-        SELECT a.player_id,
-               a.j_score,
-               LAG(p.money_won) OVER (PARTITION BY a.player_id ORDER BY a.hand_id)
-                   AS prev_money_won
-        FROM   actions a
-        JOIN   players p ON p.hand_id=a.hand_id AND p.position=a.position
-    )
-    GROUP BY player_id
+        /* counts for solver precision and river calldown accuracy */
+        solver_cnt, solver_yes_cnt, river_calls, river_calls_won
+    FROM   player_counters
+    WHERE  total_hands > 10
 )
 
 SELECT
@@ -197,12 +351,16 @@ SELECT
     ROUND(CASE WHEN b.river_calls>0
                THEN b.river_calls_won*100.0 / b.river_calls
           END, 0)                                    AS calldown_accuracy,
-    d.bet_deviance,
-    t.tilt_factor
+    /* from player_features */
+    ROUND(f.dev_sum / NULLIF(f.dev_cnt,0), 0)       AS bet_deviance,
+    /* performance drop after a losing hand */
+    ROUND(100 - (
+        (f.loss_j_sum / NULLIF(f.loss_j_cnt,0)) /
+        NULLIF(f.win_j_sum / NULLIF(f.win_j_cnt,0), 0)
+    )*100, 0)                                        AS tilt_factor
 
 FROM   base      b
-LEFT JOIN bet_dev d ON d.player_id = b.player_id
-LEFT JOIN tilt    t ON t.player_id = b.player_id
+LEFT JOIN player_features f ON f.player_id = b.player_id
 ORDER  BY total_hands DESC
 LIMIT  {limit};
 """.strip()
@@ -214,39 +372,132 @@ CREATE INDEX IF NOT EXISTS idx_actions_street_action ON actions(street, action);
 CREATE INDEX IF NOT EXISTS idx_actions_player_hand   ON actions(player_id, hand_id);
 """
 
-def rebuild_tables(con: sqlite3.Connection) -> None:
+def _calibration(con: sqlite3.Connection) -> str:
+    """Score calibration versions from 7_input_scores.py (normalised scores depend on them)."""
+    if not con.execute("SELECT 1 FROM sqlite_master WHERE name='score_calibration'").fetchone():
+        return ""
+    return ",".join(f"{k}:{v}" for k, v in con.execute(
+        "SELECT score, version FROM score_calibration ORDER BY score"))
+
+def merge_counters(con: sqlite3.Connection, seen: int | None, upto: int) -> int:
+    """
+    Merges the queued hands seen < seq <= upto into the counters (from
+    queue_slice); seen=None starts over from every hand.
+    Returns the number of hands merged.
+    """
+    cur = con.cursor()
+    calibration = _calibration(con)
+    row = cur.execute("SELECT value FROM dashboard_state WHERE key='calibration'").fetchone()
+    cur.execute(MERGE_HANDS_DDL)
+    cur.execute("DELETE FROM merge_hands")
+    if seen is None or (row[0] if row else "") != calibration:
+        # First run, --full or rescaled scores → start over.  Queued hands past
+        # upto are left for the incremental runs – progress is only marked up
+        # to upto, so merging them now would count them twice.
+        for table in ("player_counters", "dashboard_counters", "player_features", "size_stats"):
+            cur.execute(f"DELETE FROM {table}")
+        cur.execute("""
+            INSERT OR IGNORE INTO merge_hands
+            SELECT hand_id FROM hand_info
+            WHERE hand_id NOT IN (SELECT hand_id FROM etl_queue WHERE seq > ?)
+        """, (upto,))
+    else:
+        cur.execute("INSERT OR IGNORE INTO merge_hands SELECT hand_id FROM etl_queue"
+                    " WHERE seq > ? AND seq <= ?", (seen, upto))
+
+    new_hands = cur.execute("SELECT COUNT(*) FROM merge_hands").fetchone()[0]
+    if new_hands:
+        cur.execute(MERGE_PLAYER_SQL)
+        cur.execute(MERGE_DASHBOARD_SQL)
+        cur.execute(MERGE_SIZE_STATS_SQL)      # before the deviance uses it
+        cur.execute(MERGE_FEATURES_SQL)
+    mark_queue(con, WM_STAGE, upto)
+    cur.execute("INSERT OR REPLACE INTO dashboard_state VALUES ('calibration', ?)", (calibration,))
+    return new_hands
+
+# Swapped tables: name → (SELECT, index DDL run after the rename)
+SHADOW_TABLES = {
+    "dashboard_summary": (DASHBOARD_SQL, ()),
+    "top25_players":     (TOP_PLAYERS_SQL_FMT.format(limit=25),
+                          ("CREATE INDEX idx_top25_player_id ON top25_players(player_id)",)),
+}
+
+def current_generation(con: sqlite3.Connection) -> int:
+    row = con.execute("SELECT value FROM dashboard_state WHERE key='generation'").fetchone()
+    return int(row[0]) if row else 0
+
+def swap_in(con: sqlite3.Connection, generation: int) -> None:
+    """Renames every *_next table into place and publishes the generation – one short transaction."""
+    cur = con.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        for name, (_, indexes) in SHADOW_TABLES.items():
+            cur.execute(f"DROP TABLE IF EXISTS {name}")
+            cur.execute(f"ALTER TABLE {name}_next RENAME TO {name}")
+            for ddl in indexes:
+                cur.execute(ddl)
+
+        # player_summary is a view over player_counters
+        kind = cur.execute("SELECT type FROM sqlite_master WHERE name='player_summary'").fetchone()
+        if kind and kind[0] == "table":           # materialised table from older versions
+            cur.execute("DROP TABLE player_summary")
+            kind = None
+        if not kind:
+            cur.execute(f"CREATE VIEW player_summary AS {PLAYER_SUMMARY_SQL}")
+
+        cur.execute("INSERT OR REPLACE INTO dashboard_state VALUES ('generation', ?)",
+                    (str(generation),))
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
+
+def rebuild_tables(con: sqlite3.Connection, full: bool = False) -> None:
     cur = con.cursor()
 
-    # 1. dashboard_summary ---------------------------------------------------
-    cur.executescript("DROP TABLE IF EXISTS dashboard_summary;")
-    cur.execute(f"CREATE TABLE dashboard_summary AS {DASHBOARD_SQL}")
-
-    # 2. top25_players -------------------------------------------------------
-    cur.executescript("DROP TABLE IF EXISTS top25_players;")
-    cur.execute(f"CREATE TABLE top25_players AS {TOP_PLAYERS_SQL_FMT.format(limit=25)}")
-    cur.execute("CREATE INDEX idx_top25_player_id ON top25_players(player_id);")
-
-    # 3. player_summary ------------------------------------------------------
-    cur.executescript("DROP TABLE IF EXISTS player_summary;")
-    cur.execute(f"CREATE TABLE player_summary AS {PLAYER_SUMMARY_SQL}")   # ← add CREATE TABLE
-    cur.execute("CREATE INDEX idx_ps_player_id ON player_summary(player_id);")
+    # Schema first – executescript commits, so it stays outside the transactions below
+    con.commit()
+    cur.executescript(COUNTERS_DDL + DDL_INDEXES)
 
-    cur.executescript(DDL_INDEXES)
+    # 1. counters + *_next tables (readers keep seeing the previous generation)
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        seen, upto = queue_slice(con, WM_STAGE, AFTER, full=full)
+        merged = merge_counters(con, seen, upto)
+        generation = current_generation(con) + 1
+        for name, (select, _) in SHADOW_TABLES.items():
+            cur.execute(f"DROP TABLE IF EXISTS {name}_next")
+            if name == "dashboard_summary":
+                select = f"SELECT *, {generation} AS generation FROM ({select.rstrip().rstrip(';')})"
+            cur.execute(f"CREATE TABLE {name}_next AS {select}")
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
 
-    con.commit()
+    # 2. swap ----------------------------------------------------------------
+    swap_in(con, generation)
 
-    log.info("✅  Tables materialized.")
+    log.info("✅  Tables materialized (generation %d, %d new hands merged).", generation, merged)
 
 
 # ---------------------------------------------------------------------------
-if __name__ == "__main__":
+def main() -> None:
     import argparse
     parser = argparse.ArgumentParser(description="Materialise dashboard & player summary tables")
     parser.add_argument("--db", help="Path to heavy_analysis.db (defaults to utils.paths.HEAVY_DB)")
+    parser.add_argument("--full", action="store_true",
+                        help="Rebuild the counters from all hands instead of merging new ones")
     args = parser.parse_args()
 
     con = get_db(args.db)
     try:
-        rebuild_tables(con)
+        rebuild_tables(con, args.full)
     finally:
         con.close()
+
+
+if __name__ == "__main__":
+    # Bara fristående – in-process (etl_pipeline) ska inte konfigurera root-loggern
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)8s  %(message)s")
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+enrich_actions.py – steg 3–6 i ett enda pass (valfritt)
+──────────────────────────────────────────────────────────────────
+Läser varje köad hands actions EN gång (i PK-ordning) och räknar i minnet:
+
+• size_frac + size_cat       (3_size_cat.py)
+• action_label + ip_status   (4_action_label.py)
+• j_score                    (5_add_j_score.py)
+• intention                  (6_intention.py)
+
+Alla kolumner skrivs med en UPDATE per rad i stället för fyra läs- och
+skrivpass över samma rader. Logiken hämtas från de fristående scripten, som
+finns kvar för riktade omräkningar – redan satta värden skrivs inte över.
+Progress markeras i etl_queue för alla fyra stegen.
+
+Kör:  python enrich_actions.py [-db X.db] [--range range.txt] [--full]
+      python etl_pipeline.py --fused      # ersätter steg 3–6 i kedjan
+"""
+
+from __future__ import annotations
+import argparse, sqlite3, sys
+from itertools import groupby
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent))
+from script_paths import DST_DB, connect, check_deadline
+from etl_state import queue_slice, queue_filter, mark_queue
+from etl_pipeline import SCRIPTS_DIR, load_stage
+
+DEFAULT_DB = DST_DB  # Använder centraliserad path-hantering
+FUSED_STAGES = ("3_size_cat", "4_action_label", "5_add_j_score", "6_intention")
+FLUSH_ROWS = 20_000
+
+size_cat, action_label, j_score, intention = (
+    load_stage(SCRIPTS_DIR / f"{stage}.py") for stage in FUSED_STAGES)
+
+# ────────────────────────────────────────────────────────────────
+# 1. SQL
+# ────────────────────────────────────────────────────────────────
+# Rader som något av de fyra stegen fortfarande behöver
+PENDING = """(
+       (size_cat IS NULL AND (action LIKE 'r%' OR action LIKE 'b%'))
+    OR action_label IS NULL OR j_score IS NULL OR intention IS NULL)"""
+
+# Alla rader för händer med minst en ofullständig rad, i PK-ordning
+STREAM_SQL = """
+SELECT a.rowid, a.hand_id, a.street, a.position, a.action, a.amount_to,
+       a.invested_this_action AS inv, a.pot_before AS pb,
+       a.holecards, a.board_cards,
+       a.size_frac, a.size_cat, a.action_label, a.ip_status, a.j_score, a.intention,
+       hi.big_blind AS bb, hi.hand_id IS NOT NULL AS has_info
+FROM actions a
+LEFT JOIN hand_info hi ON hi.hand_id = a.hand_id
+WHERE a.hand_id IN (SELECT hand_id FROM actions WHERE {pending} AND {scope})
+ORDER BY a.hand_id, a.action_order
+"""
+
+SQL_UPD = """
+UPDATE actions SET size_frac=?, size_cat=?, action_label=?, ip_status=?,
+                   j_score=?, intention=?
+WHERE rowid=?
+"""
+
+# ────────────────────────────────────────────────────────────────
+# 2. en hand i minnet
+# ────────────────────────────────────────────────────────────────
+def size_fields(r: sqlite3.Row) -> tuple[float | None, str]:
+    """size_frac + size_cat som 3_size_cat.update_sql() (NULL-nämnare → 'unknown')."""
+    if (r["street"] or "").lower() == "preflop":
+        frac = r["amount_to"] / r["bb"] if r["amount_to"] is not None and r["bb"] else None
+    else:
+        frac = r["inv"] / r["pb"] if r["inv"] is not None and r["pb"] else None
+    return frac, ("unknown" if frac is None else size_cat.label(float(frac), r["street"]))
+
+def enrich_hand(rows: list[sqlite3.Row], hid: str, act_tr,
+                intentions) -> list[tuple]:
+    """En hands rader → UPDATE-parametrar för rader där något saknades."""
+    labels = action_label.process_hand(rows, hid, act_tr)
+    out = []
+    for r, (label, ip, _rid) in zip(rows, labels):
+        frac, cat = r["size_frac"], r["size_cat"]
+        act = (r["action"] or "").lower()
+        if cat is None and r["has_info"] and act.startswith(("r", "b")):
+            frac, cat = size_fields(r)
+        if r["action_label"] is not None:
+            label, ip = r["action_label"], r["ip_status"]
+        j = r["j_score"] if r["j_score"] is not None else j_score.score_row(r)
+        intent = r["intention"]
+        if intent is None:
+            intent = intentions.lookup(r["street"], label, j, r["inv"], r["pb"])
+        new = (frac, cat, label, ip, j, intent)
+        if new != (r["size_frac"], r["size_cat"], r["action_label"], r["ip_status"],
+                   r["j_score"], r["intention"]):
+            out.append((*new, r["rowid"]))
+    return out
+
+# ────────────────────────────────────────────────────────────────
+# 3. main
+# ────────────────────────────────────────────────────────────────
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Steg 3–6 (size_cat, action_label, j_score, intention) i ett pass")
+    ap.add_argument("-db", "--database", help="sökväg till heavy_analysis.db")
+    ap.add_argument("--range", help="Egen path till range.txt")
+    ap.add_argument("--full", action="store_true",
+                    help="Ignorera etl_queue och berika alla ofullständiga händer")
+    args = ap.parse_args()
+
+    db = Path(args.database).expanduser().resolve() if args.database else DEFAULT_DB
+    if not db.exists():
+        sys.exit(f"❌ Hittar inte databasen: {db}")
+
+    j_score.load_range(args.range)
+    con = connect(db)
+    con.row_factory = sqlite3.Row
+    j_score.ensure_col(con)
+    size_cat.ensure_cols(con)
+    action_label.ensure_cols(con)
+    intention.ensure_intention_column(con)
+    con.commit()
+
+    # Kön från det steg som ligger längst bak (alla fyra markeras efteråt)
+    slices = [queue_slice(con, stage, full=args.full) for stage in FUSED_STAGES]
+    seen = None if any(s is None for s, _ in slices) else min(s for s, _ in slices)
+    upto = max(u for _, u in slices)
+    scope = queue_filter("hand_id", seen, upto)
+
+    act_tr = action_label.ActionTracker()
+    intentions = intention.IntentionTable(intention.JSON_ROOT)
+    total, batch = 0, []
+
+    def flush():
+        nonlocal total
+        con.executemany(SQL_UPD, batch)
+        con.commit()
+        total += len(batch); batch.clear()
+
+    cur = con.cursor()
+    for hid, rows in groupby(cur.execute(STREAM_SQL.format(pending=PENDING, scope=scope)),
+                             key=lambda r: r["hand_id"]):
+        check_deadline()
+        batch.extend(enrich_hand(list(rows), hid, act_tr, intentions))
+        if len(batch) >= FLUSH_ROWS:
+            flush()
+            print(f"✓ {total:,} actions berikade …")
+
+    if batch:
+        flush()
+    for stage in FUSED_STAGES:
+        mark_queue(con, stage, upto)
+    con.commit()
+    con.close()
+    print(f"✅ klart – {total:,} actions fick size_cat, action_label, j_score och intention")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+etl_pipeline.py – kör processing-scripten 1_*.py … 9_*.py i en och samma process
+──────────────────────────────────────────────────────────────────────────────
+Ersätter en `python <script>`-subprocess per steg och batch:
+
+• Varje steg importeras en gång (modulen cachas mellan batcherna) och dess
+  main() anropas med samma argv som vid `python <script>`.
+• Kopplingar som stegen öppnar via script_paths.connect() delas mellan
+  stegen och hålls öppna mellan batcherna.
+• Per-steg timeout – SQLite progress handler avbryter pågående query när
+  tiden gått ut, och stegens långa Python-loopar anropar
+  script_paths.check_deadline() – och felisolering: ett kraschat steg rullas
+  tillbaka och rapporteras, processen lever vidare. Timeouten är best-effort:
+  till skillnad från subprocess-läget dödas inget, så kod som varken kör SQL
+  eller når en check_deadline() (t.ex. ett jobb i en worker-process) körs
+  klart innan steget avbryts.
+
+Kör:  python etl_pipeline.py                             # alla steg i ordning
+      python etl_pipeline.py --fused                     # steg 3–6 som enrich_actions.py
+      python etl_pipeline.py --skip 2_preflop_scores.py  # hoppa över steg
+      python etl_pipeline.py 3_size_cat.py -db X.db      # ett steg, egna argument
+"""
+
+from __future__ import annotations
+import argparse, importlib.util, io, sqlite3, sys, time, traceback
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from pathlib import Path
+from types import ModuleType
+from typing import List, Sequence
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+sys.path.append(str(SCRIPTS_DIR))
+import script_paths  # noqa: E402
+
+DEFAULT_TIMEOUT = 300
+TIMEOUTS = {"7_input_scores": 600}      # script 7 kan ta längre tid
+
+# --fused: ett läs/skriv-pass över actions i stället för steg 3–6
+FUSED_STAGE = "enrich_actions"
+FUSED_REPLACES = ("3_size_cat", "4_action_label", "5_add_j_score", "6_intention")
+
+_MODULES: dict[Path, ModuleType] = {}
+
+# ────────────────────────────────────────────────────────────────
+# 1. hitta & ladda steg
+# ────────────────────────────────────────────────────────────────
+def find_stages(fused: bool = False) -> List[Path]:
+    """
+    Hittar alla script 1_*.py, 2_*.py etc i scripts/-mappen (i körordning).
+    fused=True ersätter steg 3–6 med enrich_actions.py på steg 3:s plats.
+    """
+    stages: List[Path] = []
+    for i in range(1, 10):
+        stages.extend(SCRIPTS_DIR.glob(f"{i}_*.py"))
+    stages = sorted(stages)
+    if fused:
+        at = next((i for i, p in enumerate(stages) if p.stem in FUSED_REPLACES), len(stages))
+        stages = [p for p in stages if p.stem not in FUSED_REPLACES]
+        stages.insert(at, SCRIPTS_DIR / f"{FUSED_STAGE}.py")
+    return stages
+
+def resolve_stage(name: str) -> Path:
+    """'3_size_cat.py', '3_size_cat' eller en sökväg → Path till steget."""
+    p = Path(name)
+    if p.is_file():
+        return p.resolve()
+    p = SCRIPTS_DIR / (name if name.endswith(".py") else f"{name}.py")
+    if not p.is_file():
+        raise SystemExit(f"❌ Okänt steg: {name}")
+    return p
+
+def load_stage(path: Path) -> ModuleType:
+    """Importerar ett steg en gång (filnamnen börjar med siffra → spec_from_file_location)."""
+    mod = _MODULES.get(path)
+    if mod is None:
+        name = f"etl_stage_{path.stem}"
+        spec = importlib.util.spec_from_file_location(name, path)
+        assert spec and spec.loader
+        mod = importlib.util.module_from_spec(spec)
+        sys.modules[name] = mod                 # krävs för pickling i process-pooler
+        try:
+            spec.loader.exec_module(mod)
+        except BaseException:
+            sys.modules.pop(name, None)
+            raise
+        if not callable(getattr(mod, "main", None)):
+            sys.modules.pop(name, None)
+            raise RuntimeError(f"{path.name} saknar main()")
+        _MODULES[path] = mod
+    return mod
+
+# ────────────────────────────────────────────────────────────────
+# 2. kör ett steg
+# ────────────────────────────────────────────────────────────────
+@dataclass
+class StageResult:
+    name: str
+    ok: bool
+    seconds: float
+    output: str = ""
+    error: str | None = None
+    timed_out: bool = False
+
+def run_stage(path: Path, argv: Sequence[str] = (), timeout: float | None = None,
+              capture: bool = True) -> StageResult:
+    """Kör stegets main() in-process. Fel och SystemExit != 0 fångas och rapporteras."""
+    if timeout is None:
+        timeout = TIMEOUTS.get(path.stem, DEFAULT_TIMEOUT)
+    script_paths.enable_shared_connections()
+
+    buf = io.StringIO()
+    old_argv = sys.argv
+    t0 = time.monotonic()
+    ok, error, timed_out = True, None, False
+    try:
+        sys.argv = [str(path), *argv]
+        script_paths.set_deadline(timeout)
+        if capture:
+            with redirect_stdout(buf):
+                load_stage(path).main()
+        else:
+            load_stage(path).main()
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            ok, error = False, str(e.code)
+    except script_paths.StageTimeout as e:
+        ok, error, timed_out = False, str(e), True
+    except sqlite3.OperationalError as e:
+        ok, error = False, str(e)
+        timed_out = "interrupted" in str(e) and time.monotonic() - t0 >= timeout
+    except Exception as e:
+        ok, error = False, f"{e.__class__.__name__}: {e}\n{traceback.format_exc(limit=5)}"
+    finally:
+        script_paths.set_deadline(None)
+        sys.argv = old_argv
+
+    # Felisolering: lämna aldrig en halv transaktion efter ett kraschat steg
+    for con in script_paths.shared_connections():
+        try:
+            if ok:
+                con.commit()
+            else:
+                con.rollback()
+        except sqlite3.Error:
+            pass
+
+    return StageResult(path.name, ok, time.monotonic() - t0,
+                       buf.getvalue(), error, timed_out)
+
+# ────────────────────────────────────────────────────────────────
+# 3. kör hela kedjan
+# ────────────────────────────────────────────────────────────────
+def run_all(skip: Sequence[str] | None = None, fused: bool = False) -> bool:
+    """Kör alla steg i ordning. Returnerar True om alla lyckades (avbryter vid första fel)."""
+    skip = skip or []
+    stages = find_stages(fused)
+    if not stages:
+        print("⚠️  Inga processing-scripts hittades")
+        return True
+
+    print(f"🛠️  Kör {len(stages)} processing-scripts (in-process)...")
+    success_count = 0
+    for path in stages:
+        if path.name in skip:
+            print(f"   ⏭️  {path.name} (hoppas över)")
+            continue
+
+        print(f"   🔧 {path.name}...", end=" ", flush=True)
+        res = run_stage(path)
+        if res.ok:
+            print(f"✅ ({res.seconds:.1f}s)")
+            success_count += 1
+            # Visa output från långsamma scripts
+            if "7_input_scores" in path.name and res.output:
+                for line in res.output.strip().split("\n")[-3:]:
+                    if line.strip():
+                        print(f"      {line}")
+        elif res.timed_out:
+            print("⏰ (timeout)")
+            return False
+        else:
+            print("❌")
+            print(f"      Fel: {res.error}")
+            return False
+
+    print(f"   ✅ Alla {success_count} scripts klara")
+    return True
+
+# ────────────────────────────────────────────────────────────────
+# 4. CLI
+# ────────────────────────────────────────────────────────────────
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Kör ETL-stegen in-process")
+    ap.add_argument("stage", nargs="?", help="Kör bara detta steg (t.ex. 3_size_cat.py)")
+    ap.add_argument("--skip", nargs="*", default=[], help="Steg att hoppa över")
+    ap.add_argument("--timeout", type=float, help="Timeout i sekunder för steget")
+    ap.add_argument("--fused", action="store_true",
+                    help="Kör steg 3–6 som ett pass (enrich_actions.py)")
+    args, rest = ap.parse_known_args()
+
+    try:
+        if args.stage:
+            # Samma output och exit-kod som `python <script> [args]`
+            res = run_stage(resolve_stage(args.stage), rest, args.timeout, capture=False)
+            if not res.ok:
+                sys.exit(f"❌ {res.name}: {'timeout' if res.timed_out else res.error}")
+        elif not run_all(args.skip, args.fused):
+            sys.exit(1)
+    finally:
+        script_paths.close_shared_connections()
+
+if __name__ == "__main__":
+    main()
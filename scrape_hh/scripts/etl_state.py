@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+etl_state.py – persistent ETL-progress i heavy_analysis.db
+──────────────────────────────────────────────────────────
+etl_watermark: ett rowid-watermark per (steg, källdatabas). Ett steg som
+läser poker.db behöver bara titta på rader med rowid > watermark. Bredvid
+rowid sparas radens id (last_key) – matchar den inte längre källan har
+poker.db byggts om och watermarket kastas.
+
+etl_queue: steg 1 lägger varje ny hand i kön (seq, hand_id) i samma
+transaktion som raderna. Senare steg läser bara sin del av kön – hand_id
+med seq > stegets progress (etl_watermark, source 'etl_queue') – och
+markerar progress när de är klara. Ett steg utan progress skannar allt.
+"""
+
+from __future__ import annotations
+import sqlite3
+from datetime import datetime
+from typing import Iterable
+
+# En sats per sträng: körs med execute (executescript committar anroparens transaktion)
+SCHEMA = ("""
+CREATE TABLE IF NOT EXISTS etl_watermark(
+    stage      TEXT,
+    source     TEXT,
+    last_rowid INTEGER,
+    last_key   TEXT,
+    updated_at TEXT,
+    PRIMARY KEY(stage, source)
+)""", """
+CREATE TABLE IF NOT EXISTS etl_queue(
+    seq     INTEGER PRIMARY KEY AUTOINCREMENT,
+    hand_id TEXT NOT NULL
+)""")
+
+# 2 = båda tabellerna finns och etl_watermark har last_key
+SCHEMA_CHECK = """
+SELECT (SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='etl_queue')
+     + (SELECT COUNT(*) FROM pragma_table_info('etl_watermark') WHERE name='last_key')
+"""
+
+QUEUE = "etl_queue"      # source i etl_watermark för kö-progress
+
+def ensure_state(con: sqlite3.Connection) -> None:
+    """
+    Skapar tabellerna om de saknas. Annars bara en läsning – inget committas,
+    så helpers kan anropas mitt i ett stegs transaktion.
+    """
+    if con.execute(SCHEMA_CHECK).fetchone()[0] == 2:
+        return
+    for stmt in SCHEMA:
+        con.execute(stmt)
+    cols = {r[1] for r in con.execute("PRAGMA table_info(etl_watermark)")}
+    if "last_key" not in cols:          # äldre heavy_analysis.db
+        con.execute("ALTER TABLE etl_watermark ADD COLUMN last_key TEXT")
+
+def get_watermark(con: sqlite3.Connection, stage: str, source: str) -> int | None:
+    """Senast behandlade rowid i källan, eller None om steget aldrig körts mot den."""
+    ensure_state(con)
+    row = con.execute(
+        "SELECT last_rowid FROM etl_watermark WHERE stage=? AND source=?",
+        (stage, source)).fetchone()
+    return row[0] if row else None
+
+def set_watermark(con: sqlite3.Connection, stage: str, source: str, last_rowid: int,
+                  last_key: str | None = None) -> None:
+    """
+    Sparar watermark i anroparens transaktion (committas tillsammans med datan).
+    last_key = källradens id vid last_rowid (se checked_watermark); None med
+    oförändrat rowid (inga nya rader lästes) behåller det sparade id:t.
+    """
+    con.execute("""
+        INSERT INTO etl_watermark(stage, source, last_rowid, last_key, updated_at)
+        VALUES (?,?,?,?,?)
+        ON CONFLICT(stage, source) DO UPDATE SET
+            last_key   = CASE WHEN excluded.last_key IS NULL
+                               AND excluded.last_rowid = etl_watermark.last_rowid
+                          THEN etl_watermark.last_key ELSE excluded.last_key END,
+            last_rowid = excluded.last_rowid,
+            updated_at = excluded.updated_at
+    """, (stage, source, last_rowid, last_key, datetime.now().isoformat(timespec="seconds")))
+
+def checked_watermark(con: sqlite3.Connection, src: sqlite3.Connection,
+                      stage: str, source: str, table: str = "hands",
+                      key_col: str = "id") -> int | None:
+    """
+    Som get_watermark, men None om källraden vid watermarket inte längre har
+    samma id (poker.db har raderats/byggts om, även med lika många rader) –
+    då måste steget skanna allt igen. Watermarks utan last_key (äldre
+    versioner) går inte att kontrollera och kastas också.
+    """
+    ensure_state(con)
+    row = con.execute(
+        "SELECT last_rowid, last_key FROM etl_watermark WHERE stage=? AND source=?",
+        (stage, source)).fetchone()
+    if row is None:
+        return None
+    wm, key = row
+    if not wm:
+        return 0
+    if key is None:
+        return None
+    hit = src.execute(f"SELECT {key_col} FROM {table} WHERE rowid=?", (wm,)).fetchone()
+    return wm if hit is not None and str(hit[0]) == key else None
+
+# ────────────────────────────────────────────────────────────────
+# etl_queue
+# ────────────────────────────────────────────────────────────────
+def enqueue_hands(con: sqlite3.Connection, hand_ids: Iterable[str]) -> None:
+    """Lägger nya händer i kön (anroparens transaktion – samma som raderna)."""
+    con.executemany("INSERT INTO etl_queue(hand_id) VALUES (?)", ((h,) for h in hand_ids))
+
+def queue_slice(con: sqlite3.Connection, stage: str, after: Iterable[str] = (),
+                full: bool = False) -> tuple[int | None, int]:
+    """
+    Stegets del av kön: (senast behandlade seq, seq att behandla t.o.m.).
+    Första värdet är None om steget saknar progress eller full=True – då
+    skannar steget allt som förut. Slutet begränsas av progressen för stegen
+    i `after` (0 om de aldrig körts), så ett steg går aldrig förbi data det
+    bygger på.
+    """
+    ensure_state(con)
+    upto = con.execute("SELECT COALESCE(MAX(seq), 0) FROM etl_queue").fetchone()[0]
+    for dep in after:
+        upto = min(upto, get_watermark(con, dep, QUEUE) or 0)
+    done = None if full else get_watermark(con, stage, QUEUE)
+    return done, max(upto, done or 0)
+
+def queue_filter(column: str, done: int | None, upto: int) -> str:
+    """SQL-villkor: column är ett hand_id i kö-delen (seq done+1 … upto); '1' = allt."""
+    if done is None:
+        return "1"
+    return (f"{column} IN (SELECT hand_id FROM etl_queue"
+            f" WHERE seq > {int(done)} AND seq <= {int(upto)})")
+
+def mark_queue(con: sqlite3.Connection, stage: str, upto: int) -> None:
+    """Steget har behandlat kön t.o.m. upto (anroparens transaktion)."""
+    set_watermark(con, stage, QUEUE, upto)
+
+def reset_queue(con: sqlite3.Connection, stage: str) -> None:
+    """Glömmer stegets kö-progress – nästa körning skannar allt (t.ex. efter --reset)."""
+    ensure_state(con)
+    con.execute("DELETE FROM etl_watermark WHERE stage=? AND source=?", (stage, QUEUE))
+
+def prune_queue(con: sqlite3.Connection) -> int:
+    """Tar bort köposter som alla steg med progress redan passerat."""
+    ensure_state(con)
+    return con.execute("""
+        DELETE FROM etl_queue WHERE seq <= (
+            SELECT MIN(last_rowid) FROM etl_watermark WHERE source=?)
+    """, (QUEUE,)).rowcount
@@ -3,7 +3,10 @@
 Gemensam path-hantering för alla processing-scripts.
 Fungerar både lokalt och på Render.com.
 """
+from __future__ import annotations
+import sqlite3
 import sys
+import time
 from pathlib import Path
 
 # Lägg till utils i path
@@ -37,6 +40,69 @@ SQLITE = {
     "OUT": OUT_DB,
 }
 
+# ── Delade SQLite-kopplingar (etl_pipeline.py) ─────────────────────
+# När pipelinen kör alla steg i samma process återanvänds en koppling per
+# databasfil mellan stegen och batcherna. Körs ett script fristående
+# beter sig connect() exakt som sqlite3.connect().
+class SharedConnection(sqlite3.Connection):
+    """Koppling som ägs av pipelinen – close() från ett steg committar bara."""
+    def close(self) -> None:
+        if self.in_transaction:
+            self.commit()
+
+    def close_for_real(self) -> None:
+        super().close()
+
+_SHARED: dict[str, SharedConnection] | None = None
+_DEADLINE: float | None = None
+
+def _past_deadline() -> int:
+    # SQLite avbryter pågående statement ("interrupted") när handlern returnerar != 0
+    return int(_DEADLINE is not None and time.monotonic() > _DEADLINE)
+
+def connect(path, **kwargs) -> sqlite3.Connection:
+    """sqlite3.connect() som delar koppling per fil när pipelinen är aktiv."""
+    if _SHARED is None:
+        return sqlite3.connect(path, **kwargs)
+    key = str(Path(path).expanduser().resolve())
+    con = _SHARED.get(key)
+    if con is None:
+        con = sqlite3.connect(key, factory=SharedConnection, check_same_thread=False)
+        con.set_progress_handler(_past_deadline, 10_000)
+        _SHARED[key] = con
+    con.row_factory = None               # varje steg sätter sin egen
+    return con
+
+def enable_shared_connections() -> None:
+    global _SHARED
+    if _SHARED is None:
+        _SHARED = {}
+
+def shared_connections() -> list[SharedConnection]:
+    return list(_SHARED.values()) if _SHARED else []
+
+def close_shared_connections() -> None:
+    global _SHARED
+    for con in shared_connections():
+        con.close_for_real()
+    _SHARED = None
+
+def set_deadline(seconds: float | None) -> None:
+    """Sätter (eller tar bort) tidsgränsen för pågående steg."""
+    global _DEADLINE
+    _DEADLINE = time.monotonic() + seconds if seconds else None
+
+class StageTimeout(Exception):
+    """Stegets tidsgräns passerades i en Python-loop (check_deadline)."""
+
+def check_deadline() -> None:
+    """
+    Anropas i stegens långa Python-loopar: progress-handlern avbryter bara
+    pågående SQLite-queries. Utan tidsgräns (fristående körning) en no-op.
+    """
+    if _past_deadline():
+        raise StageTimeout("tidsgränsen passerad")
+
 # Debug info
 if __name__ == "__main__":
     print(f"ROOT: {ROOT}")
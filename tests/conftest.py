@@ -0,0 +1,151 @@
+"""
+Gemensamma fixtures för ETL-testerna: stegen laddas som i etl_pipeline.py
+och heavy_analysis.db byggs av några syntetiska 6-max-händer.
+"""
+from __future__ import annotations
+import json
+import random
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+SCRIPTS_DIR = ROOT / "scrape_hh" / "scripts"
+for p in (str(ROOT), str(SCRIPTS_DIR)):
+    if p not in sys.path:
+        sys.path.append(p)
+
+from etl_pipeline import load_stage  # noqa: E402
+from etl_state import ensure_state, enqueue_hands  # noqa: E402
+
+SEATS = ["UTG", "HJ", "CO", "BTN", "SB", "BB"]
+POSTFLOP_ORDER = ["SB", "BB", "UTG", "HJ", "CO", "BTN"]
+PLAYERS = [f"player-{i}" for i in range(12)]
+
+def stage(name: str):
+    """Ett ETL-steg som modul, t.ex. stage('4_action_label')."""
+    return load_stage(SCRIPTS_DIR / f"{name}.py")
+
+def _street(rng: random.Random, street: str, order: list[str]) -> list[tuple[str, str]]:
+    """En gatas (position, token) – slumpad men sammanhängande (x/r/c/f)."""
+    acts, active = [], list(order)
+    facing, raises = street == "preflop", 0
+    i, to_act = 0, len(active)
+    while to_act and len(active) > 1:
+        pos = active[i % len(active)]
+        roll = rng.random()
+        if facing:
+            tok = "f" if roll < 0.35 else "c" if roll < 0.75 or raises >= 4 else "r"
+        else:
+            tok = "x" if roll < 0.6 else "r"
+        acts.append((pos, tok))
+        if tok == "f":
+            active.remove(pos)
+            to_act -= 1
+            continue
+        if tok == "r":
+            facing, raises = True, raises + 1
+            to_act = len(active)
+        i += 1
+        to_act -= 1
+    return acts
+
+def synthetic_hands(n: int, seed: int = 7) -> list[list[tuple[str, str, str]]]:
+    """n händer som listor av (gata, position, token) i action-ordning."""
+    rng = random.Random(seed)
+    hands = []
+    for _ in range(n):
+        rows, seats = [], list(SEATS)
+        for street in ("preflop", "flop", "turn", "river"):
+            order = seats if street == "preflop" else [p for p in POSTFLOP_ORDER if p in seats]
+            acts = _street(rng, street, order)
+            rows += [(street, pos, tok) for pos, tok in acts]
+            seats = [p for p in seats if (p, "f") not in acts]
+            if len(seats) < 2:
+                break
+        hands.append(rows)
+    return hands
+
+def build_heavy_db(path: Path, n_hands: int, seed: int = 7) -> sqlite3.Connection:
+    """heavy_analysis.db med schema från steg 1, syntetiska händer och kö."""
+    rng = random.Random(seed)
+    con = sqlite3.connect(path)
+    stage("1_build_heavy_analysis").ensure(con)
+    ensure_state(con)
+    hand_ids = []
+    for n, rows in enumerate(synthetic_hands(n_hands, seed), 1):
+        hid = f"Hand{1000 + n}"
+        hand_ids.append(hid)
+        names = dict(zip(SEATS, rng.sample(PLAYERS, len(SEATS))))
+        con.execute("INSERT INTO hand_info VALUES (?,?,?,?,?,?,?,?,?,?)",
+                    (hid, "2025-06-05", n, 0, 1, 100, 50, 0, len(SEATS), None))
+        con.executemany("INSERT INTO players VALUES (?,?,?,?,?,?)",
+                        [(hid, pos, names[pos], 10000, "AsKd", rng.choice((-300, -100, 0, 500)))
+                         for pos in SEATS])
+        pot = 150
+        for order, (street, pos, tok) in enumerate(rows):
+            invested = 200 if tok == "r" else 100 if tok == "c" else 0
+            con.execute("""
+                INSERT INTO actions(hand_id, action_order, street, position, player_id,
+                                    nickname, action, amount_to, invested_this_action,
+                                    pot_before, pot_after, holecards, board_cards)
+                VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
+            """, (hid, order, street, pos, names[pos], names[pos] + "_nick", tok,
+                  invested, invested, pot, pot + invested, "AsKd",
+                  "" if street == "preflop" else "QhJh2c"))
+            pot += invested
+    enqueue_hands(con, hand_ids)
+    con.commit()
+    return con
+
+def build_poker_db(path: Path, n_hands: int, seed: int = 7) -> None:
+    """poker.db (hands + partial_scores) med samma syntetiska händer som rå HH-JSON."""
+    rng = random.Random(seed)
+    deck = [r + s for r in "23456789TJQKA" for s in "shdc"]
+    con = sqlite3.connect(path)
+    con.executescript("""
+        CREATE TABLE hands(id TEXT PRIMARY KEY, hand_date TEXT, seq INTEGER, raw_json TEXT);
+        CREATE TABLE partial_scores(id TEXT PRIMARY KEY, json TEXT);
+    """)
+    for n, rows in enumerate(synthetic_hands(n_hands, seed), 1):
+        hid = f"Hand{1000 + n}"
+        cards = rng.sample(deck, 2 * len(SEATS) + 5)
+        boards = {"flop": "".join(cards[-5:-2]), "turn": cards[-2], "river": cards[-1]}
+        positions = {pos: {"name": f"{p}_nick", "stub": p, "stack": 10000,
+                           "hole_cards": cards[2 * i:2 * i + 2],
+                           "money_won": rng.choice((-300, -100, 0, 500))}
+                     for i, (pos, p) in enumerate(zip(SEATS, rng.sample(PLAYERS, len(SEATS))))}
+        situation, breadcrumb, partial, street, size = "", [], {}, "preflop", 100
+        for st, pos, tok in rows:
+            if st != street:
+                street, size = st, 0
+                situation += f"[{boards[st]}]"
+            if tok == "r":
+                size = size * 3 if size else 200
+                tok = f"r{size}"
+            situation += tok
+            if st == "preflop":
+                breadcrumb.append(f"{pos}:10000:{tok}")
+            elif rng.random() < 0.7:
+                partial[situation] = {"action_score": round(rng.random(), 3),
+                                      "decision_difficulty": round(rng.random(), 3)}
+        hand = {"stub": hid, "positions": positions, "situation_string": situation,
+                "breadcrumb": ",".join(breadcrumb), "big_blind_amount": 100,
+                "small_blind_amount": 50, "ante_amount": 0, "is_cash": True,
+                "is_mtt": False, "blinds": "b50b100", "pot_type": "SRP"}
+        con.execute("INSERT INTO hands VALUES (?,?,?,?)",
+                    (hid, "2025-06-05", n, json.dumps(hand)))
+        if partial:
+            con.execute("INSERT INTO partial_scores VALUES (?,?)", (hid, json.dumps(partial)))
+    con.commit()
+    con.close()
+
+@pytest.fixture
+def heavy_db(tmp_path):
+    """Sökväg + öppen koppling till en syntetisk heavy_analysis.db (40 händer)."""
+    path = tmp_path / "heavy_analysis.db"
+    con = build_heavy_db(path, 40)
+    yield path, con
+    con.close()
@@ -0,0 +1,77 @@
+"""
+4_action_label: etiketterna från de kompilerade reglerna (RuleTable + memo)
+ska vara desamma som när action_rules.yml tolkas rakt av, regel för regel.
+"""
+from __future__ import annotations
+import sqlite3
+import sys
+from itertools import groupby
+from typing import Any, Dict, List
+
+from conftest import stage
+
+label = stage("4_action_label")
+
+# ─── referens: YAML-reglerna tolkade rakt av (som innan kompileringen) ───
+def evaluate_conditions(conditions: Dict, context: Dict) -> bool:
+    """Utvärderar när-villkor från YAML."""
+    for key, expected in conditions.items():
+        if key.endswith('_gt'):
+            if context.get(key[:-3], 0) <= expected:
+                return False
+        elif key.endswith('_contains'):
+            if expected not in context.get(key[:-9], []):
+                return False
+        elif context.get(key) != expected:
+            return False
+    return True
+
+def interpret_rules(rules: List[Dict[str, Any]], scope: str, context: Dict) -> str | None:
+    for rule in rules:
+        if not label.rule_in_scope(rule, scope):
+            continue
+        if evaluate_conditions(rule.get('when', {}), context):
+            if 'result' in rule:
+                result = rule['result']
+            elif 'result_template' in rule:
+                result = rule['result_template']
+                for var, value in context.items():
+                    result = result.replace(f"{{{var}}}", str(value))
+            else:
+                continue
+            if result:
+                return result
+    return None
+
+class InterpretedRules:
+    """Samma gränssnitt som RuleTable, utan kompilering och memo."""
+    def __init__(self, rules: List[Dict[str, Any]]):
+        self.rules = rules
+
+    def match(self, key: tuple) -> str | None:
+        return interpret_rules(self.rules, key[0], label.context_from_key(key))
+
+# ─── test ──────────────────────────────────────────────────────────────
+def test_compiled_rules_match_interpreted_yaml(heavy_db, monkeypatch):
+    path, con = heavy_db
+    monkeypatch.setattr(sys, "argv", ["4_action_label.py", "-db", str(path)])
+    label.main()                                   # skriver action_label via RuleTable
+
+    con.row_factory = sqlite3.Row
+    reference = label.ActionTracker()
+    reference.table = InterpretedRules(reference.rules)
+    rows = con.execute("""
+        SELECT rowid, hand_id, street, position, action, action_label, ip_status
+        FROM actions ORDER BY hand_id, action_order
+    """)
+    checked, labels = 0, set()
+    for hid, hand in groupby(rows, key=lambda r: r["hand_id"]):
+        hand = list(hand)
+        for (ref_label, ref_ip, _rid), r in zip(label.process_hand(hand, hid, reference), hand):
+            assert (r["action_label"], r["ip_status"]) == (ref_label, ref_ip), (hid, dict(r))
+            labels.add(ref_label)
+            checked += 1
+
+    assert checked == con.execute("SELECT COUNT(*) FROM actions").fetchone()[0]
+    # Fixturen ska täcka mer än bara passiva drag
+    assert {"call", "fold", "check"} < labels and len(labels) > 6
@@ -0,0 +1,43 @@
+"""
+1_build_heavy_analysis: --workers (ProcessPoolExecutor + writer-tråd) ska
+ge exakt samma heavy_analysis.db som den seriella importen.
+"""
+from __future__ import annotations
+import sqlite3
+import sys
+
+from conftest import build_poker_db, stage
+
+TABLES = {
+    "hand_info": "hand_id",
+    "streets": "hand_id, street",
+    "players": "hand_id, position",
+    "actions": "hand_id, action_order",
+    "postflop_scores": "hand_id, node_string",
+    "etl_queue": "seq",
+}
+
+def import_hands(monkeypatch, src, dst, *extra):
+    monkeypatch.setattr(sys, "argv", ["1_build_heavy_analysis.py",
+                                      "--src", str(src), "--dst", str(dst), *extra])
+    stage("1_build_heavy_analysis").main()
+
+def dump(path):
+    con = sqlite3.connect(path)
+    out = {t: con.execute(f"SELECT * FROM {t} ORDER BY {key}").fetchall()
+           for t, key in TABLES.items()}
+    out["etl_watermark"] = con.execute(
+        "SELECT stage, last_rowid, last_key FROM etl_watermark ORDER BY stage").fetchall()
+    con.close()
+    return out
+
+def test_parallel_import_matches_serial(tmp_path, monkeypatch):
+    src = tmp_path / "poker.db"
+    build_poker_db(src, 450)                      # > 2 PARSE_CHUNK-bitar
+    import_hands(monkeypatch, src, tmp_path / "serial.db")
+    import_hands(monkeypatch, src, tmp_path / "parallel.db", "--workers", "2")
+
+    serial, parallel = dump(tmp_path / "serial.db"), dump(tmp_path / "parallel.db")
+    assert len(serial["hand_info"]) == 450 and serial["postflop_scores"]
+    for table in serial:
+        assert serial[table] == parallel[table], table
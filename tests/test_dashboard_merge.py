@@ -0,0 +1,47 @@
+"""
+8_materialise_dashboard: inkrementella merges ska ge samma räknare som en
+full rebuild – även när en full rebuild körs medan ett beroende ligger efter.
+"""
+from __future__ import annotations
+
+from conftest import stage
+from etl_state import mark_queue
+
+DEPENDENCIES = ("3_size_cat", "4_action_label", "5_add_j_score", "7_input_scores")
+
+def prepare(con):
+    """Kolumnerna som steg 3–7 lägger till (värdena behövs inte här)."""
+    stage("3_size_cat").ensure_cols(con)
+    stage("4_action_label").ensure_cols(con)
+    stage("5_add_j_score").ensure_col(con)
+    stage("7_input_scores").ensure_score_columns(con)
+    con.commit()
+
+def counters(con):
+    return (con.execute("SELECT * FROM dashboard_counters").fetchall(),
+            con.execute("SELECT * FROM player_counters ORDER BY player_id, nickname").fetchall())
+
+def test_full_rebuild_with_lagging_dependency_does_not_double_count(heavy_db):
+    path, con = heavy_db
+    prepare(con)
+    n_hands = con.execute("SELECT COUNT(*) FROM hand_info").fetchone()[0]
+    dash = stage("8_materialise_dashboard")
+
+    # Steg 7 ligger efter (t.ex. timeout i en tidigare batch) när --full körs
+    for dep in DEPENDENCIES:
+        mark_queue(con, dep, n_hands if dep != "7_input_scores" else n_hands // 2)
+    con.commit()
+    db = dash.get_db(path)
+    dash.rebuild_tables(db, full=True)
+    assert db.execute("SELECT total_hands FROM dashboard_summary").fetchone()[0] == n_hands // 2
+
+    # Steg 7 kommer ikapp → resten mergas, inget räknas två gånger
+    mark_queue(db, "7_input_scores", n_hands)
+    db.commit()
+    dash.rebuild_tables(db)
+    assert db.execute("SELECT total_hands FROM dashboard_summary").fetchone()[0] == n_hands
+    incremental = counters(db)
+
+    dash.rebuild_tables(db, full=True)
+    assert counters(db) == incremental
+    db.close()
@@ -0,0 +1,41 @@
+"""
+enrich_actions (steg 3–6 i ett pass) ska ge samma kolumner som de
+fristående stegen 3 → 4 → 5 → 6 körda i tur och ordning.
+"""
+from __future__ import annotations
+import sqlite3
+import sys
+
+from conftest import build_heavy_db, stage
+
+COLUMNS = "size_frac, size_cat, action_label, ip_status, j_score, intention"
+
+def run(monkeypatch, module, *argv):
+    monkeypatch.setattr(sys, "argv", [module.__name__, *argv])
+    module.main()
+
+def enriched(path):
+    con = sqlite3.connect(path)
+    rows = con.execute(f"SELECT hand_id, action_order, {COLUMNS} FROM actions"
+                       " ORDER BY hand_id, action_order").fetchall()
+    con.close()
+    return rows
+
+def test_fused_pass_matches_standalone_stages(tmp_path, monkeypatch):
+    chain, fused = tmp_path / "chain.db", tmp_path / "fused.db"
+    build_heavy_db(chain, 40).close()
+    build_heavy_db(fused, 40).close()
+
+    run(monkeypatch, stage("3_size_cat"), "-db", str(chain))
+    run(monkeypatch, stage("4_action_label"), "-db", str(chain))
+    run(monkeypatch, stage("5_add_j_score"), "-db", str(chain))
+    intention = stage("6_intention")
+    monkeypatch.setattr(intention, "DB_PATH", chain)
+    run(monkeypatch, intention)
+
+    run(monkeypatch, stage("enrich_actions"), "-db", str(fused))
+
+    expected = enriched(chain)
+    assert all(r[4] is not None and r[6] is not None for r in expected)
+    assert any(r[3] not in (None, "unknown") for r in expected)      # size_cat på raises
+    assert enriched(fused) == expected
@@ -0,0 +1,25 @@
+"""
+etl_pipeline: ett steg som fastnar i ren Python (ingen SQL som progress-
+handlern kan avbryta) stoppas av check_deadline() och rapporteras som timeout.
+"""
+from __future__ import annotations
+
+import etl_pipeline
+
+STUCK_STAGE = '''
+from script_paths import check_deadline
+
+def main():
+    while True:
+        check_deadline()
+'''
+
+def test_python_loop_is_stopped_by_deadline(tmp_path):
+    path = tmp_path / "9_stuck.py"
+    path.write_text(STUCK_STAGE)
+    try:
+        res = etl_pipeline.run_stage(path, timeout=0.2)
+    finally:
+        etl_pipeline.script_paths.close_shared_connections()
+    assert not res.ok and res.timed_out
+    assert res.seconds < 5
@@ -0,0 +1,60 @@
+"""
+etl_state: ett watermark mot poker.db får bara återanvändas så länge
+källraden vid watermarket är densamma (samma id på samma rowid), och
+helpers får aldrig committa anroparens transaktion.
+"""
+from __future__ import annotations
+import sqlite3
+
+from etl_state import (QUEUE, checked_watermark, ensure_state, get_watermark, mark_queue,
+                       queue_slice, set_watermark)
+
+SOURCE = "poker.db"
+
+def poker_db(first_id: int, n: int) -> sqlite3.Connection:
+    src = sqlite3.connect(":memory:")
+    src.execute("CREATE TABLE hands(id TEXT PRIMARY KEY, raw_json TEXT)")
+    src.executemany("INSERT INTO hands VALUES (?, '{}')",
+                    [(f"Hand{first_id + i}",) for i in range(n)])
+    return src
+
+def test_watermark_survives_new_rows_but_not_a_rebuilt_source():
+    con = sqlite3.connect(":memory:")
+    ensure_state(con)
+    src = poker_db(1000, 10)
+    set_watermark(con, "stage", SOURCE, 10, "Hand1009")
+    assert checked_watermark(con, src, "stage", SOURCE) == 10
+
+    src.executemany("INSERT INTO hands VALUES (?, '{}')", [("Hand2000",), ("Hand2001",)])
+    assert checked_watermark(con, src, "stage", SOURCE) == 10
+
+    # Ombyggd poker.db med minst lika många rader: samma rowid, annan hand
+    assert checked_watermark(con, poker_db(5000, 12), "stage", SOURCE) is None
+    assert checked_watermark(con, poker_db(1000, 5), "stage", SOURCE) is None
+
+def test_unchanged_rowid_keeps_key_and_old_watermarks_are_discarded():
+    con = sqlite3.connect(":memory:")
+    con.execute("""CREATE TABLE etl_watermark(stage TEXT, source TEXT, last_rowid INTEGER,
+                                              updated_at TEXT, PRIMARY KEY(stage, source))""")
+    con.execute("INSERT INTO etl_watermark VALUES ('stage', ?, 10, NULL)", (SOURCE,))
+    src = poker_db(1000, 10)
+    assert checked_watermark(con, src, "stage", SOURCE) is None   # saknar last_key
+    assert get_watermark(con, "stage", SOURCE) == 10
+
+    set_watermark(con, "stage", SOURCE, 10, "Hand1009")
+    set_watermark(con, "stage", SOURCE, 10)                       # inga nya rader lästes
+    assert checked_watermark(con, src, "stage", SOURCE) == 10
+
+def test_helpers_do_not_commit_the_callers_transaction():
+    con = sqlite3.connect(":memory:")
+    ensure_state(con)
+    con.execute("CREATE TABLE work(x)")
+    con.commit()
+
+    con.execute("INSERT INTO work VALUES (1)")            # halvfärdigt stegarbete
+    queue_slice(con, "stage", after=("other",))
+    checked_watermark(con, poker_db(1000, 1), "stage", SOURCE)
+    mark_queue(con, "stage", 5)
+    con.rollback()
+    assert con.execute("SELECT COUNT(*) FROM work").fetchone()[0] == 0
+    assert get_watermark(con, "stage", QUEUE) is None
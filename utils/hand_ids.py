@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Kanoniska hand-ID:n för alla tabeller
+Hand-ID lagras alltid som "Hand<nummer>" (samma form som API:ets stub),
+så att actions, preflop_scores och postflop_scores kan joinas med ren likhet.
+"""
+from __future__ import annotations
+import sqlite3
+from typing import Iterable
+
+HAND_PREFIX = "Hand"
+
+# Saknar prefixet ⇔ utanför intervallet ['Hand', 'Hane') – kan använda hand_id-index
+NON_CANONICAL = "(hand_id < 'Hand' OR hand_id >= 'Hane') AND hand_id <> ''"
+
+def canonical_hand_id(hand_id: str | None) -> str | None:
+    """'249244191' eller 'Hand249244191' → 'Hand249244191'."""
+    if hand_id and not hand_id.startswith(HAND_PREFIX):
+        return HAND_PREFIX + hand_id
+    return hand_id
+
+def migrate_hand_ids(con: sqlite3.Connection, tables: Iterable[str]) -> int:
+    """
+    Skriver om icke-kanoniska hand_id i tabellerna (i anroparens transaktion).
+    Rader vars kanoniska motsvarighet redan finns tas bort.
+    """
+    fixed = 0
+    for table in tables:
+        if con.execute(f"SELECT 1 FROM {table} WHERE {NON_CANONICAL} LIMIT 1").fetchone() is None:
+            continue
+        fixed += con.execute(
+            f"UPDATE OR IGNORE {table} SET hand_id = '{HAND_PREFIX}' || hand_id "
+            f"WHERE {NON_CANONICAL}").rowcount
+        con.execute(f"DELETE FROM {table} WHERE {NON_CANONICAL}")
+    return fixed